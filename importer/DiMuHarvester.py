@@ -8,7 +8,11 @@ usage:
 
 &params;
 """
+import collections
+import itertools
 import os
+import threading
+from concurrent import futures
 
 import requests
 
@@ -17,24 +21,85 @@ import pywikibot
 import batchupload.common as common
 import batchupload.helpers as helpers
 
+try:
+    import importer.artifact_cache as artifact_cache
+    import importer.delta_harvest as delta_harvest
+    import importer.exhibition_store as exhibition_store
+    import importer.harvest_io as harvest_io
+    import importer.harvest_journal as harvest_journal
+    import importer.harvest_log as harvest_log
+    import importer.harvest_pipeline as harvest_pipeline
+    import importer.harvest_shards as harvest_shards
+    import importer.harvest_stats as harvest_stats
+    import importer.http_client as http_client
+except ImportError:  # run as a script from within the importer directory
+    import artifact_cache
+    import delta_harvest
+    import exhibition_store
+    import harvest_io
+    import harvest_journal
+    import harvest_log
+    import harvest_pipeline
+    import harvest_shards
+    import harvest_stats
+    import http_client
+
+API_URL = 'http://api.dimu.org'
 SETTINGS_DIR = "settings"
 CACHE_DIR = "cache"
 SETTINGS = "settings.json"
 LOGFILE = 'dimu_harvest.log'
 HARVEST_FILE = 'dimu_harvest_data.json'
+EXHIBITION_FILE = 'dimu_exhibitions.json'
+SEARCH_ROWS = 100
+SUPPORTED_TYPES = ('Photograph', 'Thing', 'Fineart')
+# the only fields of object search hits which are used by the harvester
+UPDATED_FIELD = 'artifact.updatedDate'  # last modified timestamp in search
+SEARCH_FIELDS = ('artifact.uuid', 'artifact.type', 'artifact.hasPictures',
+                 UPDATED_FIELD)
 
 DEFAULT_OPTIONS = {
     'settings_file': os.path.join(SETTINGS_DIR, SETTINGS),
     'api_key': 'demo',
     'glam_code': None,
     'all_slides': False,
+    'resume': False,
     'harvest_log_file': LOGFILE,
+    'log_backend': 'plain',
+    'log_json_file': None,
     'harvest_file': HARVEST_FILE,
+    'normalise': False,
     'verbose': False,
     'cutoff': None,
     'folder_id': None,
-    'cache': False
+    'shard': None,
+    'cache': False,
+    'cache_ttl': None,
+    'cache_backend': 'directory',
+    'cache_path': None,
+    'cache_compress': False,
+    'delta': None,
+    'exhibition_file': EXHIBITION_FILE,
+    'exhibition_ttl': None,
+    'workers': 1,
+    'page_workers': 1,
+    'rows': SEARCH_ROWS,
+    'engine': 'sync',
+    'parse_workers': None,
+    'queue_size': harvest_pipeline.DEFAULT_QUEUE_SIZE,
+    'api_url': API_URL,
+    'pool_size': http_client.DEFAULT_POOL_SIZE,
+    'timeout': http_client.DEFAULT_TIMEOUT,
+    'retries': http_client.DEFAULT_RETRIES,
+    'backoff': http_client.DEFAULT_BACKOFF,
+    'rate': None
 }
+# options given as numbers, for which 0 is a valid setting
+INT_OPTIONS = ('cutoff', 'workers', 'rows', 'page_workers',
+               'parse_workers', 'queue_size', 'pool_size', 'retries')
+FLOAT_OPTIONS = ('timeout', 'backoff', 'cache_ttl', 'exhibition_ttl', 'rate')
+# options given as booleans, for which a bare flag means True
+BOOL_OPTIONS = ('resume', 'cache', 'cache_compress', 'normalise')
 PARAMETER_HELP = u"""\
 Basic DiMuHarvester options (can also be supplied via the settings file):
 -settings_file:PATH    path to settings file (DEF: {settings_file})
@@ -42,22 +107,85 @@ Basic DiMuHarvester options (can also be supplied via the settings file):
 -glam_code:STR         DiMu code for the institution, e.g. "S-NM" \
 (DEF: {glam_code})
 -harvest_log_file:PATH path to log file (DEF: {harvest_log_file})
--harvest_file:PATH     path to harvest file (DEF: {harvest_file})
+-log_backend:STR       how to write the log, either "plain" (every line as \
+it is logged) or "buffered" (in batches on a background thread) \
+(DEF: {log_backend})
+-log_json_file:PATH    path to a JSON Lines file to also write every log \
+record to, with its uuid and stage. Uses the buffered backend \
+(DEF: {log_json_file})
+-harvest_file:PATH     path to harvest file. If it ends in ".jsonl" the \
+entries are streamed to disk as they are harvested, using the JSON Lines \
+format, rather than kept in memory (DEF: {harvest_file})
+-normalise:BOOL        whether to store the data shared by all images of an \
+object only once per object in the harvest file (DEF: {normalise})
 -verbose:BOOL          if verbose output is desired (DEF: {verbose})
 -cutoff:INT            if run should be terminated after these many hits. \
 All are processed if not present (DEF: {cutoff})
 -folder_id:STR         unique id (12 digits) or uuid (8-4-4-4-12 hexadecimal \
-digits) of the Digitalt Museum folder used (DEF: {folder_id})
+digits) of the Digitalt Museum folder used. Several comma separated folders \
+may be given, in which case objects found in more than one of them are only \
+harvested once (DEF: {folder_id})
+-shard:STR             only harvest the objects in shard "i/N", where \
+0 <= i < N, of the folders. The shard is added to the names of the harvest \
+file, the log and the cache, see harvest_shards.py (DEF: {shard})
 - all_slides           whether to harvest all slides of multiple-slide \
 objects or only the first one (DEF: {all_slides})
-- cache                whether to get data from local cache instead of DM \
-(DEF: {cache})
+- resume               whether to continue an interrupted harvest from the \
+journal kept next to the harvest file (DEF: {resume})
+- cache                whether to serve all cached objects from the local \
+cache instead of revalidating them against DM (DEF: {cache})
+-cache_ttl:INT         seconds for which cached objects are served without \
+revalidation, overrides -cache. Missing objects are always fetched \
+(DEF: {cache_ttl})
+-cache_backend:STR     how to store the local cache, either "directory" \
+(one json file per object) or "sqlite" (a single database file) \
+(DEF: {cache_backend})
+-cache_path:PATH       path to the cache directory or database file \
+(DEF: "{cache_dir}" or "{sqlite_file}" depending on the backend)
+-cache_compress:BOOL   whether to compress objects in a sqlite cache \
+(DEF: {cache_compress})
+-delta:PATH            path to an earlier harvest file. Only objects which \
+are new or have changed since then are fetched and parsed, the others are \
+copied from the earlier harvest (DEF: {delta})
+-exhibition_file:PATH  path to the file in which the DiMu codes of \
+exhibitions are kept between runs (DEF: {exhibition_file})
+-exhibition_ttl:INT    seconds after which a stored exhibition code is \
+looked up again. Never if not present (DEF: {exhibition_ttl})
+-workers:INT           number of objects to fetch and parse in parallel \
+(DEF: {workers})
+-rows:INT              number of hits per search result page \
+(DEF: {rows})
+-page_workers:INT      number of search result pages to request in \
+parallel (DEF: {page_workers})
+-engine:STR            harvest engine to use, either "sync" (optionally \
+using -workers) or "pipeline", which fetches objects using -workers threads \
+and parses them using -parse_workers processes (DEF: {engine})
+-parse_workers:INT     number of processes parsing objects for the pipeline \
+engine. The number of cpus if not present (DEF: {parse_workers})
+-queue_size:INT        max number of objects fetched but not yet stored by \
+the pipeline engine (DEF: {queue_size})
+-api_url:URL           base url of the DiMu API, e.g. for a local stand-in \
+(DEF: {api_url})
+-pool_size:INT         max number of kept-alive connections per host \
+(DEF: {pool_size})
+-timeout:FLOAT         seconds to wait for a response from DiMu \
+(DEF: {timeout})
+-retries:INT           max number of retries on connection problems or \
+transient server errors (DEF: {retries})
+-backoff:FLOAT         backoff factor, in seconds, between retries \
+(DEF: {backoff})
+-rate:FLOAT            max requests per second to each host. In the \
+settings file this may also be a dict of host name to rate. The number of \
+requests in flight to each host is adjusted automatically, up to pool_size \
+(DEF: {rate})
 
 Can also handle any pywikibot options. Most importantly:
 -simulate              don't write to database
 -help                  output all available options
 """
-docuReplacements = {'&params;': PARAMETER_HELP.format(**DEFAULT_OPTIONS)}
+HELP_DEFAULTS = dict(DEFAULT_OPTIONS, cache_dir=CACHE_DIR,
+                     sqlite_file=artifact_cache.SQLITE_FILE)
+docuReplacements = {'&params;': PARAMETER_HELP.format(**HELP_DEFAULTS)}
 
 # @todo: consider merging copyright and default_copyright into one tag
 
@@ -67,44 +195,230 @@ class DiMuHarvester(object):
 
     def __init__(self, options):
         """Initialise a harvester object for a DigitaltMuseum harvest."""
-        if not os.path.exists(CACHE_DIR):
-            os.makedirs(CACHE_DIR)  # Create directory for cache if needed
-        self.data = {}  # data container for harvested info
-        self.settings = options
-        self.log = common.LogFile('', self.settings.get('harvest_log_file'))
+        self.init_parsing(options)
+        try:
+            # only objects in this shard are harvested, all if None
+            self.shard = harvest_shards.parse_shard(self.settings.get('shard'))
+        except ValueError as e:
+            raise pywikibot.Error(str(e))
+        self.cache = artifact_cache.ArtifactCache(
+            self.make_cache_store(), self.cache_ttl(), self.stats)
+        if self.settings.get('delta'):
+            self.delta = delta_harvest.DeltaHarvest.from_file(
+                self.settings.get('delta'))
+        if self.settings.get('harvest_file'):
+            self.make_journal()
+        http_client.configure(
+            pool_size=max(
+                self.settings.get('pool_size')
+                or http_client.DEFAULT_POOL_SIZE,
+                self.max_parallel_requests()),
+            timeout=self.settings.get('timeout'),
+            retries=self.settings.get('retries'),
+            backoff=self.settings.get('backoff'),
+            rate=self.settings.get('rate'))
+        self.log = self.make_log()
         self.log.write_w_timestamp('Harvester started...')
-        self.exhibition_cache = {}  # cache for exhibition dimu-code, as it's
-        # not present in object entry, but it's needed if we want to link
-        # to the exhibition from Commons
+        # store of exhibition dimu-codes, as these are not present in the
+        # object entry, but are needed if we want to link to the exhibition
+        # from Commons
+        self.exhibitions = exhibition_store.ExhibitionStore(
+            self.settings.get('exhibition_file') or EXHIBITION_FILE,
+            self.fetch_exhibition_code, self.settings.get('exhibition_ttl'))
+
+    def init_parsing(self, options):
+        """
+        Set up the state needed to parse and store objects.
+
+        Also used by the harvesters which only parse, see harvest_replay.
+
+        :param options: the harvester settings
+        """
+        self.settings = options
+        self.stats = harvest_stats.HarvestStats()  # stage timings and counts
+        # unhandled keys found in the objects, reported at the end of the run
+        self.unknown_keys = harvest_stats.UnknownKeys()
+        self.data = self.make_data_container()  # for harvested info
+        self.search_stamps = {}  # last modified timestamps from the search
+        # uuids of the folders in which each object was found
+        self.object_folders = collections.OrderedDict()
+        self.delta = None  # earlier harvest when doing a delta harvest
+        self.journal = None  # progress journal, see make_journal
+        self._local = threading.local()  # per-thread state, see active_uuid
+
+    def make_log(self):
+        """Open the harvest log using the log settings."""
+        return harvest_log.make_log(
+            self.settings.get('harvest_log_file'),
+            self.settings.get('log_backend'),
+            self.settings.get('log_json_file'))
+
+    def make_cache_store(self):
+        """Create the store for the local cache using the cache settings."""
+        backend = self.settings.get('cache_backend') or 'directory'
+        path = self.settings.get('cache_path')
+        if backend == 'directory':
+            path = path or CACHE_DIR
+        try:
+            return artifact_cache.make_store(
+                backend, path, self.settings.get('cache_compress'))
+        except ValueError as e:
+            raise pywikibot.Error(str(e))
+
+    def make_data_container(self):
+        """
+        Create the container for the harvested entries.
+
+        This is a dict unless the harvest file uses the JSON Lines format, in
+        which case entries are streamed to disk instead.
+        """
+        harvest_file = self.settings.get('harvest_file')
+        if harvest_io.is_jsonl(harvest_file):
+            return harvest_io.JsonlHarvestWriter(harvest_file)
+        return {}
+
+    def make_journal(self):
+        """
+        Open the journal of the harvest progress.
+
+        When resuming, the entries of all objects finished by the earlier
+        run are read from the journal.
+        """
+        self.journal = harvest_journal.HarvestJournal(
+            self.settings.get('harvest_file') + harvest_journal.SUFFIX,
+            resume=self.settings.get('resume'))
+        if self.journal.processed:
+            for uuid, records in self.journal.iter_records():
+                self.data.update(records)
+            for folder_uuid, uuids in self.journal.folders.items():
+                self.add_to_folder(folder_uuid, uuids)
+            pywikibot.output(
+                'Resuming harvest with {0} processed objects'.format(
+                    len(self.journal.processed)))
+
+    def cache_ttl(self):
+        """
+        Return the time-to-live for cached objects.
+
+        Without an explicit cache_ttl cached objects are always revalidated
+        unless the cache setting is used, in which case they never expire.
+        """
+        if self.settings.get('cache_ttl') is not None:
+            return self.settings.get('cache_ttl')
+        return None if self.settings.get('cache') else 0
+
+    def max_parallel_requests(self):
+        """Return the max number of requests the harvester may run at once."""
+        page_workers = self.settings.get('page_workers') or 1
+        return page_workers + (self.settings.get('workers') or 1)
+
+    def load_folders(self, idnos):
+        """
+        Process several collections/folders.
+
+        Objects found in more than one of the folders are only processed
+        once.
+
+        :param idnos: list of uuids or uniqueIds for the folders
+        """
+        for idno in idnos:
+            self.load_folder(idno)
+
+    def load_folder(self, idno):
+        """
+        Process the collection/folder using the configured harvest engine.
+
+        :param idno: either the uuid or uniqueId for the folder
+        """
+        engine = self.settings.get('engine') or 'sync'
+        if engine == 'pipeline':
+            harvest_pipeline.PipelineHarvestEngine(
+                self, self.settings.get('workers'),
+                self.settings.get('parse_workers'),
+                self.settings.get('queue_size')).load_collection(idno)
+        elif engine == 'sync':
+            self.load_collection(idno)
+        else:
+            raise pywikibot.Error(
+                'Unknown harvest engine "{}"'.format(engine))
+
+    @property
+    def api_url(self):
+        """The base url of the DiMu API."""
+        return self.settings.get('api_url') or API_URL
+
+    @property
+    def active_uuid(self):
+        """The uuid of the object being parsed by the current thread."""
+        return getattr(self._local, 'active_uuid', None)
+
+    @active_uuid.setter
+    def active_uuid(self, value):
+        self._local.active_uuid = value
 
     def sort_data(self, sorting_key):
         """Sort downloaded data by selected key."""
         sorted_data = {}
         sorted_keys = sorted(
-            self.data.keys(), key=lambda y: (self.data[y][sorting_key]))
+            self.data.keys(),
+            key=lambda y: harvest_io.as_sort_key(self.data[y][sorting_key]))
         for key in sorted_keys:
             sorted_data[key] = self.data[key]
         return sorted_data
 
+    def add_folders(self, key, image_data):
+        """
+        Add the folders in which the object was found to an image entry.
+
+        Entries from a harvest not based on folders are left untouched.
+
+        :param key: the harvest key of the image
+        :param image_data: the harvest entry of the image
+        :return: the updated entry
+        """
+        if self.object_folders:
+            image_data['folders'] = self.object_folders.get(
+                harvest_io.object_uuid(key), [])
+        return image_data
+
     def save_data(self, filename=None):
-        """Dump data as json blob."""
-        filename = filename or self.settings.get('harvest_file')
+        """Dump data as json blob, or as JSON Lines when streaming."""
+        with self.stats.timer('save'):
+            self.write_data(filename or self.settings.get('harvest_file'))
+
+    def write_data(self, filename):
+        """Write the harvest file, see save_data."""
+        if isinstance(self.data, harvest_io.JsonlHarvestWriter):
+            self.data.save(
+                lambda entry: entry.get('glam_id'), filename=filename,
+                transform=self.add_folders,
+                normalised=self.settings.get('normalise'))
+            pywikibot.output('{0} created'.format(filename))
+            return
+        for key, image_data in self.data.items():
+            self.add_folders(key, image_data)
         sorted_data = self.sort_data('glam_id')
+        if self.settings.get('normalise'):
+            sorted_data = harvest_io.normalise_data(sorted_data)
         common.open_and_write_file(filename, sorted_data, as_json=True)
         pywikibot.output('{0} created'.format(filename))
 
-    def get_search_record_from_url(self, query, only_folder=False, start=None):
+    def get_search_record_from_url(self, query, only_folder=False, start=None,
+                                   only_objects=False):
         """
         Perform search on DiMu api and return the response.
 
         :param query: the required search term, e.g. an uuid
         :param only_folder: filter out any non-folders
         :param start: starting value of result pager. Default: 0
+        :param only_objects: filter out anything but objects of a supported
+            type which have images, and only return the fields needed to
+            process them
         """
-        base_url = 'http://api.dimu.org/api/solr/select'
+        base_url = '{}/api/solr/select'.format(self.api_url)
         payload = {
             'wt': 'json',
-            'rows': 100,
+            'rows': self.settings.get('rows') or SEARCH_ROWS,
             'api.key': self.settings.get('api_key'),
             'start': start or 0,
             'q': query
@@ -116,9 +430,16 @@ class DiMuHarvester(object):
         if only_folder:
             payload['fq'] = payload.get('fq') or []
             payload['fq'].append('artifact.type:Folder')
+        if only_objects:
+            payload['fq'] = payload.get('fq') or []
+            payload['fq'].append('artifact.type:({})'.format(
+                ' OR '.join(SUPPORTED_TYPES)))
+            payload['fq'].append('artifact.hasPictures:true')
+            payload['fl'] = ','.join(SEARCH_FIELDS)
 
         try:
-            data = get_json_from_url(base_url, payload)
+            with self.stats.timer('search_page'):
+                data = get_json_from_url(base_url, payload)
         except requests.HTTPError as e:
             # Note that DiMu might have redirected the url
             error_message = 'Error when trying to look up {0}: {1}'.format(
@@ -127,7 +448,7 @@ class DiMuHarvester(object):
                 # a 404 is returned if the api key is incorrect
                 error_message = 'Api key not accepted by DiMu API'
 
-            self.log.write(error_message)
+            self.write_log(error_message, 'search')
             raise pywikibot.Error(error_message)
 
         return data.get('response')
@@ -138,44 +459,163 @@ class DiMuHarvester(object):
 
         :param idno: either the uuid or uniqueId for the folder
         """
+        for offset, uuids in self.iter_collection_pages(idno):
+            self.process_objects(
+                self.add_to_folder(self.folder_uuid, uuids))
+            self.record_page(offset, uuids)
+
+    def add_to_folder(self, folder_uuid, uuids):
+        """
+        Record that objects were found in a folder.
+
+        :param folder_uuid: the uuid of the folder
+        :param uuids: list of object uuids
+        :return: list of the objects not already found in an earlier folder
+        """
+        new_uuids = []
+        for uuid in uuids:
+            if uuid not in self.object_folders:
+                self.object_folders[uuid] = []
+                new_uuids.append(uuid)
+            if folder_uuid not in self.object_folders[uuid]:
+                self.object_folders[uuid].append(folder_uuid)
+        return new_uuids
+
+    def resume_offset(self, folder_uuid):
+        """Return the search offset from which to start harvesting a folder."""
+        return self.journal.offset(folder_uuid) if self.journal else 0
+
+    def record_page(self, offset, uuids):
+        """Journal that all objects on a page of the folder are processed."""
+        if self.journal:
+            self.journal.record_page(self.folder_uuid, offset, uuids)
+
+    def iter_collection(self, idno):
+        """
+        Yield the uuids of the objects to process in a collection/folder.
+
+        The uuids are yielded as one list per page of search results, see
+        iter_collection_pages.
+
+        :param idno: either the uuid or uniqueId for the folder
+        """
+        for offset, uuids in self.iter_collection_pages(idno, start=0):
+            yield uuids
+
+    def iter_collection_pages(self, idno, start=None):
+        """
+        Yield the pages of objects to process in a collection/folder.
+
+        The uuids are yielded as one list per page of search results,
+        together with the search offset following the page. Once the number
+        of hits is known all remaining pages are requested, using up to
+        page_workers parallel requests, and are yielded in order as they
+        arrive.
+
+        :param idno: either the uuid or uniqueId for the folder
+        :param start: search offset at which to start, defaults to where the
+            journal says an earlier run of the harvest stopped
+        :return: iterator of (offset, list of uuids) tuples
+        """
         self.folder_uuid = self.load_collection_object(idno)
+        if start is None:
+            start = self.resume_offset(self.folder_uuid)
+        query = 'artifact.folderUids:{}'.format(self.folder_uuid)
 
         search_data = self.get_search_record_from_url(
-            query='artifact.folderUids:{}'.format(self.folder_uuid))
+            query=query, start=start, only_objects=True)
         total_results = search_data.get('numFound')
-        start = 0
-        self.verbose_output('Found {} results'.format(total_results))
+        self.verbose_output('Found {} results'.format(total_results),
+                            stage='search')
 
-        num_hits = len(search_data.get('docs'))
+        # allow a run to be interupted after a given number of entries
         cutoff = self.settings.get('cutoff')
-        stop = False
-        while(not stop and num_hits > 0):
-            # allow a run to be interupted after a given number of entries
-            if cutoff and (start + num_hits) >= cutoff:
-                diff = start + num_hits - cutoff
-                search_data['docs'] = search_data.get('docs')[diff:]
-                stop = True
-
-            for item in search_data.get('docs'):
-                item_type = item.get('artifact.type')
-                if item_type == 'Folder':
+        last = min(total_results, cutoff) if cutoff else total_results
+        first_docs = search_data.get('docs')
+        offsets = range(start + (len(first_docs) or last), last,
+                        len(first_docs) or 1)
+
+        # docs may move between pages if the folder changes during the run
+        seen = set()
+        remaining = last - start
+        offset = start
+        pages = self.iter_search_pages(query, offsets)
+        for docs in itertools.chain([first_docs], pages):
+            offset += len(docs)
+            docs = [doc for doc in docs
+                    if doc.get('artifact.uuid') not in seen][:remaining]
+            seen.update(doc.get('artifact.uuid') for doc in docs)
+            remaining -= len(docs)
+            yield offset, self.filter_search_docs(docs)
+            if remaining <= 0:
+                pages.close()
+                break
+
+    def iter_search_pages(self, query, offsets):
+        """
+        Yield the docs of the search result pages at the given offsets.
+
+        Up to page_workers pages are requested in parallel but the docs are
+        always yielded in the order of the offsets.
+
+        :param query: the search query
+        :param offsets: iterable of start values for the result pager
+        """
+        workers = self.settings.get('page_workers') or 1
+        if workers <= 1:
+            for start in offsets:
+                yield self.get_search_record_from_url(
+                    query=query, start=start, only_objects=True).get('docs')
+            return
+
+        pending = collections.deque()
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for start in offsets:
+                    pending.append(executor.submit(
+                        self.get_search_record_from_url,
+                        query=query, start=start, only_objects=True))
+                    if len(pending) >= 2 * workers:
+                        yield pending.popleft().result().get('docs')
+                while pending:
+                    yield pending.popleft().result().get('docs')
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def filter_search_docs(self, docs):
+        """
+        Return the uuids of the search hits which should be processed.
+
+        Hits in other shards than that of the harvester are skipped.
+
+        :param docs: the docs of a search result page
+        :return: list of uuids
+        """
+        uuids = []
+        for item in docs:
+            item_type = item.get('artifact.type')
+            if item_type == 'Folder':
+                continue
+            elif item_type in SUPPORTED_TYPES:
+                if self.shard and not harvest_shards.in_shard(
+                        item.get('artifact.uuid'), self.shard):
+                    self.stats.count('other_shards')
                     continue
-                elif item_type in ['Photograph', 'Thing', 'Fineart']:
-                    # skip items without images
-                    self.log.write(item.get('artifact.uuid'))
-                    if not item.get('artifact.hasPictures'):
-                        continue
-                    self.process_single_object(item.get('artifact.uuid'))
-                else:
-                    pywikibot.warning(
-                        '{uuid}: The artifact type {type} is not yet '
-                        'supported. Skipping!'.format(
-                            uuid=item.get('artifact.uuid'), type=item_type))
-            if not stop:
-                start += num_hits
-                search_data = self.get_search_record_from_url(
-                    query=self.folder_uuid, start=start)
-                num_hits = len(search_data.get('docs'))
+                # skip items without images
+                self.write_log(item.get('artifact.uuid'), 'search',
+                               item.get('artifact.uuid'))
+                if not item.get('artifact.hasPictures'):
+                    continue
+                uuids.append(item.get('artifact.uuid'))
+                self.search_stamps[item.get('artifact.uuid')] = item.get(
+                    UPDATED_FIELD)
+            else:
+                pywikibot.warning(
+                    '{uuid}: The artifact type {type} is not yet '
+                    'supported. Skipping!'.format(
+                        uuid=item.get('artifact.uuid'), type=item_type))
+        return uuids
 
     def load_collection_object(self, idno):
         """
@@ -195,7 +635,7 @@ class DiMuHarvester(object):
 
         folder = search_data.get('docs')[0]
         self.verbose_output('working on the folder: {}'.format(
-            folder.get('artifact.ingress.title')))
+            folder.get('artifact.ingress.title')), stage='search')
         return folder.get('artifact.uuid')
 
     def process_single_object(self, item_uuid):
@@ -209,10 +649,145 @@ class DiMuHarvester(object):
 
         :param item_uuid: the uuid of the item
         """
+        data, parsed_data = self.fetch_and_parse_object(item_uuid)
+        self.store_object(item_uuid, data, parsed_data)
+
+    def process_objects(self, uuids):
+        """
+        Process the data for a list of objects.
+
+        All objects are fetched first, after which any unknown exhibitions
+        of theirs are looked up together, see ExhibitionStore.prefetch. If
+        more than one worker is configured the objects and exhibitions are
+        fetched in parallel. The objects are always parsed and stored in the
+        order given so that the result is the same as for a serial run.
+
+        Objects already processed according to the journal, or unchanged
+        objects in a delta harvest, are reused instead.
+
+        :param uuids: list of item uuids, e.g. those on a search result page
+        """
+        reused = self.find_reusable(uuids)
+        to_fetch = [uuid for uuid in uuids if uuid not in reused]
+        workers = self.settings.get('workers') or 1
+        if workers <= 1:
+            raw_data = list(map(self.load_single_object, to_fetch))
+        else:
+            with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                raw_data = list(
+                    executor.map(self.load_single_object, to_fetch))
+
+        self.exhibitions.prefetch(
+            exhibition_store.exhibition_uuids(raw_data), workers)
+        self.store_results(uuids, reused, self.parse_objects(raw_data))
+
+    def parse_objects(self, raw_data):
+        """
+        Parse the loaded objects one at a time.
+
+        :param raw_data: list of raw object data, None for failed objects
+        :return: iterator of tuples of the raw and the parsed data, as for
+            fetch_and_parse_object
+        """
+        for data in raw_data:
+            if data is None:
+                yield None, None
+            else:
+                yield data, self.timed_parse(data)
+
+    def store_results(self, uuids, reused, results):
+        """
+        Store the processed objects in the order given.
+
+        Each stored object is also written to the journal. Objects found in
+        the journal were already stored when it was read, see make_journal.
+
+        :param uuids: list of item uuids
+        :param reused: set of uuids found in the journal or to copy from the
+            earlier harvest
+        :param results: iterator of tuples of the raw and the parsed data
+            (see fetch_and_parse_object) for the uuids which are not
+            reused, in the same order
+        """
+        for uuid in uuids:
+            self.stats.count('objects')
+            if uuid in reused:
+                self.stats.count('reused_objects')
+                if self.journal and self.journal.has(uuid):
+                    continue
+                stored = self.store_reused(uuid)
+            else:
+                data, parsed_data = next(results)
+                if data is None:
+                    self.stats.count('failed_objects')
+                    continue  # not journaled, so that it is retried
+                stored = self.store_object(uuid, data, parsed_data)
+            if self.journal:
+                self.journal.record_object(uuid, stored)
+
+    def find_reusable(self, uuids):
+        """
+        Return the objects which need not be fetched and parsed.
+
+        These are the objects already processed according to the journal
+        and, in a delta harvest, those unchanged since the earlier harvest.
+
+        :param uuids: list of item uuids
+        :return: set of uuids
+        """
+        reusable = set()
+        for uuid in uuids:
+            if self.journal and self.journal.has(uuid):
+                reusable.add(uuid)
+            elif self.delta and self.delta.check(
+                    uuid, self.search_stamps.get(uuid)):
+                reusable.add(uuid)
+        return reusable
+
+    def store_reused(self, item_uuid):
+        """
+        Copy the entries for an object from the earlier harvest.
+
+        :return: dict of the stored entries
+        """
+        stored = collections.OrderedDict(self.delta.reuse(item_uuid))
+        self.data.update(stored)
+        return stored
+
+    def fetch_and_parse_object(self, item_uuid):
+        """
+        Load and parse the data for a single object.
+
+        Does not modify self.data so it is safe to call from worker threads.
+
+        :param item_uuid: the uuid of the item
+        :return: tuple of the raw and the parsed data, both None on failure
+        """
         data = self.load_single_object(item_uuid)
+        if data is None:
+            # the failure has already been logged by load_single_object
+            return None, None
+        return data, self.timed_parse(data)
+
+    def timed_parse(self, raw_data):
+        """Parse the json for a single object, timing it in the stats."""
+        with self.stats.timer('parse'):
+            return self.parse_single_object(raw_data)
+
+    def store_object(self, item_uuid, data, parsed_data):
+        """
+        Store one entry per image of a parsed object in self.data.
+
+        :param item_uuid: the uuid of the item
+        :param data: the raw data for the item
+        :param parsed_data: the output of parse_single_object for the item
+        :return: dict of the stored entries
+        """
+        stored = collections.OrderedDict()
+        if data is None:
+            return stored
         process_all = self.settings.get("all_slides")
 
-        parsed_data = self.parse_single_object(data)
         all_image_keys = set([
             '{item}_{image}'.format(item=item_uuid, image=image.get('index'))
             for image in data.get('media').get('pictures')])
@@ -222,6 +797,9 @@ class DiMuHarvester(object):
         else:
             slides_to_work_on = [data.get('media').get('pictures')[0]]
 
+        # kept with the entries so that a later delta harvest can compare it
+        updated = self.search_stamps.get(item_uuid)
+
         for order, image in enumerate(slides_to_work_on):
             key = '{item}_{image}'.format(
                 item=item_uuid, image=image.get('index'))
@@ -232,32 +810,33 @@ class DiMuHarvester(object):
 
             image_data = self.make_image_object(
                 image, order, parsed_data, other_keys)
+            if updated is not None:
+                image_data[delta_harvest.UPDATED_KEY] = updated
             if (image_data.get('copyright')
                     or image_data.get('default_copyright')):
                 self.data[key] = image_data
+                stored[key] = image_data
             else:
-                self.log.write('{}: had no license info. Skipping.'.format(
-                    key))
+                self.write_log(
+                    '{}: had no license info. Skipping.'.format(key),
+                    'license', self.active_uuid)
+        return stored
 
     def load_single_object(self, uuid):
         """
-        Load the data for a single object.
+        Load the data for a single object, from the local cache if possible.
 
         :param uuid: the uuid for the item
         """
-        url = 'http://api.dimu.org/artifact/uuid/{}'.format(uuid)
+        url = '{0}/artifact/uuid/{1}'.format(self.api_url, uuid)
 
         try:
-            filepath = os.path.join(CACHE_DIR, uuid + ".json")
-            if self.settings["cache"]:
-                print("Loading {} from local cache".format(uuid))
-                data = common.open_and_read_file(filepath, as_json=True)
-            else:
-                data = get_json_from_url(url)
-                common.open_and_write_file(filepath, data, as_json=True)
+            with self.stats.timer('object_load'):
+                data = self.cache.load(
+                    uuid, url, self.search_stamps.get(uuid))
         except requests.HTTPError as e:
             error_message = '{0}: {1}'.format(e, url)
-            self.log.write(error_message)
+            self.write_log(error_message, 'load', uuid)
             return None
 
         return data
@@ -376,9 +955,10 @@ class DiMuHarvester(object):
                 if subject.get('nameType') == "subject":
                     subjects.add(subject.get('name'))
                 else:
-                    self.log.write(
+                    self.write_log(
                         '{}: had an unexpected subject name type "{}".'.format(
-                            self.active_uuid, subject.get('nameType')))
+                            self.active_uuid, subject.get('nameType')),
+                        'parse', self.active_uuid)
         new_subjects = data.get("subjects") + list(subjects)
         data['subjects'] = new_subjects
 
@@ -415,10 +995,11 @@ class DiMuHarvester(object):
                         found_roles[place_role] = DiMuHarvester.merge_place(
                             found_roles[place_role], place)
                     except pywikibot.Error:
-                        self.log.write(
+                        self.write_log(
                             '{}: encountered multiple conflicting places with '
                             'the "{}" role, skipping the later.'.format(
-                                self.active_uuid, place_role))
+                                self.active_uuid, place_role),
+                            'parse', self.active_uuid)
                         continue
 
                 found_roles[place_role] = place
@@ -434,10 +1015,9 @@ class DiMuHarvester(object):
                 self.parse_person(person)
                 for person in motif_data.get('depictedPersons')]
 
-        if any(k not in known_keys for k in motif_data.keys()):
-            self.log.write(
-                '{}: encountered an unexpected motif key in: {}'.format(
-                    self.active_uuid, ', '.join(motif_data.keys())))
+        for key in motif_data.keys():
+            if key not in known_keys:
+                self.unknown_keys.add('motif.{}'.format(key), self.active_uuid)
 
     def parse_measures(self, data, info_data):
         """Parse measures info."""
@@ -495,16 +1075,31 @@ class DiMuHarvester(object):
                 exh_obj["to_year"] = exh["timespan"].get("toYear")
                 exh_obj["from_year"] = exh["timespan"].get("fromYear")
                 exh_obj["titles"] = exh["titles"]
-                if self.exhibition_cache.get(exh["uuid"]):
-                    exh_obj["dimu_code"] = self.exhibition_cache.get(
-                        exh["uuid"])
-                else:
-                    ex_dimu = self.load_single_object(
-                        exh["uuid"]).get("dimu_code")
-                    self.exhibition_cache[exh["uuid"]] = ex_dimu
-                    exh_obj["dimu_code"] = ex_dimu
+                exh_obj["dimu_code"] = self.get_exhibition_code(exh["uuid"])
                 data["exhibitions"].append(exh_obj)
 
+    def get_exhibition_code(self, exh_uuid):
+        """
+        Return the DiMu code for an exhibition.
+
+        The exhibition is only fetched if it is not already in the
+        exhibition store.
+
+        :param exh_uuid: the uuid of the exhibition
+        """
+        return self.exhibitions.get(exh_uuid)
+
+    def fetch_exhibition_code(self, exh_uuid):
+        """
+        Fetch the DiMu code for an exhibition.
+
+        :param exh_uuid: the uuid of the exhibition
+        :return: the code, None if the exhibition could not be loaded
+        """
+        with self.stats.timer('exhibition_fetch'):
+            exh_data = self.load_single_object(exh_uuid)
+        return exh_data.get('dimuCode') if exh_data else None
+
     def parse_description(self, data, desc_data):
         """
         Parse data about description.
@@ -561,9 +1156,10 @@ class DiMuHarvester(object):
                 place[place_type]['code'] = (
                     field.get('code') or field.get('value'))
             elif place_type:
-                self.log.write(
+                self.write_log(
                     '{}: encountered an unknown place_type "{}".'.format(
-                        self.active_uuid, place_type))
+                        self.active_uuid, place_type),
+                    'parse', self.active_uuid)
             else:
                 place['other'][field.get('name')] = {
                     'label': field.get('value'),
@@ -749,9 +1345,10 @@ class DiMuHarvester(object):
             if event_type == 'Fotografering':
                 data['is_photo'] = True
             elif event_type not in creation_types:
-                self.log.write(
+                self.write_log(
                     '{}: had an unexpected event type "{}".'.format(
-                        self.active_uuid, event_type))
+                        self.active_uuid, event_type),
+                    'parse', self.active_uuid)
 
             data['creation'] = self.parse_event(production_data)
 
@@ -761,9 +1358,10 @@ class DiMuHarvester(object):
             for event in event_wrap_data.get('events'):
                 event_type = event.get('eventType')
                 if event_type not in creation_types:
-                    self.log.write(
+                    self.write_log(
                         '{}: found a new event type "{}".'.format(
-                            self.active_uuid, event_type))
+                            self.active_uuid, event_type),
+                        'parse', self.active_uuid)
                     data['events'].append(self.parse_event(event))
 
         # store Historik
@@ -813,29 +1411,96 @@ class DiMuHarvester(object):
         return image
 
     def load_uuid_list(self, uuid_list):
-        """Process a list of image uuids instead of starting from a folder."""
-        for uuid in uuid_list:
-            self.process_single_object(uuid)
+        """
+        Process a list of image uuids instead of starting from a folder.
+
+        The objects are processed in batches the size of a search result
+        page.
+        """
+        uuid_list = list(uuid_list)
+        rows = self.settings.get('rows') or SEARCH_ROWS
+        for start in range(0, len(uuid_list), rows):
+            self.process_objects(uuid_list[start:start + rows])
 
     def not_implemented_yet_warning(self, raw_data, method):
-        """Raise a pywikibot warning that a method has not been implemented."""
+        """
+        Record data about something which has not been implemented.
+
+        This is reported once for the whole run, see report_unknown_keys.
+        """
         if raw_data.get(method):
-            pywikibot.warning(
-                '{uuid}: You found an entry which contains data about '
-                '"{method}", sadly this has not been implemented yet.'.format(
-                    uuid=self.active_uuid, method=method))
+            self.unknown_keys.add(method, self.active_uuid)
+
+    def report_unknown_keys(self):
+        """Warn about, and log, any unhandled keys found during the run."""
+        for key, count, uuid in self.unknown_keys.report():
+            text = (
+                'Found {count} entries which contain data about "{key}", '
+                'sadly this has not been implemented yet (e.g. {uuid}).'
+                ).format(count=count, key=key, uuid=uuid)
+            pywikibot.warning(text)
+            self.log.write(text)
+
+    def output_delta_summary(self):
+        """Log and output a summary of the changes found in a delta harvest."""
+        summary = self.delta.summary()
+        pywikibot.output('Delta harvest: {}'.format(', '.join(
+            '{0} {1}'.format(len(uuids), change)
+            for change, uuids in summary.items())))
+        for change, uuids in summary.items():
+            if change != delta_harvest.UNCHANGED and uuids:
+                self.log.write('{0} objects: {1}'.format(
+                    change, ', '.join(uuids)))
+
+    def stats_file(self):
+        """Return the path to the stats report, next to the harvest log."""
+        log_file = self.settings.get('harvest_log_file') or LOGFILE
+        return os.path.splitext(log_file)[0] + '.stats.json'
+
+    def write_stats(self, filename=None):
+        """
+        Write the stage timings and counts of the run as a json report.
 
-    def verbose_output(self, txt, no_log=False):
+        Includes the cache hit ratios and the requests and bytes per host.
+        """
+        filename = filename or self.stats_file()
+        self.stats.write(
+            filename,
+            images=len(self.data),
+            unknown_keys=dict(self.unknown_keys.counts),
+            cache=harvest_stats.ratios(self.cache.counts),
+            hosts=http_client.get_session().host_stats())
+        pywikibot.output('Harvest stats written to {}'.format(filename))
+
+    def log_request_limits(self):
+        """Write the request limits and outcomes for each host to the log."""
+        for line in http_client.get_session().report():
+            self.log.write(line)
+
+    def verbose_output(self, txt, no_log=False, stage='parse'):
         """
         Log and output to terminal in verbose mode.
 
         :param txt: text to output
         :param no_log: if logging should be skipped
+        :param stage: the stage of the run, the active uuid is logged with
+            the text during parsing
         """
         if self.settings.get('verbose'):
-            pywikibot.output(txt)
+            harvest_log.output(self.log, txt)
         if not no_log:
-            self.log.write(txt)
+            self.write_log(
+                txt, stage, self.active_uuid if stage == 'parse' else None)
+
+    def write_log(self, text, stage=None, uuid=None):
+        """
+        Write to the log, with the stage and uuid if the backend keeps them.
+
+        :param text: the line to log
+        :param stage: the stage of the run, e.g. 'search' or 'parse'
+        :param uuid: the uuid of the object the line is about, if any
+        """
+        harvest_log.write(self.log, text, stage, uuid)
 
 
 def handle_args(args, usage):
@@ -847,19 +1512,30 @@ def handle_args(args, usage):
     :param args: arguments to be handled
     :return: dict of options
     """
-    expected_args = ('api_key', 'all_slides', 'glam_code',
-                     'harvest_log_file', 'harvest_file', 'settings_file',
-                     'verbose', 'cutoff', 'folder_id', 'cache')
+    expected_args = ('api_key', 'all_slides', 'resume', 'glam_code',
+                     'harvest_log_file', 'log_backend', 'log_json_file',
+                     'harvest_file', 'normalise',
+                     'settings_file',
+                     'verbose', 'cutoff', 'folder_id', 'shard', 'cache',
+                     'cache_ttl',
+                     'cache_backend', 'cache_path', 'cache_compress',
+                     'delta', 'exhibition_file', 'exhibition_ttl',
+                     'workers', 'rows', 'page_workers', 'engine',
+                     'parse_workers', 'queue_size',
+                     'api_url', 'pool_size', 'timeout', 'retries',
+                     'backoff', 'rate')
     options = {}
 
     for arg in pywikibot.handle_args(args):
         option, sep, value = arg.partition(':')
         if option == '-verbose':
             options['verbose'] = common.interpret_bool(value)
-        elif option == '-cutoff':
-            options['cutoff'] = int(value)
-        elif option == '-cache':
-            options['cache'] = common.interpret_bool(value)
+        elif option.startswith('-') and option[1:] in BOOL_OPTIONS:
+            options[option[1:]] = not value or common.interpret_bool(value)
+        elif option.startswith('-') and option[1:] in INT_OPTIONS:
+            options[option[1:]] = int(value)
+        elif option.startswith('-') and option[1:] in FLOAT_OPTIONS:
+            options[option[1:]] = float(value)
         elif option.startswith('-') and option[1:] in expected_args:
             options[option[1:]] = common.convert_from_commandline(value)
         else:
@@ -880,7 +1556,7 @@ def load_settings(args):
     """
     default_options = DEFAULT_OPTIONS.copy()
 
-    options = handle_args(args, PARAMETER_HELP.format(**default_options))
+    options = handle_args(args, PARAMETER_HELP.format(**HELP_DEFAULTS))
 
     # settings_file must be handled first
     options['settings_file'] = (
@@ -890,14 +1566,57 @@ def load_settings(args):
     settings_options = common.open_and_read_file(
         options.get('settings_file'), as_json=True)
     for key, val in default_options.items():
-        options[key] = options.get(key) or settings_options.get(key) or val
+        if key in INT_OPTIONS + FLOAT_OPTIONS + BOOL_OPTIONS:
+            # a 0 or False must not fall through to the next source
+            options[key] = next(
+                (value for value in (options.get(key),
+                                     settings_options.get(key))
+                 if value is not None), val)
+        else:
+            options[key] = (
+                options.get(key) or settings_options.get(key) or val)
+
+    if options.get('shard'):
+        shard_settings(options)
 
     return options
 
 
+def shard_settings(options):
+    """
+    Give a shard its own harvest file, journal, log and cache.
+
+    :param options: the settings, updated in place
+    """
+    try:
+        shard = harvest_shards.parse_shard(options.get('shard'))
+    except ValueError as e:
+        raise pywikibot.Error(str(e))
+    if not options.get('cache_path'):
+        options['cache_path'] = (
+            artifact_cache.SQLITE_FILE
+            if options.get('cache_backend') == 'sqlite' else CACHE_DIR)
+    for key in ('harvest_file', 'harvest_log_file', 'log_json_file',
+                'cache_path'):
+        if options.get(key):
+            options[key] = harvest_shards.shard_path(options.get(key), shard)
+
+
+def folder_ids(value):
+    """
+    Return the list of folders to harvest.
+
+    :param value: the folder_id setting, either a list or a comma separated
+        string
+    """
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [idno.strip() for idno in (value or '').split(',') if idno.strip()]
+
+
 def get_json_from_url(url, payload=None):
-    """Download json record from url."""
-    response = requests.get(url, params=payload)
+    """Download json record from url using the shared http session."""
+    response = http_client.get_session().get(url, params=payload)
     response.raise_for_status()
     return response.json()
 
@@ -906,8 +1625,16 @@ def main(*args):
     """Initialise and run the harvester."""
     options = load_settings(args)
     harvester = DiMuHarvester(options)
-    harvester.load_collection(options.get('folder_id'))
+    harvester.load_folders(folder_ids(options.get('folder_id')))
+    harvester.report_unknown_keys()
+    if harvester.delta:
+        harvester.output_delta_summary()
+    harvester.exhibitions.save()
     harvester.save_data()
+    if harvester.journal:
+        harvester.journal.remove()
+    harvester.log_request_limits()
+    harvester.write_stats()
     harvester.log.write_w_timestamp('...Harvester finished\n')
     pywikibot.output(harvester.log.close_and_confirm())
 
@@ -17,6 +17,13 @@ from pywikibot.data import sparql
 import batchupload.common as common
 from batchupload.listscraper import MappingList
 
+try:
+    import importer.harvest_io as harvest_io
+    import importer.json_codec as json_codec
+except ImportError:  # run as a script from within the importer directory
+    import harvest_io
+    import json_codec
+
 SETTINGS_DIR = "settings"
 SETTINGS = "settings.json"
 MAPPINGS_DIR = 'mappings'
@@ -36,7 +43,8 @@ DEFAULT_OPTIONS = {
 PARAMETER_HELP = u"""\
 Basic DiMuMappingUpdater options (can also be supplied via the settings file):
 -settings_file:PATH     path to settings file (DEF: {settings_file})
--harvest_file:PATH      path to harvest file (DEF: {harvest_file})
+-harvest_file:PATH      path to harvest file, either json or JSON Lines \
+(DEF: {harvest_file})
 -mapping_log_file:PATH  path to mappings log file (DEF: {mapping_log_file})
 -mappings_dir:PATH      path to mappings dir (DEF: {mappings_dir})
 -wiki_mapping_root:PATH path to wiki mapping root (DEF: {wiki_mapping_root})
@@ -150,8 +158,13 @@ class DiMuMappingUpdater(object):
         return out_data
 
     def parse_harvest_data(self, harvest_data):
-        """Go through the harvest data breaking out data needing mapping."""
-        for key, image in harvest_data.items():
+        """
+        Go through the harvest data breaking out data needing mapping.
+
+        :param harvest_data: iterator of (key, entry) tuples, as returned by
+            load_harvest_data
+        """
+        for key, image in harvest_data:
             self.current_key = key
             self.subjects_to_map.update(image.get('subjects'))
             self.subjects_to_map.update(image.get('tags'))
@@ -233,10 +246,16 @@ class DiMuMappingUpdater(object):
 
 
 def load_harvest_data(filename):
-    """Load the harvested data from a file."""
+    """
+    Load the harvested data from a file.
+
+    Entries of a JSON Lines harvest file are streamed rather than loaded
+    all at once.
+
+    :return: iterator of (key, entry) tuples
+    """
     filename = filename or HARVEST_FILE
-    harvest_data = common.open_and_read_file(filename, as_json=True)
-    return harvest_data
+    return harvest_io.iter_harvest_data(filename)
 
 
 def load_mappings(update_mappings, mappings_dir=None,
@@ -281,18 +300,13 @@ def load_mappings(update_mappings, mappings_dir=None,
             county_file, mappings['county'], as_json=True)
 
     else:
-        mappings['parish'] = common.open_and_read_file(
-            parish_file, as_json=True)
-        mappings['municipality'] = common.open_and_read_file(
-            muni_file, as_json=True)
-        mappings['county'] = common.open_and_read_file(
-            county_file, as_json=True)
+        mappings['parish'] = json_codec.read_file(parish_file)
+        mappings['municipality'] = json_codec.read_file(muni_file)
+        mappings['county'] = json_codec.read_file(county_file)
 
     # static files
-    mappings['province'] = common.open_and_read_file(
-        province_file, as_json=True)
-    mappings['country'] = common.open_and_read_file(
-        country_file, as_json=True)
+    mappings['province'] = json_codec.read_file(province_file)
+    mappings['country'] = json_codec.read_file(country_file)
 
     if load_mapping_lists:
         load_mapping_lists_mappings(
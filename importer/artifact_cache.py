@@ -0,0 +1,386 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Local cache of raw DiMu artifact data.
+
+Each cached artifact is stored together with the time it was fetched, the
+ETag and Last-Modified validators sent by DiMu and, if known, the last
+modified timestamp reported for it by the DiMu search. Entries younger than
+the time-to-live are served locally, older ones, or ones for which the search
+reports a different timestamp, are revalidated using a conditional request
+and missing ones are fetched and stored.
+
+The artifacts can be kept either as one json file per artifact in a
+directory or in a single SQLite database.
+
+usage, to migrate a cache directory to a SQLite database:
+    python importer/artifact_cache.py -from:cache -to:cache.sqlite \
+[-compress:BOOL]
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+import pywikibot
+
+import batchupload.common as common
+
+try:
+    import importer.harvest_stats as harvest_stats
+    import importer.http_client as http_client
+    import importer.json_codec as json_codec
+except ImportError:  # run as a script from within the importer directory
+    import harvest_stats
+    import http_client
+    import json_codec
+
+BACKENDS = ('directory', 'sqlite')
+SQLITE_FILE = 'cache.sqlite'
+
+
+class DirectoryStore(object):
+    """
+    Store each artifact as a json file in a directory.
+
+    The data is stored in <uuid>.json and the fetch metadata in
+    <uuid>.meta.json. Entries without a metadata file, e.g. from older
+    harvests, are treated as fetched at an unknown time.
+    """
+
+    def __init__(self, directory):
+        """Initialise a store in the given directory, creating it if needed."""
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def data_path(self, uuid):
+        """Return the path to the data file for an artifact."""
+        return os.path.join(self.directory, '{}.json'.format(uuid))
+
+    def meta_path(self, uuid):
+        """Return the path to the metadata file for an artifact."""
+        return os.path.join(self.directory, '{}.meta.json'.format(uuid))
+
+    def get(self, uuid):
+        """
+        Return the cached data and metadata for an artifact.
+
+        :return: tuple of data and metadata, (None, None) if not cached
+        """
+        data = read_json(self.data_path(uuid))
+        if data is None:
+            return None, None
+        return data, read_json(self.meta_path(uuid)) or {}
+
+    def put(self, uuid, data, meta):
+        """Store the data and metadata for an artifact."""
+        write_json(self.data_path(uuid), data)
+        write_json(self.meta_path(uuid), meta)
+
+    def get_meta(self, uuid):
+        """Return the metadata for an artifact, None if not known."""
+        return read_json(self.meta_path(uuid))
+
+    def put_meta(self, uuid, meta):
+        """Update only the metadata for an artifact."""
+        write_json(self.meta_path(uuid), meta)
+
+    def uuids(self):
+        """Return the uuids of all stored artifacts."""
+        return [filename[:-len('.json')]
+                for filename in os.listdir(self.directory)
+                if filename.endswith('.json')
+                and not filename.endswith('.meta.json')]
+
+
+class SqliteStore(object):
+    """
+    Store all artifacts in a single SQLite database.
+
+    The artifacts are indexed by uuid and the json data may optionally be
+    stored zlib compressed.
+    """
+
+    def __init__(self, filename, compress=False):
+        """
+        Initialise a store in the given database file, creating it if needed.
+
+        :param filename: path to the database file
+        :param compress: whether to compress newly stored data
+        """
+        self.filename = filename
+        self.compress = compress
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS artifacts ('
+                'uuid TEXT PRIMARY KEY, data BLOB, compressed INTEGER, '
+                'etag TEXT, last_modified TEXT, fetched REAL, updated TEXT)')
+            columns = [row[1] for row in self.connection.execute(
+                'PRAGMA table_info(artifacts)')]
+            if 'updated' not in columns:  # database from an older version
+                self.connection.execute(
+                    'ALTER TABLE artifacts ADD COLUMN updated TEXT')
+
+    def get(self, uuid):
+        """
+        Return the cached data and metadata for an artifact.
+
+        :return: tuple of data and metadata, (None, None) if not cached
+        """
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT data, compressed, etag, last_modified, fetched, '
+                'updated FROM artifacts WHERE uuid = ?', (uuid, )).fetchone()
+        if row is None:
+            return None, None
+        data, compressed = row[:2]
+        if compressed:
+            data = zlib.decompress(data)
+        return json_codec.loads(data), self.row_to_meta(row[2:])
+
+    def get_meta(self, uuid):
+        """Return the metadata for an artifact, None if not known."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT etag, last_modified, fetched, updated '
+                'FROM artifacts WHERE uuid = ?', (uuid, )).fetchone()
+        if row is not None:
+            return self.row_to_meta(row)
+
+    @staticmethod
+    def row_to_meta(row):
+        """Convert the metadata columns of a row to a metadata dict."""
+        return dict(zip(('etag', 'last_modified', 'fetched', 'updated'), row))
+
+    def put(self, uuid, data, meta):
+        """Store the data and metadata for an artifact."""
+        data = json_codec.dumpb(data)
+        if self.compress:
+            data = zlib.compress(data)
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO artifacts (uuid, data, compressed, '
+                'etag, last_modified, fetched, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (uuid, data, int(self.compress), meta.get('etag'),
+                 meta.get('last_modified'), meta.get('fetched'),
+                 meta.get('updated')))
+
+    def put_meta(self, uuid, meta):
+        """Update only the metadata for an artifact."""
+        with self._lock, self.connection:
+            self.connection.execute(
+                'UPDATE artifacts SET etag = ?, last_modified = ?, '
+                'fetched = ?, updated = ? WHERE uuid = ?',
+                (meta.get('etag'), meta.get('last_modified'),
+                 meta.get('fetched'), meta.get('updated'), uuid))
+
+    def uuids(self):
+        """Return the uuids of all stored artifacts."""
+        with self._lock:
+            return [row[0] for row in self.connection.execute(
+                'SELECT uuid FROM artifacts')]
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self.connection.close()
+
+
+def make_store(backend=None, path=None, compress=False):
+    """
+    Create the store for the given cache backend.
+
+    :param backend: one of BACKENDS, defaults to 'directory'
+    :param path: the cache directory or database file
+    :param compress: whether a SQLite store should compress new data
+    """
+    backend = backend or 'directory'
+    if backend == 'directory':
+        return DirectoryStore(path)
+    elif backend == 'sqlite':
+        return SqliteStore(path or SQLITE_FILE, compress=compress)
+    raise ValueError(
+        'Unknown cache backend "{0}", expected one of: {1}'.format(
+            backend, ', '.join(BACKENDS)))
+
+
+def migrate(source, target):
+    """
+    Copy all artifacts, with their metadata, from one store to another.
+
+    :return: the number of copied artifacts
+    """
+    num_copied = 0
+    for uuid in source.uuids():
+        data, meta = source.get(uuid)
+        if data is not None:
+            target.put(uuid, data, meta)
+            num_copied += 1
+    return num_copied
+
+
+class ArtifactCache(object):
+    """A read-through cache of artifacts with conditional revalidation."""
+
+    def __init__(self, store, ttl=None, stats=None):
+        """
+        Initialise the cache.
+
+        :param store: the store in which the artifacts are kept
+        :param ttl: seconds for which a cached entry is served without
+            revalidation. None means cached entries never go stale.
+        :param stats: HarvestStats in which to time the cache reads and
+            writes, the requests and the json decoding
+        """
+        self.store = store
+        self.ttl = ttl
+        self.stats = stats or harvest_stats.HarvestStats()
+        self.counts = Counter()  # 'hit', 'revalidated', 'fetched'
+        self._lock = threading.Lock()
+
+    def count(self, outcome):
+        """Count the outcome of a lookup."""
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def is_fresh(self, meta, updated=None):
+        """
+        Check whether a cached entry may be served without revalidation.
+
+        :param meta: the metadata of the cached entry
+        :param updated: the current last modified timestamp of the artifact
+            according to the DiMu search, if known
+        """
+        if updated is not None and meta.get('updated') not in (None, updated):
+            return False
+        if self.ttl is None:
+            return True
+        fetched = meta.get('fetched')
+        return fetched is not None and time.time() - fetched < self.ttl
+
+    def updated(self, uuid):
+        """Return the stored last modified timestamp for an artifact."""
+        return (self.store.get_meta(uuid) or {}).get('updated')
+
+    def load(self, uuid, url, updated=None):
+        """
+        Return the data for an artifact, from the cache if possible.
+
+        :param uuid: the uuid of the artifact
+        :param url: the url from which to fetch the artifact if needed
+        :param updated: the current last modified timestamp of the artifact
+            according to the DiMu search, if known. Stored with the entry
+            whenever it is fetched or revalidated.
+        :raises requests.HTTPError: if the artifact could not be fetched
+        """
+        with self.stats.timer('cache_read'):
+            data, meta = self.store.get(uuid)
+        if data is not None and self.is_fresh(meta, updated):
+            self.count('hit')
+            return data
+
+        with self.stats.timer('artifact_request'):
+            response = http_client.get_session().get(
+                url, headers=conditional_headers(meta) if data else None)
+        if data is not None and response.status_code == 304:
+            meta['fetched'] = time.time()
+            meta['updated'] = updated or meta.get('updated')
+            with self.stats.timer('cache_write'):
+                self.store.put_meta(uuid, meta)
+            self.count('revalidated')
+            return data
+
+        response.raise_for_status()
+        self.stats.count('artifact_bytes', len(response.content))
+        with self.stats.timer('json_decode'):
+            data = response.json()
+        meta = response_meta(response)
+        meta['updated'] = updated
+        with self.stats.timer('cache_write'):
+            self.store.put(uuid, data, meta)
+        self.count('fetched')
+        return data
+
+
+def conditional_headers(meta):
+    """Return the headers for revalidating a cached entry."""
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta.get('etag')
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta.get('last_modified')
+    return headers
+
+
+def response_meta(response):
+    """Return the metadata to store for a fetched artifact."""
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched': time.time()
+    }
+
+
+def read_json(filename):
+    """Read a json file, returning None if it does not exist."""
+    try:
+        return json_codec.read_file(filename)
+    except FileNotFoundError:
+        return None
+
+
+def write_json(filename, data):
+    """Write a json file, replacing any existing file atomically."""
+    tmp_filename = '{0}.{1}.{2}.tmp'.format(
+        filename, os.getpid(), threading.get_ident())
+    with open(tmp_filename, 'wb') as f:
+        f.write(json_codec.dumpb(data))
+    os.replace(tmp_filename, filename)
+
+
+def handle_args(args):
+    """
+    Parse the command line arguments of the migration.
+
+    :return: dict of options, None if the usage should be shown
+    """
+    options = {'from': None, 'to': SQLITE_FILE, 'compress': False}
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        key = option[1:]
+        if key not in options:
+            return None
+        if key == 'compress':
+            options[key] = common.interpret_bool(value)
+        else:
+            options[key] = common.convert_from_commandline(value)
+    if not options.get('from'):
+        return None
+    return options
+
+
+def main(*args):
+    """Migrate a cache directory to a SQLite database."""
+    options = handle_args(args)
+    if options is None:
+        pywikibot.output(__doc__)
+        return
+
+    source = DirectoryStore(options.get('from'))
+    target = SqliteStore(options.get('to'), compress=options.get('compress'))
+    num_copied = migrate(source, target)
+    target.close()
+    pywikibot.output('Migrated {0} artifacts from {1} to {2}'.format(
+        num_copied, options.get('from'), options.get('to')))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
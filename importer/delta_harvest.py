@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Bookkeeping for incremental (delta) harvests.
+
+A delta harvest starts from the harvest file of an earlier run. Objects whose
+last modified timestamp in the DiMu search matches the one stored with their
+entries in the earlier harvest file are copied over from the earlier harvest
+instead of being fetched and parsed again. Objects no longer found in the
+folder are dropped.
+
+The timestamp is compared to the harvest file, rather than to the local
+cache, since the cache may have been refreshed by a later run.
+"""
+from collections import OrderedDict
+
+try:
+    import importer.harvest_io as harvest_io
+except ImportError:  # run as a script from within the importer directory
+    import harvest_io
+
+UPDATED_KEY = 'updated'  # entry field holding the timestamp from the search
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+REMOVED = 'removed'
+
+
+class DeltaHarvest(object):
+    """Keep track of the objects of an earlier harvest and their changes."""
+
+    def __init__(self, previous_data):
+        """
+        Initialise the delta harvest.
+
+        :param previous_data: the data of the earlier harvest, a dict with one
+            entry per image keyed by '<object uuid>_<image index>'
+        """
+        self.previous = OrderedDict()
+        self.stamps = {}  # last modified timestamp of each earlier object
+        for key, image in previous_data.items():
+            uuid = harvest_io.object_uuid(key)
+            self.previous.setdefault(uuid, OrderedDict())[key] = image
+            self.stamps.setdefault(uuid, image.get(UPDATED_KEY))
+        self.changes = OrderedDict(
+            (change, []) for change in (NEW, CHANGED, UNCHANGED))
+
+    @classmethod
+    def from_file(cls, filename):
+        """Initialise the delta harvest from an earlier harvest file."""
+        return cls(harvest_io.load_harvest_data(filename))
+
+    def check(self, uuid, updated):
+        """
+        Check whether an object has changed since the earlier harvest.
+
+        Objects harvested without a timestamp are always treated as changed.
+        The result is recorded for the summary.
+
+        :param uuid: the uuid of the object
+        :param updated: the last modified timestamp of the object according
+            to the DiMu search
+        :return: True if the earlier harvested data can be reused
+        """
+        if uuid not in self.previous:
+            change = NEW
+        elif updated is not None and updated == self.stamps.get(uuid):
+            change = UNCHANGED
+        else:
+            change = CHANGED
+        self.changes[change].append(uuid)
+        return change == UNCHANGED
+
+    def reuse(self, uuid):
+        """Return the earlier harvested entries for an object."""
+        return self.previous.get(uuid).items()
+
+    def removed(self):
+        """Return the objects of the earlier harvest which were not seen."""
+        seen = set()
+        for uuids in self.changes.values():
+            seen.update(uuids)
+        return [uuid for uuid in self.previous if uuid not in seen]
+
+    def summary(self):
+        """Return the uuids of all objects grouped by type of change."""
+        summary = OrderedDict(self.changes)
+        summary[REMOVED] = self.removed()
+        return summary
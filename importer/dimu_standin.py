@@ -0,0 +1,395 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+A local stand-in for the parts of the DiMu API used by the harvester.
+
+Serves recorded Solr search results for folders as well as artifact
+documents, so that harvests can be tested without touching api.dimu.org.
+Original images can be served too, in place of dms01.dimu.org, as can
+look-ups of files by SHA-1, in place of the Wikimedia Commons API.
+Artificial latency and errors can be added to every response, and large
+folders of synthetic objects generated from a few template artifacts.
+
+usage:
+    python importer/dimu_standin.py RECORDINGS_FILE [PORT]
+
+where RECORDINGS_FILE is a json file with the keys 'folders' and 'artifacts'
+as described in StandinData.
+"""
+import copy
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Mapping
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import pywikibot
+
+SYNTHETIC_FOLDER_UUID = 'B0000000-0000-0000-0000-000000000000'
+SYNTHETIC_FOLDER_ID = '000000000001'
+
+
+class StandinData(object):
+    """The recordings served by the stand-in."""
+
+    def __init__(self, folders=None, artifacts=None, images=None,
+                 commons_files=None):
+        """
+        Initialise the recordings.
+
+        :param folders: dict of folder uuid to a dict with the keys
+            'unique_id', 'title' and 'docs' (the Solr docs of the folder)
+        :param artifacts: dict of artifact uuid to the artifact document
+        :param images: dict of media id to the bytes of the original image
+        :param commons_files: dict of the (hex) SHA-1 of files on Commons to
+            their title
+        """
+        self.folders = folders or {}
+        self.artifacts = artifacts or {}
+        self.images = images or {}
+        self.commons_files = commons_files or {}
+
+    @classmethod
+    def from_file(cls, filename):
+        """Load recordings stored as json."""
+        with open(filename, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get('folders'), data.get('artifacts'))
+
+    @classmethod
+    def synthetic(cls, templates, num_objects):
+        """
+        Create a folder of synthetic objects based on template artifacts.
+
+        The folder has the uuid SYNTHETIC_FOLDER_UUID and the unique id
+        SYNTHETIC_FOLDER_ID.
+
+        :param templates: list of artifacts, cycled through for the objects
+        :param num_objects: the number of objects in the folder
+        """
+        artifacts = SyntheticArtifacts(templates, num_objects)
+        docs = [{
+            'artifact.uuid': uuid,
+            'artifact.type': artifacts.template(i).get('artifactType'),
+            'artifact.hasPictures': True
+        } for i, uuid in enumerate(artifacts)]
+        folders = {
+            SYNTHETIC_FOLDER_UUID: {'unique_id': SYNTHETIC_FOLDER_ID,
+                                    'title': 'Synthetic folder',
+                                    'docs': docs}
+        }
+        return cls(folders, artifacts)
+
+    def folder_doc(self, uuid):
+        """Return the Solr doc describing a folder."""
+        folder = self.folders.get(uuid)
+        return {
+            'artifact.uuid': uuid,
+            'artifact.type': 'Folder',
+            'artifact.ingress.title': folder.get('title'),
+            'identifier.id': folder.get('unique_id')
+        }
+
+    def search(self, query, filters=None, fields=None):
+        """
+        Return all Solr docs matching a query.
+
+        :param query: the 'q' parameter
+        :param filters: list of 'fq' parameters
+        :param fields: the 'fl' parameter
+        """
+        filters = filters or []
+        docs = []
+        if query.startswith('artifact.folderUids:'):
+            folder = self.folders.get(query.partition(':')[2]) or {}
+            docs = folder.get('docs', [])
+        elif 'artifact.type:Folder' in filters:
+            docs = [self.folder_doc(uuid)
+                    for uuid, folder in self.folders.items()
+                    if query in (uuid, folder.get('unique_id'))]
+
+        docs = [doc for doc in docs
+                if all(matches_filter(doc, fq) for fq in filters)]
+        if fields:
+            fields = fields.split(',')
+            docs = [{k: v for k, v in doc.items() if k in fields}
+                    for doc in docs]
+        return docs
+
+
+class SyntheticArtifacts(Mapping):
+    """
+    Artifacts generated on request from a few templates.
+
+    Only the templates are kept in memory, so folders of any size can be
+    served.
+    """
+
+    def __init__(self, templates, num_objects):
+        """
+        Initialise the artifacts.
+
+        :param templates: list of artifacts, cycled through for the objects
+        :param num_objects: the number of artifacts
+        """
+        self.templates = templates
+        self.num_objects = num_objects
+
+    @staticmethod
+    def uuid(index):
+        """Return the uuid of the artifact with the given index."""
+        return 'synthetic_{:07d}'.format(index)
+
+    def template(self, index):
+        """Return the template of the artifact with the given index."""
+        return self.templates[index % len(self.templates)]
+
+    def __getitem__(self, uuid):
+        """Generate the artifact with the given uuid."""
+        prefix, _, index = uuid.rpartition('_')
+        if not (prefix == 'synthetic' and index.isdigit()
+                and int(index) < self.num_objects):
+            raise KeyError(uuid)
+        artifact = copy.deepcopy(self.template(int(index)))
+        artifact['uuid'] = uuid
+        artifact.setdefault('identifier', {})['id'] = 'SYN.{}'.format(
+            int(index))
+        return artifact
+
+    def __iter__(self):
+        """Iterate over the uuids of all artifacts."""
+        return (self.uuid(i) for i in range(self.num_objects))
+
+    def __len__(self):
+        """Return the number of artifacts."""
+        return self.num_objects
+
+
+def matches_filter(doc, fq):
+    """
+    Check if a Solr doc matches a simple 'field:value' filter query.
+
+    The value may also be a parenthesised list of OR-ed values. Filters on
+    fields which are not present in the doc are ignored.
+    """
+    field, _, value = fq.partition(':')
+    if field not in doc:
+        return True
+    values = value.strip('()').split(' OR ')
+    doc_value = doc.get(field)
+    if isinstance(doc_value, bool):
+        doc_value = str(doc_value).lower()
+    return str(doc_value) in values
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    """Respond to DiMu API requests using the server's recordings."""
+
+    def do_GET(self):
+        """Serve a search page or an artifact document."""
+        if self.server.simulate_conditions():
+            self.send_json(503, {'error': 'simulated failure'})
+            return
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/api/solr/select':
+            self.serve_search(params)
+        elif url.path.startswith('/artifact/uuid/'):
+            self.serve_artifact(url.path[len('/artifact/uuid/'):])
+        elif url.path.startswith('/image/'):
+            self.serve_image(url.path[len('/image/'):])
+        elif url.path == '/w/api.php':
+            self.serve_commons_query(params)
+        else:
+            self.send_json(404, {'error': 'unknown path'})
+
+    def serve_search(self, params):
+        """Serve one page of search results."""
+        data = self.server.data
+        start = int(params.get('start', [0])[0])
+        rows = int(params.get('rows', [10])[0])
+        docs = data.search(params.get('q', [''])[0], params.get('fq'),
+                           params.get('fl', [None])[0])
+        self.send_json(200, {
+            'response': {
+                'numFound': len(docs),
+                'start': start,
+                'docs': docs[start:start + rows]
+            }
+        })
+
+    def serve_artifact(self, uuid):
+        """
+        Serve a single artifact document.
+
+        An ETag is sent with every artifact and a matching If-None-Match
+        header results in a 304 response.
+        """
+        artifact = self.server.data.artifacts.get(uuid)
+        if artifact is None:
+            self.send_json(404, {'error': 'unknown uuid'})
+            return
+
+        body = json.dumps(artifact).encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_body(200, body, {'ETag': etag})
+
+    def serve_image(self, media_id):
+        """
+        Serve an original image.
+
+        A Range header of the form "bytes=N-" is honoured, unless the
+        server is set to ignore ranges.
+        """
+        image = self.server.data.images.get(media_id)
+        if image is None:
+            self.send_json(404, {'error': 'unknown media id'})
+            return
+
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if not (match and self.server.ranges):
+            self.send_body(200, image, content_type='image/jpeg')
+            return
+        with self.server._lock:
+            self.server.counts['ranges'] += 1
+        start = int(match.group(1))
+        if start >= len(image):
+            self.send_body(416, b'', {
+                'Content-Range': 'bytes */{}'.format(len(image))})
+            return
+        self.send_body(206, image[start:], {
+            'Content-Range': 'bytes {0}-{1}/{2}'.format(
+                start, len(image) - 1, len(image))},
+            content_type='image/jpeg')
+
+    def serve_commons_query(self, params):
+        """Serve a Commons API look-up of files by SHA-1 (list=allimages)."""
+        if params.get('list', [''])[0] != 'allimages':
+            self.send_json(200, {'error': {'code': 'unsupported'}})
+            return
+        sha1 = params.get('aisha1', [''])[0].lower()
+        title = self.server.data.commons_files.get(sha1)
+        files = []
+        if title:
+            files.append({'name': title[len('File:'):], 'title': title})
+        self.send_json(200, {'batchcomplete': '',
+                             'query': {'allimages': files}})
+
+    def send_json(self, status, data):
+        """Send a json response."""
+        self.send_body(status, json.dumps(data).encode('utf-8'))
+
+    def send_body(self, status, body, headers=None,
+                  content_type='application/json; charset=utf-8'):
+        """Send a response, with a json body unless otherwise stated."""
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Silence the per-request logging of BaseHTTPRequestHandler."""
+        pass
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    """A threaded http server holding the recordings to serve."""
+
+    daemon_threads = True
+    protocol_version = 'HTTP/1.1'  # allow keep-alive connections
+
+    def __init__(self, data, port=0, latency=0, error_rate=0, seed=None):
+        """
+        Initialise the server, binding to localhost.
+
+        :param data: the StandinData to serve
+        :param port: port to listen on, a free one is picked if 0
+        :param latency: seconds to wait before every response
+        :param error_rate: share of requests, 0-1, answered by a 503 error
+        :param seed: seed for picking the failing requests
+        """
+        HTTPServer.__init__(
+            self, ('127.0.0.1', port), StandinRequestHandler)
+        self.data = data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.counts = Counter()  # 'requests', simulated 'errors', 'ranges'
+        self.ranges = True  # whether to honour Range requests for images
+        self._lock = threading.Lock()
+
+    def simulate_conditions(self):
+        """
+        Apply the artificial latency to a request.
+
+        :return: whether the request should fail with a simulated error
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.counts['requests'] += 1
+            fail = bool(self.error_rate) and (
+                self.random.random() < self.error_rate)
+            if fail:
+                self.counts['errors'] += 1
+        return fail
+
+    @property
+    def url(self):
+        """The base url to use in place of http://api.dimu.org."""
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+    def start(self):
+        """Serve requests from a background thread."""
+        self.thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and release the port."""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        """Start serving when used as a context manager."""
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        """Stop serving when leaving the context."""
+        self.stop()
+
+
+def main(*args):
+    """Serve a recordings file until interrupted."""
+    if not args:
+        pywikibot.output(__doc__)
+        return
+    port = int(args[1]) if len(args) > 1 else 8080
+    server = StandinServer(StandinData.from_file(args[0]), port)
+    pywikibot.output('Serving DiMu stand-in at {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
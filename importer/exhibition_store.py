@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Persistent lookup table of exhibition uuids to their DiMu codes.
+
+The DiMu code of an exhibition is not part of the data of the objects shown
+in it, so it must be looked up separately. The codes are kept in a json file
+between runs so that each exhibition is only fetched once, or once per
+time-to-live if one is given.
+
+The store is safe to share between threads. Concurrent lookups of the same
+exhibition wait for a single fetch rather than each fetching it. The json
+file may also be shared between processes, e.g. the shards of a harvest or
+the workers of a replay. Each process merges the codes saved by the others
+into its own when saving, rather than overwriting them.
+"""
+import contextlib
+import fcntl
+import threading
+import time
+from concurrent import futures
+
+try:
+    import importer.artifact_cache as artifact_cache
+except ImportError:  # run as a script from within the importer directory
+    import artifact_cache
+
+LOCK_SUFFIX = '.lock'
+
+
+class ExhibitionStore(object):
+    """A persistent, thread-safe, single-flight store of exhibition codes."""
+
+    def __init__(self, filename, fetch, ttl=None):
+        """
+        Initialise the store, loading any earlier stored codes.
+
+        :param filename: path to the json file in which codes are kept
+        :param fetch: function returning the DiMu code for an exhibition
+            uuid, or None if it could not be looked up
+        :param ttl: seconds after which a stored code is fetched again.
+            None means stored codes never go stale.
+        """
+        self.filename = filename
+        self.fetch = fetch
+        self.ttl = ttl
+        self.entries = artifact_cache.read_json(filename) or {}
+        self.failed = set()  # uuids which could not be looked up this run
+        self.in_flight = {}  # uuid to the future of an ongoing fetch
+        self._lock = threading.Lock()
+
+    def __contains__(self, uuid):
+        """Check whether an exhibition is known without fetching it."""
+        return self.is_fresh(uuid) or uuid in self.failed
+
+    def is_fresh(self, uuid):
+        """Check whether a stored code may be used without fetching."""
+        entry = self.entries.get(uuid)
+        if entry is None:
+            return False
+        return (self.ttl is None
+                or time.time() - entry.get('fetched') < self.ttl)
+
+    def get(self, uuid):
+        """
+        Return the DiMu code for an exhibition, fetching it if needed.
+
+        If the exhibition is already being fetched by another thread the
+        result of that fetch is awaited instead.
+        """
+        with self._lock:
+            if uuid in self:
+                return self.entries.get(uuid, {}).get('dimu_code')
+            future = self.in_flight.get(uuid)
+            owner = future is None
+            if owner:
+                future = futures.Future()
+                self.in_flight[uuid] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            code = self.fetch(uuid)
+        except Exception as e:
+            with self._lock:
+                del self.in_flight[uuid]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if code is None:
+                self.failed.add(uuid)
+            else:
+                self.entries[uuid] = {'dimu_code': code,
+                                      'fetched': time.time()}
+            del self.in_flight[uuid]
+        future.set_result(code)
+        return code
+
+    def missing(self, uuids):
+        """Return those of the given exhibitions which must be fetched."""
+        with self._lock:
+            return set(uuid for uuid in uuids if uuid not in self)
+
+    def prefetch(self, uuids, workers=1):
+        """
+        Look up all unknown exhibitions among the given ones.
+
+        :param uuids: iterable of exhibition uuids, e.g. for all objects on a
+            page of search results
+        :param workers: number of exhibitions to fetch in parallel
+        """
+        missing = self.missing(uuids)
+        if workers <= 1 or len(missing) <= 1:
+            for uuid in missing:
+                self.get(uuid)
+            return
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self.get, missing))
+
+    def save(self):
+        """
+        Write the stored codes to disk.
+
+        Any codes saved by other processes since the file was loaded are
+        merged in first, keeping the most recently fetched code for an
+        exhibition known to both.
+        """
+        with file_lock(self.filename), self._lock:
+            entries = artifact_cache.read_json(self.filename) or {}
+            for uuid, entry in self.entries.items():
+                if (entry.get('fetched') or 0) >= (
+                        entries.get(uuid, {}).get('fetched') or 0):
+                    entries[uuid] = entry
+            self.entries = entries
+            artifact_cache.write_json(self.filename, entries)
+
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """
+    Hold an exclusive lock, between processes, on a file.
+
+    The lock is taken on a separate "<filename>.lock" file, so that the file
+    itself may be replaced while the lock is held.
+    """
+    with open(filename + LOCK_SUFFIX, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def exhibition_uuids(raw_data):
+    """
+    Return the uuids of all exhibitions of the given objects.
+
+    :param raw_data: list of raw object data (or None)
+    """
+    uuids = set()
+    for data in filter(None, raw_data):
+        for exh in data.get('exhibitions') or []:
+            uuids.add(exh.get('uuid'))
+    return uuids
@@ -0,0 +1,301 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Benchmark complete harvests against a local DiMu stand-in.
+
+For each folder size a folder of synthetic objects, based on one or more
+template artifacts, is served by a local stand-in with the given artificial
+latency and error rate. The folder is then harvested, in a separate process
+starting from an empty cache, and the objects per second, the p95 latency
+of loading and of parsing an object and the peak memory use are reported.
+
+usage:
+    python importer/harvest_benchmark.py [OPTIONS]
+
+&params;
+"""
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import pywikibot
+
+import batchupload.common as common
+
+try:
+    import importer.artifact_cache as artifact_cache
+    import importer.dimu_standin as dimu_standin
+except ImportError:  # run as a script from within the importer directory
+    import artifact_cache
+    import dimu_standin
+
+MAX_TEMPLATES = 1000
+POLL_INTERVAL = 1  # seconds between checks that the harvest is still running
+# settings passed on to the harvester as they are
+HARVESTER_OPTIONS = ('engine', 'workers', 'page_workers', 'rows', 'retries',
+                     'backoff', 'pool_size', 'rate', 'cache_backend')
+
+DEFAULT_OPTIONS = {
+    'sizes': '1000,10000,100000',
+    'latency': 0,
+    'error_rate': 0,
+    'seed': 0,
+    'templates': None,
+    'stream': False,
+    'output': None,
+    'engine': 'sync',
+    'workers': 1,
+    'page_workers': 1,
+    'rows': 100,
+    'retries': None,
+    'backoff': None,
+    'pool_size': None,
+    'rate': None,
+    'cache_backend': 'directory'
+}
+PARAMETER_HELP = u"""\
+Benchmark options:
+-sizes:INT,INT         comma separated number of objects in the benchmarked \
+folders (DEF: {sizes})
+-latency:FLOAT         seconds the stand-in waits before every response \
+(DEF: {latency})
+-error_rate:FLOAT      share of requests, 0-1, answered with a 503 error \
+(DEF: {error_rate})
+-seed:INT              seed for picking the failing requests (DEF: {seed})
+-templates:PATH        required. Cache directory or SQLite cache file whose \
+artifacts are used as templates for the objects, or a json file of a single \
+artifact
+-stream:BOOL           whether to stream the harvest file as JSON Lines \
+(DEF: {stream})
+-output:PATH           json file to write the results to (DEF: {output})
+
+Harvester options used for the benchmarked harvests: -engine, -workers, \
+-page_workers, -rows, -retries, -backoff, -pool_size, -rate and \
+-cache_backend, see DiMuHarvester.py.
+"""
+__doc__ = __doc__.replace(
+    '&params;', PARAMETER_HELP.format(**DEFAULT_OPTIONS))
+
+
+def load_templates(path):
+    """
+    Load the template artifacts.
+
+    :param path: cache directory or SQLite cache file to load up to
+        MAX_TEMPLATES artifacts with pictures from, or a json file holding a
+        single artifact
+    """
+    if path.endswith('.json'):
+        return [common.open_and_read_file(path, as_json=True)]
+
+    backend = 'sqlite' if os.path.isfile(path) else 'directory'
+    store = artifact_cache.make_store(backend, path)
+    templates = []
+    for uuid in store.uuids():
+        data, meta = store.get(uuid)
+        if data and (data.get('media') or {}).get('pictures'):
+            templates.append(data)
+            if len(templates) >= MAX_TEMPLATES:
+                break
+    if not templates:
+        raise ValueError('No artifacts with pictures found in {}'.format(path))
+    return templates
+
+
+def harvester_settings(options, api_url, tmp_dir):
+    """Return the settings for a benchmarked harvester."""
+    settings = {key: options.get(key) for key in HARVESTER_OPTIONS
+                if options.get(key) is not None}
+    settings.update({
+        'api_url': api_url,
+        'cache_path': os.path.join(tmp_dir, 'cache'),
+        'exhibition_file': os.path.join(tmp_dir, 'exhibitions.json'),
+        'harvest_log_file': os.path.join(tmp_dir, 'dimu_harvest.log'),
+        'harvest_file': os.path.join(
+            tmp_dir, 'dimu_harvest_data.jsonl' if options.get('stream')
+            else 'dimu_harvest_data.json')
+    })
+    if settings.get('cache_backend') == 'sqlite':
+        settings['cache_path'] += '.sqlite'
+    return settings
+
+
+def run_harvest(settings, results):
+    """
+    Harvest the synthetic folder, putting the measurements on a queue.
+
+    Run in a separate process so that the peak memory use is that of the
+    harvest alone.
+
+    :param settings: the harvester settings
+    :param results: multiprocessing queue for the measurements
+    """
+    try:
+        import importer.DiMuHarvester as DiMuHarvester
+    except ImportError:  # run as a script from within the importer directory
+        import DiMuHarvester
+
+    options = DiMuHarvester.DEFAULT_OPTIONS.copy()
+    options.update(settings)
+    harvester = DiMuHarvester.DiMuHarvester(options)
+    start = time.perf_counter()
+    harvester.load_folder(dimu_standin.SYNTHETIC_FOLDER_ID)
+    harvester.save_data()
+    duration = time.perf_counter() - start
+    harvester.journal.remove()
+    harvester.log.close_and_confirm()
+
+    stats = harvester.stats.report()
+    results.put({
+        'duration': duration,
+        'objects': stats['counts'].get('objects', 0),
+        'failed_objects': stats['counts'].get('failed_objects', 0),
+        'images': stats.get('images', len(harvester.data)),
+        'object_load_p95': stats['stages'].get(
+            'object_load', {}).get('p95'),
+        'parse_p95': stats['stages'].get('parse', {}).get('p95'),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stats['stages']
+    })
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of the current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # reported in bytes rather than KiB
+        peak /= 1024
+    return peak / 1024
+
+
+def run_benchmark(num_objects, templates, options):
+    """
+    Benchmark the harvest of a folder with the given number of objects.
+
+    :return: dict of measurements
+    """
+    data = dimu_standin.StandinData.synthetic(templates, num_objects)
+    server = dimu_standin.StandinServer(
+        data, latency=options.get('latency'),
+        error_rate=options.get('error_rate'), seed=options.get('seed'))
+    tmp_dir = tempfile.mkdtemp()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    try:
+        with server:
+            process = context.Process(
+                target=run_harvest,
+                args=(harvester_settings(options, server.url, tmp_dir),
+                      results))
+            process.start()
+            result = wait_for_result(process, results)
+            process.join()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    result.update({
+        'size': num_objects,
+        'objects_per_second': result['objects'] / result['duration'],
+        'requests': server.counts['requests'],
+        'simulated_errors': server.counts['errors']
+    })
+    return result
+
+
+def wait_for_result(process, results):
+    """
+    Wait for the measurements of a harvest running in another process.
+
+    :param process: the process running run_harvest
+    :param results: the queue it puts its measurements on
+    :return: dict of measurements
+    :raises pywikibot.Error: if the process exits without any
+    """
+    while process.is_alive():
+        try:
+            return results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    try:
+        # the measurements may have been put just before the process exited
+        return results.get(timeout=POLL_INTERVAL)
+    except queue.Empty:
+        raise pywikibot.Error(
+            'The harvest failed with exit code {}'.format(process.exitcode))
+
+
+def format_result(result):
+    """Return a one line summary of a benchmark result."""
+    return (
+        '{size:>7} objects: {objects_per_second:8.1f} objects/s, '
+        'p95 load {load}, p95 parse {parse}, peak RSS {peak_rss_mb:.0f} MB, '
+        '{failed_objects} failed, {simulated_errors} simulated errors'
+        ).format(load=format_seconds(result['object_load_p95']),
+                 parse=format_seconds(result['parse_p95']), **result)
+
+
+def format_seconds(seconds):
+    """Format a duration in milliseconds."""
+    if seconds is None:
+        return '-'
+    return '{:.1f} ms'.format(seconds * 1000)
+
+
+def handle_args(args):
+    """
+    Parse the command line arguments.
+
+    :return: dict of options, None if the usage should be shown
+    """
+    options = DEFAULT_OPTIONS.copy()
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        key = option[1:]
+        if key not in options:
+            return None
+        if key in ('latency', 'error_rate', 'backoff', 'rate'):
+            options[key] = float(value)
+        elif key in ('seed', 'workers', 'page_workers', 'rows', 'retries',
+                     'pool_size'):
+            options[key] = int(value)
+        elif key == 'stream':
+            options[key] = common.interpret_bool(value)
+        else:
+            options[key] = common.convert_from_commandline(value)
+    if not options.get('templates'):
+        return None
+    return options
+
+
+def main(*args):
+    """Run the benchmarks, outputting the results."""
+    options = handle_args(args)
+    if options is None:
+        pywikibot.output(__doc__)
+        return
+
+    templates = load_templates(options.get('templates'))
+    results = []
+    for size in options.get('sizes').split(','):
+        try:
+            result = run_benchmark(int(size), templates, options)
+        except pywikibot.Error as e:
+            pywikibot.warning('{0:>7} objects: {1}'.format(size, e))
+            results.append({'size': int(size), 'error': str(e)})
+            continue
+        pywikibot.output(format_result(result))
+        results.append(result)
+
+    if options.get('output'):
+        with open(options.get('output'), 'w', encoding='utf-8') as f:
+            json.dump({'options': options, 'results': results}, f,
+                      sort_keys=True, indent=4)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
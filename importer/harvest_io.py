@@ -0,0 +1,370 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Reading and writing of harvest files.
+
+A harvest file is either a single json dict of harvest key to image entry,
+as written by batchupload.common, or, if the filename ends in '.jsonl', a
+JSON Lines file with one '{key: entry}' dict per line.
+
+Either format may also be normalised, in which case the data shared by all
+images of an object is only stored once. Instead of one entry per image
+there is then one record per object, keyed by the object uuid, holding the
+shared 'object' data and the few 'images' fields which differ per image. The
+format is marked by a FORMAT_KEY entry, which comes first in a JSON Lines
+file. Readers expand the records to image entries as they are accessed.
+
+JSON Lines harvest files are written as a stream: each entry is spilled to
+disk as soon as it is produced and the entries are only ordered once the
+harvest is complete, using an external merge sort. This keeps the memory use
+of the harvester independent of the size of the harvest.
+"""
+import heapq
+import itertools
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from collections.abc import Mapping
+
+try:
+    import importer.json_codec as json_codec
+except ImportError:  # run as a script from within the importer directory
+    import json_codec
+
+JSONL_SUFFIX = '.jsonl'
+RUN_SIZE = 10000  # max number of entries sorted in memory at once
+FORMAT_KEY = '_format'
+NORMALISED = 'normalised'
+# the fields of an image entry which differ between the images of an object
+IMAGE_FIELDS = ('copyright', 'media_id', 'slider_order', 'see_also')
+
+
+def is_jsonl(filename):
+    """Check whether a harvest file uses the JSON Lines format."""
+    return bool(filename) and filename.endswith(JSONL_SUFFIX)
+
+
+def iter_harvest_items(filename):
+    """
+    Yield the top level items of a harvest file of either format.
+
+    For a normalised harvest file these are the object records, preceded by
+    the format marker.
+
+    :param filename: path to the harvest file
+    :return: iterator of (key, value) tuples
+    """
+    if not is_jsonl(filename):
+        data = json_codec.read_file(filename)
+        if FORMAT_KEY in data:
+            yield FORMAT_KEY, data.pop(FORMAT_KEY)
+        for key, value in data.items():
+            yield key, value
+        return
+
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                for key, value in json_codec.loads(line).items():
+                    yield key, value
+
+
+def iter_harvest_data(filename):
+    """
+    Yield the entries of a harvest file of either format.
+
+    JSON Lines files are read one line at a time and the records of a
+    normalised file are expanded one object at a time.
+
+    :param filename: path to the harvest file
+    :return: iterator of (key, entry) tuples
+    """
+    normalised = False
+    for key, value in iter_harvest_items(filename):
+        if key == FORMAT_KEY:
+            normalised = value == NORMALISED
+        elif normalised:
+            for image_key, entry in expand(value):
+                yield image_key, entry
+        else:
+            yield key, value
+
+
+def load_harvest_data(filename):
+    """
+    Load all entries of a harvest file of either format.
+
+    :return: dict of harvest key to entry. For a normalised file a
+        NormalisedHarvest, expanding the entries as they are accessed.
+    """
+    data = OrderedDict()
+    normalised = False
+    for key, value in iter_harvest_items(filename):
+        if key == FORMAT_KEY:
+            normalised = value == NORMALISED
+        else:
+            data[key] = value
+    if normalised:
+        return NormalisedHarvest(data)
+    return dict(data)
+
+
+def normalise(entries):
+    """
+    Combine the entries of the images of a single object into a record.
+
+    :param entries: iterable of (key, entry) tuples of the images
+    :return: dict with the shared 'object' data and the per image fields of
+        the 'images'
+    """
+    record = {'object': None, 'images': OrderedDict()}
+    for key, entry in entries:
+        if record['object'] is None:
+            record['object'] = {field: value for field, value in entry.items()
+                                if field not in IMAGE_FIELDS}
+        record['images'][key] = {field: entry[field] for field in IMAGE_FIELDS
+                                 if field in entry}
+    return record
+
+
+def normalise_data(data):
+    """
+    Normalise a dict of harvest entries, keeping their order.
+
+    :param data: dict of harvest key to entry
+    :return: OrderedDict of the format marker and the object records
+    """
+    objects = OrderedDict()
+    for key, entry in data.items():
+        objects.setdefault(object_uuid(key), []).append((key, entry))
+    normalised = OrderedDict([(FORMAT_KEY, NORMALISED)])
+    for uuid, entries in objects.items():
+        normalised[uuid] = normalise(entries)
+    return normalised
+
+
+def expand_image(record, key):
+    """Return the full entry of an image of a normalised object record."""
+    entry = dict(record['object'])
+    entry.update(record['images'][key])
+    return entry
+
+
+def image_keys(record):
+    """
+    Return the harvest keys of the images of an object record.
+
+    The keys are returned in slide order, see tie_order, as the order in
+    the file may be that of the sorted keys.
+    """
+    images = record['images']
+    return sorted(images, key=lambda key: tie_order(key, images[key]))
+
+
+def expand(record):
+    """Yield the (key, entry) tuples of all images of an object record."""
+    for key in image_keys(record):
+        yield key, expand_image(record, key)
+
+
+class NormalisedHarvest(Mapping):
+    """
+    Read-only dict of harvest key to entry backed by object records.
+
+    Each entry is expanded when accessed, sharing all values with the object
+    record, so the data of an object is only held in memory once.
+    """
+
+    def __init__(self, records):
+        """
+        Initialise the harvest.
+
+        :param records: dict of object uuid to object record
+        """
+        self.records = records
+        self.index = OrderedDict(
+            (key, uuid) for uuid, record in records.items()
+            for key in image_keys(record))
+
+    def __getitem__(self, key):
+        """Return the expanded entry of an image."""
+        return expand_image(self.records[self.index[key]], key)
+
+    def __iter__(self):
+        """Iterate over the harvest keys of all images."""
+        return iter(self.index)
+
+    def __len__(self):
+        """Return the number of images."""
+        return len(self.index)
+
+
+def object_uuid(key):
+    """Return the object uuid from a harvest key, '<uuid>_<image index>'."""
+    return key.rpartition('_')[0]
+
+
+def tie_order(key, entry):
+    """
+    Return the order of entries sharing the same sort key.
+
+    The images of an object are kept together, in slide order as in the
+    harvester, rather than in the order of their harvest keys which would
+    put '<uuid>_10' before '<uuid>_2'.
+    """
+    return object_uuid(key), entry.get('slider_order') or 0, key
+
+
+def dump_line(key, entry):
+    """
+    Return the JSON Lines representation of a harvest entry.
+
+    Uses the standard library so that harvest files are the same whichever
+    json codec is installed.
+    """
+    return json.dumps({key: entry}, sort_keys=True, ensure_ascii=False) + '\n'
+
+
+def read_lines(f):
+    """Yield the (key, entry) tuples of an open JSON Lines file."""
+    for line in f:
+        yield next(iter(json_codec.loads(line).items()))
+
+
+class JsonlHarvestWriter(object):
+    """
+    Write harvest entries to a JSON Lines file as they are produced.
+
+    Supports the subset of the dict interface the harvester uses for storing
+    entries. Storing the same key more than once keeps the last entry, even
+    if its sort key has changed, e.g. for an object parsed again after a
+    resume. Only the position of the last entry of each key is kept in
+    memory.
+    """
+
+    def __init__(self, filename, run_size=RUN_SIZE):
+        """
+        Initialise the writer, spilling entries next to the harvest file.
+
+        :param filename: path to the final harvest file
+        :param run_size: max number of entries to sort in memory at once
+        """
+        self.filename = filename
+        self.run_size = run_size
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.spill = tempfile.TemporaryFile(
+            'w+', encoding='utf-8', dir=self.directory)
+        self.num_written = 0
+        self.latest = {}  # key to the position of its last spilled entry
+
+    def __setitem__(self, key, entry):
+        """Spill an entry to disk."""
+        self.spill.write(json_codec.dumps({key: entry}) + '\n')
+        self.latest[key] = self.num_written
+        self.num_written += 1
+
+    def update(self, entries):
+        """Spill all entries of a dict to disk."""
+        for key, entry in entries.items():
+            self[key] = entry
+
+    def __len__(self):
+        """Return the number of entries written, including any repeats."""
+        return self.num_written
+
+    def save(self, sort_key, filename=None, transform=None,
+             normalised=False):
+        """
+        Sort all spilled entries and write the final harvest file.
+
+        :param sort_key: function returning the key to sort an entry by,
+            ties are ordered by tie_order
+        :param filename: path to write to, defaults to the one given on
+            initialisation
+        :param transform: function called with the key and entry of each
+            entry just before it is written, returning the entry to write
+        :param normalised: whether to write a normalised harvest file. As
+            the images of an object share the sort key and their harvest
+            keys start with the object uuid they are always sorted together.
+        :return: the number of entries written
+        """
+        self.spill.flush()
+        self.spill.seek(0)
+        runs = []
+        try:
+            # drop all but the last entry stored for each key
+            lines = (
+                (key, entry) for seq, (key, entry)
+                in enumerate(read_lines(self.spill))
+                if self.latest[key] == seq)
+            while True:
+                chunk = sorted(
+                    (as_sort_key(sort_key(entry)), tie_order(key, entry),
+                     key, entry)
+                    for key, entry in itertools.islice(lines, self.run_size))
+                if not chunk:
+                    break
+                runs.append(self.write_run(chunk))
+            return self.merge_runs(
+                runs, filename or self.filename, transform, normalised)
+        finally:
+            for run in runs:
+                run.close()
+            self.spill.close()
+
+    def write_run(self, chunk):
+        """Write a sorted chunk of entries to a temporary run file."""
+        run = tempfile.TemporaryFile(
+            'w+', encoding='utf-8', dir=self.directory)
+        for item in chunk:
+            run.write(json_codec.dumps(item) + '\n')
+        run.seek(0)
+        return run
+
+    @staticmethod
+    def merge_runs(runs, filename, transform=None, normalised=False):
+        """
+        Merge the sorted runs into the final harvest file.
+
+        :return: the number of entries written
+        """
+        merged = heapq.merge(
+            *[(tuple_keys(json_codec.loads(line)) for line in run)
+              for run in runs])
+        transform = transform or (lambda key, entry: entry)
+        num_entries = itertools.count()
+
+        def entries():
+            for sort_key, order, key, entry in merged:
+                next(num_entries)
+                yield key, transform(key, entry)
+
+        with open(filename, 'w', encoding='utf-8') as f:
+            if not normalised:
+                for key, entry in entries():
+                    f.write(dump_line(key, entry))
+            else:
+                f.write(dump_line(FORMAT_KEY, NORMALISED))
+                grouped = itertools.groupby(
+                    entries(), key=lambda item: object_uuid(item[0]))
+                for uuid, images in grouped:
+                    f.write(dump_line(uuid, normalise(images)))
+        return next(num_entries)
+
+
+def tuple_keys(item):
+    """Restore the tuples of a sort item read back from a run file."""
+    return (as_sort_key(item[0]), tuple(item[1])) + tuple(item[2:])
+
+
+def as_sort_key(value):
+    """
+    Make a value comparable to the same value after a json round trip.
+
+    Turns all lists into tuples, so that data loaded from file can be sorted
+    together with freshly harvested data.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(as_sort_key(v) for v in value)
+    return value
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Append-only journal of the progress of a harvest.
+
+Every processed object is written to the journal together with the entries
+it produced in the harvest data. Once all objects on a page of search
+results are processed the page is written to the journal as well, with the
+folder it belongs to and the search offset following it. If a harvest is
+interrupted the journal allows a new run to continue where the previous one
+stopped, without fetching or parsing any finished objects again.
+
+Only the uuids of the processed objects are kept in memory. The entries of
+the earlier run are read back from the journal file when resuming.
+
+The journal is stored as one json document per line. A partially written
+last line, e.g. from a process being killed mid-write, is discarded.
+"""
+import os
+from collections import OrderedDict
+
+try:
+    import importer.json_codec as json_codec
+except ImportError:  # run as a script from within the importer directory
+    import json_codec
+
+SUFFIX = '.journal'
+
+
+class HarvestJournal(object):
+    """The journal of a single harvest."""
+
+    def __init__(self, filename, resume=False):
+        """
+        Open the journal, truncating it unless resuming.
+
+        :param filename: path to the journal file
+        :param resume: whether to load the journal of an earlier run and
+            append to it
+        """
+        self.filename = filename
+        self.processed = set()  # uuids of the processed objects
+        self.offsets = {}  # folder uuid to the offset of its next page
+        self.folders = OrderedDict()  # folder uuid to the processed objects
+        if resume and os.path.exists(filename):
+            self.read()
+            self.file = open(filename, 'a', encoding='utf-8')
+        else:
+            self.file = open(filename, 'w', encoding='utf-8')
+
+    def read(self):
+        """Load the journal of an earlier run, dropping any partial line."""
+        valid_length = 0
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json_codec.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid_length += len(line)
+                if 'offset' in entry:
+                    self.add_page(entry.get('folder'), entry.get('offset'),
+                                  entry.get('uuids'))
+                else:
+                    self.processed.add(entry.get('uuid'))
+        with open(self.filename, 'r+b') as f:
+            f.truncate(valid_length)
+
+    def add_page(self, folder, offset, uuids):
+        """Add a processed page of search results to the progress."""
+        self.offsets[folder] = offset
+        self.folders.setdefault(folder, []).extend(uuids or [])
+
+    def offset(self, folder):
+        """Return the search offset up to which a folder is processed."""
+        return self.offsets.get(folder, 0)
+
+    def has(self, uuid):
+        """Check whether an object was already processed."""
+        return uuid in self.processed
+
+    def iter_records(self):
+        """
+        Yield the journaled objects, as read from the journal file.
+
+        :return: iterator of tuples of uuid and dict of harvest entries
+        """
+        self.file.flush()
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                entry = json_codec.loads(line)
+                if 'offset' not in entry:
+                    yield entry.get('uuid'), entry.get('records')
+
+    def record_object(self, uuid, records):
+        """
+        Record that an object has been processed.
+
+        :param uuid: the uuid of the object
+        :param records: dict of the harvest entries stored for the object
+        """
+        self.processed.add(uuid)
+        self.write({'uuid': uuid, 'records': records})
+
+    def record_page(self, folder, offset, uuids):
+        """
+        Record that all objects on a page of search results are processed.
+
+        The journal is synced to disk at this point.
+
+        :param folder: the uuid of the folder being harvested
+        :param offset: the search offset following the page
+        :param uuids: the uuids of the objects on the page
+        """
+        self.add_page(folder, offset, uuids)
+        self.write({'folder': folder, 'offset': offset, 'uuids': uuids})
+        os.fsync(self.file.fileno())
+
+    def write(self, entry):
+        """Append an entry to the journal."""
+        self.file.write(json_codec.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        """Close the journal file."""
+        self.file.close()
+
+    def remove(self):
+        """Close and delete the journal once the harvest is complete."""
+        self.close()
+        os.remove(self.filename)
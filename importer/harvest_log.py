@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Log backends for the harvester and make_glam_info.
+
+The 'plain' backend is the LogFile of BatchUploadTools, which writes every
+line as it is logged. With many objects processed in parallel this makes the
+log a point where all threads wait on each other.
+
+The 'buffered' backend instead keeps the records in memory and writes them
+in batches on a background thread, at least every FLUSH_INTERVAL seconds.
+The plain text log is the same as for the 'plain' backend. Optionally each
+record is also written, as a json document with the 'time', 'uuid', 'stage'
+and 'message' of the record, to a JSON Lines file next to it. Terminal
+output of verbose runs can be passed through the same thread.
+"""
+import atexit
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pywikibot
+
+import batchupload.common as common
+
+try:
+    import importer.json_codec as json_codec
+except ImportError:  # run as a script from within the importer directory
+    import json_codec
+
+LOG_BACKENDS = ('plain', 'buffered')
+FLUSH_INTERVAL = 0.5  # max seconds between writes of the buffered records
+MAX_RECORDS = 1000  # records which trigger a write before the interval ends
+
+
+class BufferedLog(object):
+    """
+    A log which writes its records in batches on a background thread.
+
+    Offers the same methods as LogFile, with the uuid and stage of a record
+    as optional extra arguments.
+    """
+
+    def __init__(self, log, json_file=None, flush_interval=None,
+                 max_records=None):
+        """
+        Initialise the log and start its writer thread.
+
+        :param log: the plain text log to write to, e.g. a LogFile
+        :param json_file: path to a JSON Lines file to also write the
+            records to, if any
+        :param flush_interval: max seconds between writes, defaults to
+            FLUSH_INTERVAL
+        :param max_records: number of records which trigger a write,
+            defaults to MAX_RECORDS
+        """
+        self.log = log
+        self.json_file = json_file
+        self.json = None
+        if json_file:
+            self.json = open(json_file, 'a', encoding='utf-8')
+        self.flush_interval = flush_interval or FLUSH_INTERVAL
+        self.max_records = max_records or MAX_RECORDS
+        self.error = None  # any exception raised by the writer thread
+        # appending to a deque is thread safe, so writing a record needs no
+        # lock. Records are tuples of time, message, uuid, stage and
+        # whether to output rather than log it, or an Event set once all
+        # earlier records have been written.
+        self._records = deque()
+        self._wake = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(
+            target=self.run, name='BufferedLog', daemon=True)
+        self._thread.start()
+        # write any remaining records if the run ends without closing
+        atexit.register(self.flush)
+
+    def add(self, record):
+        """Buffer a record, waking the writer if enough are waiting."""
+        self._records.append(record)
+        if len(self._records) >= self.max_records:
+            self._wake.set()
+
+    def write(self, text, uuid=None, stage=None):
+        """
+        Add a line to the log.
+
+        :param text: the line to log
+        :param uuid: the uuid of the object the line is about, if any
+        :param stage: the stage of the run which logged the line, if any
+        """
+        self.add((time.time(), text, uuid, stage, False))
+
+    def write_w_timestamp(self, text, uuid=None, stage=None):
+        """Add a line, prefixed by the current time, to the log."""
+        self.write('{0}: {1}'.format(datetime.now(), text), uuid, stage)
+
+    def output(self, text):
+        """Output a line to the terminal, without logging it."""
+        self.add((time.time(), text, None, None, True))
+
+    def run(self):
+        """Write the buffered records until the log is closed."""
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closing
+            records = []
+            for i in range(len(self._records)):
+                record = self._records.popleft()
+                if isinstance(record, threading.Event):
+                    self.write_records(records)
+                    records = []
+                    record.set()
+                else:
+                    records.append(record)
+            self.write_records(records)
+            if closing:
+                return
+
+    def write_records(self, records):
+        """Write a batch of records to the log, and the json file if any."""
+        if not records:
+            return
+        try:
+            lines = [text for created, text, uuid, stage, to_output
+                     in records if not to_output]
+            if lines:
+                self.log.write('\n'.join(lines))
+            for created, text, uuid, stage, to_output in records:
+                if to_output:
+                    pywikibot.output(text)
+                elif self.json:
+                    self.json.write(json_codec.dumps({
+                        'time': datetime.fromtimestamp(created).isoformat(),
+                        'uuid': uuid,
+                        'stage': stage,
+                        'message': text
+                    }) + '\n')
+            if self.json:
+                self.json.flush()
+        except Exception as e:  # reported by flush and close
+            self.error = e
+
+    def flush(self):
+        """Wait until all records logged so far have been written."""
+        if self._thread.is_alive():
+            written = threading.Event()
+            self.add(written)
+            self._wake.set()
+            while not (written.wait(self.flush_interval)
+                       or not self._thread.is_alive()):
+                pass
+        if self.error:
+            raise self.error
+
+    def close_and_confirm(self):
+        """
+        Write all records, stop the writer thread and close the log.
+
+        :return: the confirmation of the plain text log
+        """
+        self._closing = True
+        self._wake.set()
+        self._thread.join()
+        atexit.unregister(self.flush)
+        if self.json:
+            self.json.close()
+        if self.error:
+            raise self.error
+        return self.log.close_and_confirm()
+
+
+def make_log(filename, backend=None, json_file=None):
+    """
+    Open a log using the given backend.
+
+    :param filename: path to the plain text log
+    :param backend: one of LOG_BACKENDS, defaults to 'plain' unless a
+        json_file is given
+    :param json_file: path to a JSON Lines file to also write the records
+        to, only supported by the 'buffered' backend
+    """
+    backend = backend or ('buffered' if json_file else 'plain')
+    if backend not in LOG_BACKENDS:
+        raise pywikibot.Error(
+            'Unknown log backend "{0}", expected one of: {1}'.format(
+                backend, ', '.join(LOG_BACKENDS)))
+    if json_file and backend != 'buffered':
+        raise pywikibot.Error(
+            'A json log file requires the buffered log backend')
+    log = common.LogFile('', filename)
+    if backend == 'buffered':
+        return BufferedLog(log, json_file)
+    return log
+
+
+def write(log, text, stage=None, uuid=None):
+    """
+    Add a line to a log of any backend.
+
+    :param log: the log
+    :param text: the line to log
+    :param stage: the stage of the run which logged the line, if any
+    :param uuid: the uuid of the object the line is about, if any
+    """
+    if isinstance(log, BufferedLog):
+        log.write(text, uuid, stage)
+    else:
+        log.write(text)
+
+
+def output(log, text):
+    """Output a line to the terminal, through the log if it is buffered."""
+    if isinstance(log, BufferedLog):
+        log.output(text)
+    else:
+        pywikibot.output(text)
@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Staged pipeline harvest engine for DiMuHarvester.
+
+Splits the harvest into separate I/O and CPU stages so that both can be kept
+busy:
+
+* a producer thread pages through the search results and queues the objects
+  to fetch,
+* `io_workers` threads fetch the raw object data, together with the DiMu
+  codes of any exhibitions of the object, and hand it to
+* `parse_workers` processes which parse the objects, while
+* a single writer, on the calling thread, stores the results in search
+  order.
+
+The stages are connected by bounded queues and at most `queue_size` objects
+are ever fetched but not yet stored, so a slow stage holds back the earlier
+ones rather than letting work pile up in memory. As results are stored in
+search order, using the harvester's own methods, the harvest file is the
+same as for a synchronous run.
+"""
+import multiprocessing
+import queue
+import threading
+from concurrent import futures
+
+try:
+    import importer.exhibition_store as exhibition_store
+except ImportError:  # run as a script from within the importer directory
+    import exhibition_store
+
+DEFAULT_QUEUE_SIZE = 200
+STOP_CHECK_INTERVAL = 0.5  # seconds between checks for a failed writer
+
+_parser = None  # the ParseHarvester of a parse worker process
+
+
+class PipelineStopped(Exception):
+    """Raised in the producer when the pipeline is stopped early."""
+
+
+class PipelineHarvestEngine(object):
+    """Run a DiMuHarvester harvest as a pipeline of I/O and CPU stages."""
+
+    def __init__(self, harvester, io_workers=None, parse_workers=None,
+                 queue_size=None):
+        """
+        Initialise the engine.
+
+        :param harvester: the DiMuHarvester in which to store the results
+        :param io_workers: number of threads fetching objects
+        :param parse_workers: number of processes parsing objects, defaults
+            to the number of cpus
+        :param queue_size: max number of objects fetched or being fetched
+            but not yet stored
+        """
+        self.harvester = harvester
+        self.io_workers = io_workers or 1
+        self.parse_workers = parse_workers or multiprocessing.cpu_count()
+        self.queue_size = max(queue_size or DEFAULT_QUEUE_SIZE,
+                              self.io_workers)
+        self.pool = None
+        self.fetch_queue = None
+        self.pages = None  # queue of pages waiting to be stored, in order
+        self.slots = None  # limits the number of objects in flight
+        self.stopping = None  # set if the writer failed
+
+    def load_collection(self, idno):
+        """
+        Process the collection/folder with the given id.
+
+        :param idno: either the uuid or uniqueId for the folder
+        """
+        self.run(self.produce_pages, idno)
+
+    def load_uuid_list(self, uuid_list):
+        """Process a list of image uuids instead of starting from a folder."""
+        self.run(self.produce_uuids, list(uuid_list))
+
+    def run(self, producer, *args):
+        """
+        Run the pipeline until the producer is done and all is stored.
+
+        :param producer: the method queueing the work
+        :param args: arguments for the producer
+        """
+        self.fetch_queue = queue.Queue(maxsize=self.queue_size)
+        self.pages = queue.Queue()
+        self.slots = threading.Semaphore(self.queue_size)
+        self.stopping = threading.Event()
+        # spawn rather than fork, since the parent process has threads
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(
+            self.parse_workers, init_parser, (self.harvester.settings,))
+        with self.pool:
+            threads = [threading.Thread(target=self.fetch_objects)
+                       for i in range(self.io_workers)]
+            threads.append(threading.Thread(
+                target=self.produce, args=(producer, args)))
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            try:
+                self.write_pages()
+            except BaseException:
+                self.stopping.set()
+                raise
+            finally:
+                for i in range(self.io_workers):
+                    self.fetch_queue.put(None)
+                for thread in threads:
+                    thread.join()
+
+    def produce(self, producer, args):
+        """Run the producer, passing any error on to the writer."""
+        try:
+            producer(*args)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            self.pages.put(e)
+        else:
+            self.pages.put(None)
+
+    def produce_pages(self, idno):
+        """
+        Queue all objects of the collection/folder, one page at a time.
+
+        :param idno: either the uuid or uniqueId for the folder
+        """
+        for offset, uuids in self.harvester.iter_collection_pages(idno):
+            self.queue_objects(
+                self.harvester.add_to_folder(
+                    self.harvester.folder_uuid, uuids),
+                offset, uuids)
+
+    def produce_uuids(self, uuids):
+        """Queue all objects of a list of uuids."""
+        self.queue_objects(uuids)
+
+    def queue_objects(self, uuids, offset=None, page_uuids=None):
+        """
+        Queue the objects which must be fetched, and the page to store.
+
+        Blocks while the pipeline is full.
+
+        :param uuids: list of item uuids to process
+        :param offset: the search offset following the page, if any
+        :param page_uuids: all uuids on the page, for the journal
+        """
+        reused = self.harvester.find_reusable(uuids)
+        results = queue.Queue()
+        self.pages.put((uuids, reused, results, offset, page_uuids))
+        for uuid in uuids:
+            if uuid in reused:
+                continue
+            while not self.slots.acquire(timeout=STOP_CHECK_INTERVAL):
+                if self.stopping.is_set():
+                    raise PipelineStopped()
+            result = futures.Future()
+            results.put(result)
+            self.fetch_queue.put((uuid, result))
+        results.put(None)  # all objects of the page are queued
+
+    def fetch_objects(self):
+        """
+        Fetch objects and hand them to the parse workers until stopped.
+
+        Runs on each of the I/O threads.
+        """
+        while True:
+            item = self.fetch_queue.get()
+            if item is None:
+                return
+            uuid, result = item
+            if self.stopping.is_set():
+                result.cancel()
+                continue
+            try:
+                self.fetch_object(uuid, result)
+            except Exception as e:
+                result.set_exception(e)
+
+    def fetch_object(self, uuid, result):
+        """
+        Fetch an object and queue it for parsing.
+
+        :param uuid: the uuid of the item
+        :param result: future for the raw and parsed data of the item
+        """
+        data = self.harvester.load_single_object(uuid)
+        if data is None:
+            result.set_result((None, None, [], {}, 0))
+            return
+        codes = {
+            exh_uuid: self.harvester.get_exhibition_code(exh_uuid)
+            for exh_uuid in exhibition_store.exhibition_uuids([data])}
+        self.pool.apply_async(
+            parse_object, (data, codes),
+            callback=lambda parsed: result.set_result((data,) + parsed),
+            error_callback=result.set_exception)
+
+    def write_pages(self):
+        """Store the objects of each page in order, as they are parsed."""
+        while True:
+            page = self.pages.get()
+            if page is None:
+                return
+            if isinstance(page, Exception):
+                raise page
+            uuids, reused, results, offset, page_uuids = page
+            self.harvester.store_results(
+                uuids, reused, self.iter_results(results))
+            if page_uuids is not None:
+                self.harvester.record_page(offset, page_uuids)
+
+    def iter_results(self, results):
+        """
+        Yield the raw and parsed data of the objects on a page, in order.
+
+        The lines logged while parsing are written to the harvest log and
+        any unhandled keys found are added to the harvester's tally.
+
+        :param results: queue of futures for the results, in order, ending
+            with None
+        """
+        for result in iter(results.get, None):
+            data, parsed_data, log_lines, unknown_keys, duration = (
+                result.result())
+            self.slots.release()
+            uuid = (data or {}).get('uuid')
+            for line in log_lines:
+                self.harvester.write_log(line, 'parse', uuid)
+            self.harvester.unknown_keys.update(unknown_keys)
+            if parsed_data is not None:
+                self.harvester.stats.add('parse', duration)
+            yield data, parsed_data
+
+
+def init_parser(settings):
+    """Create the harvester used by a parse worker process."""
+    global _parser
+    try:
+        import importer.harvest_replay as harvest_replay
+    except ImportError:  # run as a script from within the importer directory
+        import harvest_replay
+    _parser = harvest_replay.ParseHarvester(
+        dict(settings, harvest_file=None), log=harvest_replay.LogCollector())
+
+
+def parse_object(data, exhibition_codes):
+    """
+    Parse an object in a parse worker process.
+
+    :param data: the raw data for the item
+    :param exhibition_codes: dict of the DiMu codes of the exhibitions of
+        the object
+    :return: tuple of the parsed data, the logged lines, the tally of
+        unhandled keys and the seconds spent parsing
+    """
+    parsed_data = _parser.parse_object(data, exhibition_codes)
+    duration = sum(_parser.stats.durations.get('parse', []))
+    _parser.stats.durations.clear()
+    return (parsed_data, _parser.log.take(), _parser.unknown_keys.take(),
+            duration)
@@ -0,0 +1,314 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Rebuild a harvest file from the local cache, without any network requests.
+
+Useful after a change to the parsing of the DiMu data. The raw artifacts in
+the local cache are parsed again, spread over a pool of processes, and a
+fresh harvest file is written. Exhibition codes are taken from the
+exhibition store, or from cached exhibition artifacts, and are never
+fetched.
+
+By default all cached objects of a supported type which have images are
+replayed. Use -objects to only replay the objects of an earlier harvest, in
+which case the folders in which they were found are kept too.
+
+usage:
+    python importer/harvest_replay.py [OPTIONS]
+
+&params;
+"""
+import collections
+import multiprocessing
+import os
+import sys
+from datetime import datetime
+
+import pywikibot
+
+try:
+    import importer.DiMuHarvester as DiMuHarvester
+    import importer.exhibition_store as exhibition_store
+    import importer.harvest_io as harvest_io
+except ImportError:  # run as a script from within the importer directory
+    import DiMuHarvester
+    import exhibition_store
+    import harvest_io
+
+CHUNK_SIZE = 64  # objects sent to a worker process at a time
+PARAMETER_HELP = u"""\
+Replay options:
+-processes:INT         number of worker processes (DEF: number of cpus)
+-objects:PATH          earlier harvest file whose objects should be replayed. \
+All cached objects are replayed if not present
+
+The DiMuHarvester options for the harvest file, the log (-harvest_log_file, \
+-log_backend and -log_json_file), the cache \
+(-cache_backend, -cache_path and -cache_compress), the exhibition store \
+(-exhibition_file) as well as -all_slides and -verbose are also used.
+"""
+__doc__ = __doc__.replace('&params;', PARAMETER_HELP)
+
+_worker = None  # the ReplayHarvester of a worker process
+
+
+class LogCollector(object):
+    """Stand-in for a log file, keeping the lines until they are taken."""
+
+    def __init__(self):
+        """Initialise an empty log."""
+        self.lines = []
+
+    def write(self, text):
+        """Add a line to the log."""
+        self.lines.append(text)
+
+    def write_w_timestamp(self, text):
+        """Add a line, prefixed by the current time, to the log."""
+        self.write('{0}: {1}'.format(datetime.now(), text))
+
+    def take(self):
+        """Return and forget all lines collected so far."""
+        lines, self.lines = self.lines, []
+        return lines
+
+
+class ParseHarvester(DiMuHarvester.DiMuHarvester):
+    """
+    A harvester which only parses the raw data handed to it.
+
+    Unlike the normal harvester it neither configures the http session nor
+    opens a journal or the cache. The exhibition codes needed for an object
+    are supplied together with its raw data, see parse_object.
+    """
+
+    def __init__(self, options, log=None):
+        """
+        Initialise the harvester.
+
+        :param options: the harvester settings
+        :param log: the log to write to, the harvest log if not given
+        """
+        self.init_parsing(options)
+        self.log = log or self.make_log()
+        self.exhibition_codes = {}  # of the object being parsed
+
+    def get_exhibition_code(self, exh_uuid):
+        """Return the supplied DiMu code for an exhibition."""
+        return self.exhibition_codes.get(exh_uuid)
+
+    def parse_object(self, raw_data, exhibition_codes):
+        """
+        Parse the json for a single object, timing it in the stats.
+
+        :param raw_data: the raw data for the item
+        :param exhibition_codes: dict of the DiMu codes of the exhibitions
+            of the object
+        """
+        self.exhibition_codes = exhibition_codes
+        return self.timed_parse(raw_data)
+
+
+class ReplayHarvester(ParseHarvester):
+    """
+    A harvester which only reads from the local cache.
+
+    Any object or exhibition not found in the cache, or the exhibition
+    store, is logged as a failure rather than fetched.
+    """
+
+    def __init__(self, options, log=None):
+        """
+        Initialise the harvester.
+
+        :param options: the harvester settings
+        :param log: the log to write to, the harvest log if not given
+        """
+        super(ReplayHarvester, self).__init__(options, log)
+        self.store = self.make_cache_store()
+        self.exhibitions = exhibition_store.ExhibitionStore(
+            self.settings.get('exhibition_file')
+            or DiMuHarvester.EXHIBITION_FILE,
+            self.fetch_exhibition_code)
+
+    def load_single_object(self, uuid):
+        """
+        Load the data for a single object from the local cache.
+
+        The last modified timestamp cached with the object is kept in
+        search_stamps, so that it is stored with the entries as in a normal
+        harvest.
+
+        :param uuid: the uuid for the item
+        :return: the data, None if it is not cached
+        """
+        with self.stats.timer('object_load'):
+            data, meta = self.store.get(uuid)
+        if data is None:
+            self.write_log('{}: not in the local cache'.format(uuid), 'load',
+                           uuid)
+        else:
+            self.search_stamps[uuid] = meta.get('updated')
+        return data
+
+    def close_store(self):
+        """Close the cache, e.g. before forking worker processes."""
+        if hasattr(self.store, 'close'):
+            self.store.close()
+
+    def cached_objects(self):
+        """Return the uuids of all cached artifacts, in a stable order."""
+        return sorted(self.store.uuids())
+
+    def harvested_objects(self, filename):
+        """
+        Return the uuids of the objects in an earlier harvest.
+
+        The folders in which the objects were found are kept for the new
+        harvest.
+
+        :param filename: path to the harvest file
+        """
+        objects = load_objects(filename)
+        for uuid, folders in objects.items():
+            for folder_uuid in folders:
+                self.add_to_folder(folder_uuid, [uuid])
+        return list(objects)
+
+    def replay_object(self, uuid):
+        """
+        Parse a cached object, returning its harvest entries.
+
+        Artifacts which are not objects of a supported type with images,
+        e.g. cached exhibitions, are skipped.
+
+        :param uuid: the uuid of the item
+        :return: dict of the entries, None if the object could not be loaded
+        """
+        data = self.load_single_object(uuid)
+        if data is None:
+            return None
+        if not (data.get('artifactType') in DiMuHarvester.SUPPORTED_TYPES
+                and (data.get('media') or {}).get('pictures')):
+            return {}
+        codes = {exh_uuid: self.exhibitions.get(exh_uuid) for exh_uuid
+                 in exhibition_store.exhibition_uuids([data])}
+        self.data = {}
+        self.store_object(uuid, data, self.parse_object(data, codes))
+        self.search_stamps.pop(uuid, None)
+        return self.data
+
+    def replay(self, uuids, processes=None):
+        """
+        Replay the given objects using a pool of worker processes.
+
+        The entries are stored in the order of the uuids, as are the lines
+        logged by the workers. Any unhandled keys found by the workers are
+        added to the tally of the harvester.
+
+        :param uuids: list of item uuids
+        :param processes: number of worker processes, defaults to the
+            number of cpus
+        """
+        self.close_store()
+        with multiprocessing.Pool(processes, init_worker,
+                                  (self.settings,)) as pool:
+            results = pool.imap(replay_object, uuids, CHUNK_SIZE)
+            for uuid, result in zip(uuids, results):
+                entries, log_lines, unknown_keys, duration = result
+                for line in log_lines:
+                    self.write_log(line, 'parse', uuid)
+                self.unknown_keys.update(unknown_keys)
+                if entries is None:
+                    self.stats.count('failed_objects')
+                    continue
+                if entries:
+                    self.stats.count('objects')
+                    self.stats.add('parse', duration)
+                    self.data.update(entries)
+
+
+def init_worker(settings):
+    """Create the harvester used by a worker process."""
+    global _worker
+    # entries are returned to the main process rather than written
+    _worker = ReplayHarvester(
+        dict(settings, harvest_file=None), log=LogCollector())
+
+
+def replay_object(uuid):
+    """
+    Replay an object in a worker process.
+
+    :param uuid: the uuid of the item
+    :return: tuple of the entries (see ReplayHarvester.replay_object), the
+        logged lines, the tally of unhandled keys and the seconds spent
+        parsing
+    """
+    entries = _worker.replay_object(uuid)
+    duration = sum(_worker.stats.durations.get('parse', []))
+    _worker.stats.durations.clear()
+    return (entries, _worker.log.take(), _worker.unknown_keys.take(),
+            duration)
+
+
+def load_objects(filename):
+    """
+    Load the objects of an earlier harvest and the folders they were in.
+
+    :param filename: path to the harvest file
+    :return: OrderedDict of object uuids to lists of folder uuids
+    """
+    objects = collections.OrderedDict()
+    for key, entry in harvest_io.iter_harvest_data(filename):
+        objects.setdefault(
+            harvest_io.object_uuid(key), entry.get('folders') or [])
+    return objects
+
+
+def handle_args(args):
+    """
+    Separate the replay options from the harvester options.
+
+    :param args: arguments to be handled
+    :return: tuple of a dict of replay options and the remaining arguments
+    """
+    options = {}
+    harvester_args = []
+    for arg in args:
+        option, sep, value = arg.partition(':')
+        if option == '-processes':
+            options['processes'] = int(value)
+        elif option == '-objects':
+            options['objects'] = value
+        elif option in ('-help', '-h'):
+            pywikibot.output(__doc__)
+            exit()
+        else:
+            harvester_args.append(arg)
+    return options, harvester_args
+
+
+def main(*args):
+    """Replay the cached objects, writing a new harvest file."""
+    options, harvester_args = handle_args(args)
+    settings = DiMuHarvester.load_settings(harvester_args)
+    harvester = ReplayHarvester(settings)
+    harvester.log.write_w_timestamp('Replay started...')
+
+    if options.get('objects'):
+        uuids = harvester.harvested_objects(options.get('objects'))
+    else:
+        uuids = harvester.cached_objects()
+
+    pywikibot.output('Replaying {} cached artifacts'.format(len(uuids)))
+    harvester.replay(uuids, options.get('processes') or os.cpu_count())
+    harvester.report_unknown_keys()
+    harvester.save_data()
+    harvester.stats.write(harvester.stats_file(), images=len(harvester.data))
+    harvester.log.write_w_timestamp('...Replay finished\n')
+    pywikibot.output(harvester.log.close_and_confirm())
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
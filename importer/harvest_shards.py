@@ -0,0 +1,234 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Split a harvest into shards and merge the harvest files of the shards.
+
+A very large harvest may be spread over several runs, e.g. on different
+machines using different API keys, by giving each run a shard, -shard:i/N
+with 0 <= i < N, to DiMuHarvester. A run then only processes the objects
+whose uuid hashes to its shard and uses its own harvest file, journal, log
+and cache, named after the shard (see shard_path). As the shard of an
+object only depends on its uuid every object is harvested by exactly one
+shard.
+
+Once all shards are done their harvest files are merged into one, ordered
+by glam_id like the harvest file of a single run. Either give the number of
+shards, to merge the shard files of the harvest file, or list the files to
+merge:
+
+usage:
+    python importer/harvest_shards.py -shards:N [OPTIONS]
+    python importer/harvest_shards.py -in_files:PATH,PATH [OPTIONS]
+
+&params;
+"""
+import hashlib
+import os
+import sys
+from collections import OrderedDict
+
+import pywikibot
+
+import batchupload.common as common
+
+try:
+    import importer.harvest_io as harvest_io
+except ImportError:  # run as a script from within the importer directory
+    import harvest_io
+
+SHARD_FORMAT = 'shard-{0}-of-{1}'
+DEFAULT_OPTIONS = {
+    'harvest_file': None,
+    'shards': None,
+    'in_files': None,
+    'normalise': False
+}
+PARAMETER_HELP = u"""\
+Merge options:
+-harvest_file:PATH     path to the merged harvest file. If it ends in \
+".jsonl" the JSON Lines format is used (DEF: that of DiMuHarvester)
+-shards:INT            number of shards the harvest was split into. The \
+files of all shards of the harvest file are merged (DEF: {shards})
+-in_files:PATH,PATH    comma separated harvest files to merge, instead of \
+using -shards (DEF: {in_files})
+-normalise:BOOL        whether to write a normalised harvest file \
+(DEF: {normalise})
+"""
+__doc__ = __doc__.replace(
+    '&params;', PARAMETER_HELP.format(**DEFAULT_OPTIONS))
+
+
+def parse_shard(value):
+    """
+    Parse a shard setting.
+
+    :param value: the shard as "i/N", or as a list or tuple of i and N
+    :return: tuple of the shard index and the number of shards, None if no
+        shard is given
+    """
+    if not value:
+        return None
+    try:
+        if isinstance(value, (list, tuple)):
+            index, count = (int(v) for v in value)
+        else:
+            index, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise ValueError(
+            'Could not interpret the shard "{}", expected "i/N"'.format(
+                value))
+    if not 0 <= index < count:
+        raise ValueError(
+            'The shard index must be at least 0 and less than the number '
+            'of shards, not "{}"'.format(value))
+    return index, count
+
+
+def shard_of(uuid, count):
+    """
+    Return the shard of an object.
+
+    Uses a hash which is stable between runs and machines.
+
+    :param uuid: the uuid of the object
+    :param count: the number of shards
+    """
+    digest = hashlib.sha1(uuid.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def in_shard(uuid, shard):
+    """
+    Check whether an object belongs to a shard.
+
+    :param uuid: the uuid of the object
+    :param shard: tuple of the shard index and the number of shards
+    """
+    index, count = shard
+    return shard_of(uuid, count) == index
+
+
+def shard_path(path, shard):
+    """
+    Return the path of a file or directory of a shard.
+
+    The shard is added before any extension, e.g.
+    "dimu_harvest_data.shard-0-of-4.json".
+
+    :param path: the path used by an unsharded harvest
+    :param shard: tuple of the shard index and the number of shards
+    """
+    root, ext = os.path.splitext(path)
+    return '{0}.{1}{2}'.format(root, SHARD_FORMAT.format(*shard), ext)
+
+
+def shard_files(filename, count):
+    """Return the harvest files of all shards of a harvest file."""
+    return [shard_path(filename, (index, count)) for index in range(count)]
+
+
+def merge_shards(in_files, filename, normalised=False, count=None):
+    """
+    Merge the harvest files of several shards.
+
+    The entries are ordered by glam_id, and then by object and slide (see
+    harvest_io.tie_order), so the result does not depend on the order in
+    which the files are given.
+
+    :param in_files: list of paths to the harvest files of the shards, in
+        shard order if count is given
+    :param filename: path to the merged harvest file
+    :param normalised: whether to write a normalised harvest file
+    :param count: the number of shards, if given all entries are checked to
+        be in the shard of their file
+    :return: the number of merged entries
+    """
+    missing = [in_file for in_file in in_files if not os.path.isfile(in_file)]
+    if missing:
+        raise pywikibot.Error('Missing harvest files: {}'.format(
+            ', '.join(missing)))
+
+    if harvest_io.is_jsonl(filename):
+        data = harvest_io.JsonlHarvestWriter(filename)
+    else:
+        data = {}
+    keys = set()
+    for index, in_file in enumerate(in_files):
+        for key, entry in harvest_io.iter_harvest_data(in_file):
+            if key in keys:
+                raise pywikibot.Error(
+                    '{0}: found in more than one harvest file, the last '
+                    'being {1}'.format(key, in_file))
+            if count and not in_shard(
+                    harvest_io.object_uuid(key), (index, count)):
+                raise pywikibot.Error(
+                    '{0}: does not belong to the shard of {1}'.format(
+                        key, in_file))
+            keys.add(key)
+            data[key] = entry
+
+    if isinstance(data, harvest_io.JsonlHarvestWriter):
+        return data.save(lambda entry: entry.get('glam_id'),
+                         normalised=normalised)
+
+    sorted_data = OrderedDict(
+        (key, data[key]) for key in sorted(
+            data, key=lambda key: (
+                harvest_io.as_sort_key(data[key].get('glam_id')),
+                harvest_io.tie_order(key, data[key]))))
+    if normalised:
+        sorted_data = harvest_io.normalise_data(sorted_data)
+    common.open_and_write_file(filename, sorted_data, as_json=True)
+    return len(keys)
+
+
+def handle_args(args):
+    """
+    Parse the command line arguments.
+
+    :return: dict of options, None if the usage should be shown
+    """
+    options = DEFAULT_OPTIONS.copy()
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        key = option[1:]
+        if key not in options:
+            return None
+        if key == 'shards':
+            options[key] = int(value)
+        elif key == 'normalise':
+            options[key] = common.interpret_bool(value)
+        elif key == 'in_files':
+            options[key] = [
+                path.strip() for path in value.split(',') if path.strip()]
+        else:
+            options[key] = common.convert_from_commandline(value)
+    if not (options.get('shards') or options.get('in_files')):
+        return None
+    return options
+
+
+def main(*args):
+    """Merge the harvest files of the shards."""
+    options = handle_args(args)
+    if options is None:
+        pywikibot.output(__doc__)
+        return
+
+    try:
+        import importer.DiMuHarvester as DiMuHarvester
+    except ImportError:  # run as a script from within the importer directory
+        import DiMuHarvester
+    filename = options.get('harvest_file') or DiMuHarvester.HARVEST_FILE
+    in_files = options.get('in_files') or shard_files(
+        filename, options.get('shards'))
+
+    num_entries = merge_shards(
+        in_files, filename, options.get('normalise'),
+        None if options.get('in_files') else options.get('shards'))
+    pywikibot.output('{0} created with {1} entries from {2} files'.format(
+        filename, num_entries, len(in_files)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Timing and counting of the stages of a harvest.
+
+Each stage, e.g. requesting a search page or parsing an object, is timed
+every time it runs. At the end of a run the counts, total time and latency
+percentiles of every stage are written as a json report, together with any
+other counters and the throughput of the run.
+"""
+import json
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class HarvestStats(object):
+    """Thread-safe collection of stage timings and counters."""
+
+    def __init__(self):
+        """Initialise empty stats, starting the clock for the run."""
+        self.started = time.time()
+        self.durations = defaultdict(list)  # stage to list of seconds
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the enclosed block as one run of the given stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, duration):
+        """Record one run of a stage which took the given seconds."""
+        with self._lock:
+            self.durations[stage].append(duration)
+
+    def count(self, name, value=1):
+        """Add to a counter."""
+        with self._lock:
+            self.counts[name] += value
+
+    def stage_report(self, stage):
+        """Return the count, total and latency percentiles of a stage."""
+        with self._lock:
+            durations = sorted(self.durations.get(stage, []))
+        report = {
+            'count': len(durations),
+            'total': sum(durations),
+            'mean': sum(durations) / len(durations) if durations else None,
+            'max': durations[-1] if durations else None
+        }
+        for p in PERCENTILES:
+            report['p{}'.format(p)] = percentile(durations, p)
+        return report
+
+    def report(self, **extra):
+        """
+        Return the full report as a dict.
+
+        :param extra: any additional top level entries, e.g. cache counts
+        """
+        duration = time.time() - self.started
+        with self._lock:
+            stages = sorted(self.durations)
+            counts = dict(self.counts)
+        report = {
+            'started': self.started,
+            'duration': duration,
+            'stages': {stage: self.stage_report(stage) for stage in stages},
+            'counts': counts,
+            'objects_per_second': (
+                counts.get('objects', 0) / duration if duration else None)
+        }
+        report.update(extra)
+        return report
+
+    def write(self, filename, **extra):
+        """Write the full report to a json file."""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.report(**extra), f, sort_keys=True, indent=4)
+
+
+class UnknownKeys(object):
+    """
+    Thread-safe tally of unhandled keys found in the harvested objects.
+
+    Rather than warning about every object, the number of objects in which
+    each key was found, and the first such object, are kept and reported
+    once for the whole run.
+    """
+
+    def __init__(self):
+        """Initialise an empty tally."""
+        self.counts = Counter()
+        self.examples = {}  # key to the uuid of the first object with it
+        self._lock = threading.Lock()
+
+    def add(self, key, uuid):
+        """Record that an object contained the given key."""
+        with self._lock:
+            self.counts[key] += 1
+            self.examples.setdefault(key, uuid)
+
+    def update(self, tally):
+        """
+        Merge in a tally taken elsewhere, e.g. in a worker process.
+
+        :param tally: dict of keys to tuples of count and example uuid, as
+            returned by take
+        """
+        with self._lock:
+            for key, (count, uuid) in tally.items():
+                self.counts[key] += count
+                self.examples.setdefault(key, uuid)
+
+    def take(self):
+        """Return and forget the tally so far, see update."""
+        with self._lock:
+            tally = {key: (count, self.examples[key])
+                     for key, count in self.counts.items()}
+            self.counts.clear()
+            self.examples.clear()
+        return tally
+
+    def report(self):
+        """Return a list of (key, count, example uuid) sorted by key."""
+        with self._lock:
+            return [(key, self.counts[key], self.examples[key])
+                    for key in sorted(self.counts)]
+
+
+def percentile(sorted_values, p):
+    """
+    Return the p:th percentile, using the nearest rank method.
+
+    :param sorted_values: the values in ascending order
+    :param p: the percentile, 0-100
+    :return: the percentile, None if there are no values
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def ratios(counts):
+    """Return the counts of a Counter together with their share of the sum."""
+    total = sum(counts.values())
+    return {
+        'counts': dict(counts),
+        'ratios': {key: value / total for key, value in counts.items()}
+        if total else {}
+    }
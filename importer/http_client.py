@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Shared HTTP session used for all calls to the DiMu API.
+
+The session keeps a pool of keep-alive connections per host so that a harvest
+does not pay a new TCP handshake for every search page and artifact. Transient
+server errors are retried with an exponential backoff, honouring any
+Retry-After header sent by the server.
+
+Requests are also passed through a per host rate limiter, see rate_limit.
+"""
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import importer.rate_limit as rate_limit
+except ImportError:  # run as a script from within the importer directory
+    import rate_limit
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30  # seconds, for both connect and read
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  # seconds, doubled for every consecutive retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None  # the shared session, see get_session()
+
+
+class HarvestSession(requests.Session):
+    """
+    A requests session with connection pooling, timeouts and retries.
+
+    The number of requests per second and in flight to each host is limited
+    by the session's rate limiter.
+    """
+
+    def __init__(self, pool_size=None, timeout=None, retries=None,
+                 backoff=None, rate=None):
+        """
+        Initialise a session.
+
+        :param pool_size: max number of kept-alive connections per host, also
+            the upper bound for the adaptive concurrency limit
+        :param timeout: timeout, in seconds, used unless one is given per call
+        :param retries: max number of retries for a single request
+        :param backoff: backoff factor, in seconds, between retries
+        :param rate: max requests per second per host, either one value for
+            all hosts or a dict of host name to value. None for no limit.
+        """
+        super(HarvestSession, self).__init__()
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.timeout = timeout or DEFAULT_TIMEOUT
+        self.limiter = rate_limit.RateLimiter(rate, self.pool_size)
+        retries = DEFAULT_RETRIES if retries is None else retries
+        backoff = DEFAULT_BACKOFF if backoff is None else backoff
+
+        # raise_on_status=False hands back the last response once retries are
+        # exhausted so that callers get a regular HTTPError from
+        # raise_for_status() rather than a urllib3 RetryError.
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=True,
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+            pool_block=True)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        """
+        Perform a request, applying the session timeout if none given.
+
+        The request waits for the rate limiter of the host and its outcome,
+        including any retried attempts, is fed back to the limiter.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host_limiter = self.limiter.get(urlparse(url).netloc)
+        host_limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = super(HarvestSession, self).request(
+                method, url, **kwargs)
+        except requests.RequestException:
+            host_limiter.release(failed=True)
+            raise
+        except BaseException:
+            host_limiter.release()
+            raise
+        host_limiter.release(
+            latency=time.monotonic() - start,
+            statuses=response_statuses(response),
+            size=0 if kwargs.get('stream') else len(response.content or b''))
+        return response
+
+    def report(self):
+        """Return a summary line of the limits and outcomes of each host."""
+        return self.limiter.report()
+
+    def host_stats(self):
+        """Return the limits and outcomes of each host as a dict."""
+        return self.limiter.as_dict()
+
+
+def response_statuses(response):
+    """Return the statuses of all attempts, including retries, of a call."""
+    statuses = [response.status_code]
+    retries = getattr(response.raw, 'retries', None)
+    for attempt in getattr(retries, 'history', None) or ():
+        if attempt.status is not None:
+            statuses.append(attempt.status)
+    return statuses
+
+
+def configure(pool_size=None, timeout=None, retries=None, backoff=None,
+              rate=None):
+    """
+    (Re-)create the shared session with the given settings.
+
+    Any setting which is None falls back to the module default, except for
+    rate where None means no limit.
+
+    :return: the new shared session
+    """
+    global _session
+    if _session is not None:
+        _session.close()
+    _session = HarvestSession(pool_size=pool_size, timeout=timeout,
+                              retries=retries, backoff=backoff, rate=rate)
+    return _session
+
+
+def get_session():
+    """Return the shared session, creating a default one if needed."""
+    if _session is None:
+        configure()
+    return _session
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Fast json encoding and decoding, using orjson if it is installed.
+
+orjson is several times faster than the standard library json module, both
+for loading the large harvest and mapping files and for the many small
+documents of the cache and the journal. Without it the standard library is
+used.
+
+The output of dumps and dumpb differs between the two, e.g. in whitespace,
+and is therefore only used for files which are read back by the harvester
+itself, such as the cache and the journal. Files for human consumption, or
+which are compared between runs, are still written using the standard
+library.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # fall back on the standard library
+    orjson = None
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+def loads(data):
+    """
+    Decode a json document.
+
+    :param data: the document as str or utf-8 encoded bytes
+    """
+    if orjson:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def dumpb(obj, sort_keys=False):
+    """
+    Encode an object as a compact, utf-8 encoded, json document.
+
+    :param obj: the object to encode
+    :param sort_keys: whether to order the keys of any dicts
+    :return: bytes
+    """
+    if orjson:
+        return orjson.dumps(
+            obj,
+            option=ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+    return json.dumps(
+        obj, sort_keys=sort_keys, ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj, sort_keys=False):
+    """Encode an object as a compact json document, see dumpb."""
+    return dumpb(obj, sort_keys=sort_keys).decode('utf-8')
+
+
+def read_file(filename):
+    """Load a json file."""
+    with open(filename, 'rb') as f:
+        return loads(f.read())
@@ -22,10 +22,16 @@ import batchupload.listscraper as listscraper
 from batchupload.make_info import MakeBaseInfo
 
 import DiMuMappingUpdater as mapping_updater
+import harvest_io
+import harvest_log
+import near_duplicates
+import originals
+import sha1_index
 
 MAPPINGS_DIR = 'mappings'
 SETTINGS_DIR = 'settings'
 LOGFILE = 'makeinfo_processing.log'
+DUPLICATE_MODES = ('flag', 'skip')
 GEO_ORDER = ('other', 'parish', 'municipality', 'county', 'province',
              'country')
 
@@ -50,7 +56,13 @@ class GLAMInfo(MakeBaseInfo):
             'in_file': None,
             'base_name': None,
             'update_mappings': True,
-            'batch_settings': None
+            'batch_settings': None,
+            'sha1_index': None,
+            'originals': originals.STAGING_DIR,
+            'duplicates': 'flag',
+            'near_duplicates': None,
+            'log_backend': None,
+            'log_json_file': None
         }
 
         for arg in pywikibot.handle_args(args):
@@ -64,6 +76,24 @@ class GLAMInfo(MakeBaseInfo):
             elif option == '-batch_settings':
                 options['batch_settings'] = common.convert_from_commandline(
                     value)
+            elif option == '-sha1_index':
+                options['sha1_index'] = common.convert_from_commandline(value)
+            elif option == '-originals':
+                options['originals'] = common.convert_from_commandline(value)
+            elif option == '-duplicates':
+                if value not in DUPLICATE_MODES:
+                    raise pywikibot.Error(
+                        'Unknown -duplicates "{0}", expected one of: '
+                        '{1}'.format(value, ', '.join(DUPLICATE_MODES)))
+                options['duplicates'] = value
+            elif option == '-near_duplicates':
+                options['near_duplicates'] = common.convert_from_commandline(
+                    value)
+            elif option == '-log_backend':
+                options['log_backend'] = value
+            elif option == '-log_json_file':
+                options['log_json_file'] = common.convert_from_commandline(
+                    value)
 
         return options
 
@@ -96,22 +126,29 @@ class GLAMInfo(MakeBaseInfo):
         self.wikidata = pywikibot.Site('wikidata', 'wikidata')
         self.category_cache = {}  # cache for category_exists()
         self.wikidata_cache = {}  # cache for Wikidata results
-        self.log = common.LogFile(
-            '', self.b_settings.get("makeinfo_log_file" or LOGFILE))
+        self.log = harvest_log.make_log(
+            self.b_settings.get("makeinfo_log_file" or LOGFILE),
+            options.get('log_backend'), options.get('log_json_file'))
         self.log.write_w_timestamp('Make info started...')
         self.pd_year = datetime.now().year - 70
+        self.sha1_index = options.get('sha1_index')
+        self.originals = options.get('originals') or originals.STAGING_DIR
+        self.duplicates = options.get('duplicates') or 'flag'
+        self.near_duplicates = options.get('near_duplicates')
 
     def load_data(self, in_file):
         """
         Load the provided data (output from DiMuHarvester).
 
         Return this as a dict with an entry per file which can be used for
-        further processing.
+        further processing. For a normalised harvest file the entries are
+        only expanded as they are accessed.
 
-        :param in_file: the path to the metadata file generated by harvester
+        :param in_file: the path to the metadata file generated by harvester,
+            either as json or JSON Lines
         :return: dict
         """
-        raw_data = common.open_and_read_file(in_file, as_json=True)
+        raw_data = harvest_io.load_harvest_data(in_file)
         self.load_glam_data(raw_data)
         return raw_data
 
@@ -146,6 +183,10 @@ class GLAMInfo(MakeBaseInfo):
         """
         self.data = {key: GLAMItem(value, self)
                      for key, value in raw_data.items()}
+        if self.sha1_index:
+            self.check_duplicates()
+        if self.near_duplicates:
+            self.flag_near_duplicates()
 
         # remove all problematic entries
         problematic = list(
@@ -155,7 +196,65 @@ class GLAMInfo(MakeBaseInfo):
             text = '{0} -- image was skipped because of: {1}'.format(
                 item.dimu_id, '\n'.join(item.problems))
             pywikibot.output(text)
-            self.log.write(text)
+            self.write_log(text, key)
+
+    def write_log(self, text, key):
+        """
+        Write to the log, with the object uuid if the backend keeps it.
+
+        :param text: the line to log
+        :param key: the harvest key of the image the line is about
+        """
+        harvest_log.write(
+            self.log, text, 'make_info', harvest_io.object_uuid(key))
+
+    def check_duplicates(self):
+        """
+        Find the items whose original is already on Commons.
+
+        The SHA-1 of the staged originals are checked against the SHA-1
+        index at once. Depending on the duplicates mode the items found are
+        either flagged with a maintenance category or skipped.
+        """
+        staged = originals.read_manifest(self.originals)
+        sha1s = {key: staged[item.media_id].get('sha1')
+                 for key, item in self.data.items()
+                 if item.media_id in staged}
+        index = sha1_index.Sha1Index(self.sha1_index)
+        try:
+            known = sha1_index.known_files(index, sha1s.values())
+        finally:
+            index.close()
+
+        for key, sha1 in sha1s.items():
+            if sha1 not in known:
+                continue
+            item = self.data[key]
+            if self.duplicates == 'skip':
+                item.problems.append(
+                    'the file is already on Commons as {}'.format(
+                        known[sha1]))
+            else:
+                item.meta_cats.add('with a duplicate on Commons')
+                self.write_log('{0} -- the file is already on Commons as '
+                               '{1}'.format(item.dimu_id, known[sha1]), key)
+        pywikibot.output('{0} of {1} images are already on Commons'.format(
+            len([sha1 for sha1 in sha1s.values() if sha1 in known]),
+            len(self.data)))
+
+    def flag_near_duplicates(self):
+        """
+        Flag the items whose image is near identical to other images.
+
+        The groups are those found by near_duplicates.py. The other images
+        of the group are logged for each flagged item.
+        """
+        groups = near_duplicates.load_groups(self.near_duplicates)
+        for key, item in self.data.items():
+            if item.media_id in groups:
+                item.meta_cats.add('with near duplicates')
+                self.write_log('{0} -- near duplicate of: {1}'.format(
+                    item.dimu_id, ', '.join(groups[item.media_id])), key)
 
     def generate_filename(self, item):
         """
@@ -304,12 +403,10 @@ class GLAMInfo(MakeBaseInfo):
         Generate the url where the original files can be found.
 
         Uses media_id instead of filename as the latter is not guaranteed to
-        exist or be mapped to the right image.
+        exist or be mapped to the right image. The same url is used when
+        downloading the originals to a staging area, see originals.py.
         """
-        server = 'http://dms01.dimu.org'
-        org_filename = '{server}/image/{id}?dimension=max&filename={id}.jpg'
-        org_filename = org_filename.format(server=server, id=item.media_id)
-        return org_filename
+        return originals.original_url(item.media_id)
 
     def generate_content_cats(self, item):
         """
@@ -386,6 +483,19 @@ class GLAMInfo(MakeBaseInfo):
             'against online sources (defaults to True)\n'
             '\t-base_name:PATH base name for output files\n'
             '\t-batch_settings:PATH file with batch-specific settings\n'
+            '\t-sha1_index:PATH SHA-1 index of files on Commons, see '
+            'sha1_index.py (optional)\n'
+            '\t-originals:PATH staging area of the downloaded originals '
+            '(defaults to originals)\n'
+            '\t-duplicates:MODE what to do with images already on Commons, '
+            'either "flag" them with a maintenance category or "skip" them '
+            '(defaults to flag)\n'
+            '\t-near_duplicates:PATH groups of near identical images, see '
+            'near_duplicates.py (optional)\n'
+            '\t-log_backend:STR either "plain" or "buffered", which writes '
+            'the log in batches on a background thread (defaults to plain)\n'
+            '\t-log_json_file:PATH JSON Lines file to also write every log '
+            'record to, uses the buffered backend (optional)\n'
             '\tExample:\n'
             '\tpython make_glam_info.py '
             '-in_file:dimu_harvest_data.json '
@@ -0,0 +1,403 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Find groups of near identical images among the staged originals.
+
+Multi-slide objects and re-scanned negatives often give images which differ
+only in e.g. cropping, compression or exposure. For every original in the
+staging area (see originals.py) a perceptual hash (a 64 bit difference
+hash) is computed, spread over a pool of processes, and images whose hashes
+differ in at most -max_distance bits are grouped together.
+
+The hashes are kept in an index, together with the SHA-1 of the file they
+were computed from, so an image is only hashed again if its original has
+changed. As the index keeps the hashes of earlier batches, images are also
+grouped with near duplicates from those. Neighbours are found using a
+BK-tree over the Hamming distance, rather than by comparing every pair.
+
+The groups are written to a json file which make_glam_info.py can use to
+flag the images, see -near_duplicates there.
+
+Computing the hashes requires Pillow (pip install Pillow).
+
+usage:
+    python importer/near_duplicates.py [OPTIONS]
+
+&params;
+"""
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+from collections import Counter, OrderedDict
+
+import pywikibot
+
+import batchupload.common as common
+
+try:
+    import importer.originals as originals
+except ImportError:  # run as a script from within the importer directory
+    import originals
+
+try:
+    from PIL import Image
+except ImportError:  # hashes can then only be read from the index
+    Image = None
+
+HASH_SIZE = 8  # the hash is made from a HASH_SIZE x HASH_SIZE grid
+DRAFT_SIZE = 256  # JPEGs are decoded at no less than this many pixels
+DEFAULT_DISTANCE = 6  # max number of differing bits for near duplicates
+INDEX_FILE = 'phash_index.sqlite'
+GROUPS_FILE = 'near_duplicates.json'
+CHUNK_SIZE = 8  # images handed to a worker process at a time
+
+DEFAULT_OPTIONS = {
+    'in_file': None,
+    'staging_dir': originals.STAGING_DIR,
+    'index': INDEX_FILE,
+    'groups_file': GROUPS_FILE,
+    'max_distance': DEFAULT_DISTANCE,
+    'processes': None
+}
+PARAMETER_HELP = u"""\
+Near duplicate options:
+-in_file:PATH          only group the images of this harvest file. All \
+staged originals are grouped if not present (DEF: {in_file})
+-staging_dir:PATH      staging area of the downloaded originals \
+(DEF: {staging_dir})
+-index:PATH            path to the index of hashes (DEF: {index})
+-groups_file:PATH      path to the json file to write the groups to \
+(DEF: {groups_file})
+-max_distance:INT      max number of bits in which the hashes of near \
+duplicates may differ, out of 64 (DEF: {max_distance})
+-processes:INT         number of worker processes (DEF: number of cpus)
+"""
+__doc__ = __doc__.replace(
+    '&params;', PARAMETER_HELP.format(**DEFAULT_OPTIONS))
+
+
+def hash_pixels(pixels, size=HASH_SIZE):
+    """
+    Return the difference hash of a grid of grey scale pixels.
+
+    Every bit of the hash tells whether a pixel is brighter than its right
+    hand neighbour.
+
+    :param pixels: sequence of the values of a (size + 1) x size grid, row
+        by row
+    :param size: the number of rows
+    :return: int of size * size bits
+    """
+    width = size + 1
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * width + col]
+            value = (value << 1) | (left > pixels[row * width + col + 1])
+    return value
+
+
+def image_hash(filename):
+    """
+    Return the perceptual hash of an image file.
+
+    :param filename: path to the image
+    """
+    if Image is None:
+        raise pywikibot.Error(
+            'Pillow is needed to compute the hashes of images')
+    with Image.open(filename) as image:
+        # let the JPEG decoder scale down large originals while decoding
+        image.draft('L', (DRAFT_SIZE, DRAFT_SIZE))
+        small = image.convert('L').resize(
+            (HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        return hash_pixels(list(small.getdata()))
+
+
+def hash_worker(filename):
+    """
+    Hash an image in a worker process.
+
+    :return: tuple of the hash, None if the image could not be read, and
+        the error, if any
+    """
+    try:
+        return image_hash(filename), None
+    except (OSError, ValueError) as e:
+        return None, str(e)
+
+
+def hamming(a, b):
+    """Return the number of bits in which two hashes differ."""
+    return bin(a ^ b).count('1')
+
+
+class BKTree(object):
+    """
+    A BK-tree of hashes, for finding all hashes near a given one.
+
+    Every node holds a hash, the keys added with it and its children by
+    their distance to the node. Thanks to the triangle inequality a search
+    only needs to visit the children whose distance is within max_distance
+    of that of the searched hash.
+    """
+
+    def __init__(self):
+        """Initialise an empty tree."""
+        self.root = None  # list of hash, keys and dict of children
+
+    def add(self, phash, key):
+        """Add a key with its hash."""
+        if self.root is None:
+            self.root = [phash, [key], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(phash, node[0])
+            if distance == 0:
+                node[1].append(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [phash, [key], {}]
+                return
+            node = child
+
+    def search(self, phash, max_distance):
+        """
+        Find all keys whose hash is near the given one.
+
+        :param phash: the hash to search for
+        :param max_distance: max Hamming distance of the found hashes
+        :return: sorted list of tuples of distance and key
+        """
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_hash, keys, children = nodes.pop()
+            distance = hamming(phash, node_hash)
+            if distance <= max_distance:
+                found.extend((distance, key) for key in keys)
+            nodes.extend(
+                child for child_distance, child in children.items()
+                if abs(child_distance - distance) <= max_distance)
+        return sorted(found)
+
+
+class HashIndex(object):
+    """
+    The perceptual hashes of all images seen so far.
+
+    Each image, by media id, is stored with the SHA-1 of the original its
+    hash was computed from.
+    """
+
+    def __init__(self, filename=None):
+        """
+        Open the index in the given database file, creating it if needed.
+
+        :param filename: path to the database file, defaults to INDEX_FILE
+        """
+        self.filename = filename or INDEX_FILE
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            self.filename, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS hashes ('
+                'media_id TEXT PRIMARY KEY, sha1 TEXT, phash TEXT)')
+
+    def add(self, entries):
+        """
+        Add, or replace, the hashes of images.
+
+        :param entries: iterable of tuples of media id, SHA-1 and hash
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO hashes (media_id, sha1, phash) '
+                'VALUES (?, ?, ?)',
+                [(media_id, sha1, '{:016x}'.format(phash))
+                 for media_id, sha1, phash in entries])
+
+    def entries(self):
+        """Return a dict of media id to tuple of SHA-1 and hash."""
+        with self._lock:
+            return {media_id: (sha1, int(phash, 16))
+                    for media_id, sha1, phash in self.connection.execute(
+                        'SELECT media_id, sha1, phash FROM hashes')}
+
+    def __len__(self):
+        """Return the number of images in the index."""
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM hashes').fetchone()[0]
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self.connection.close()
+
+
+def pending_images(known, staged):
+    """
+    Return the staged originals which need to be hashed.
+
+    :param known: dict of media id to tuple of SHA-1 and hash, see
+        HashIndex.entries
+    :param staged: dict of media id to manifest entry, see
+        originals.read_manifest
+    :return: list of media ids of the originals not hashed before, or
+        changed since they were
+    """
+    return [media_id for media_id, entry in staged.items()
+            if (known.get(media_id) or (None, ))[0] != entry.get('sha1')]
+
+
+def update_index(index, staging_dir, media_ids=None, processes=None,
+                 log=None):
+    """
+    Hash the staged originals missing from the index.
+
+    :param index: the HashIndex
+    :param staging_dir: the staging area holding the originals
+    :param media_ids: only hash these images, defaults to all staged ones
+    :param processes: number of worker processes, defaults to the number of
+        cpus
+    :param log: the log to write failures to
+    :return: Counter of 'hashed', 'reused' and 'failed' images
+    """
+    staged = originals.read_manifest(staging_dir)
+    if media_ids is not None:
+        staged = OrderedDict((media_id, staged[media_id])
+                             for media_id in media_ids if media_id in staged)
+    pending = pending_images(index.entries(), staged)
+    outcomes = Counter(reused=len(staged) - len(pending))
+    if not pending:
+        return outcomes
+
+    paths = [os.path.join(staging_dir, staged[media_id].get('file'))
+             for media_id in pending]
+    hashed = []
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.imap(hash_worker, paths, CHUNK_SIZE)
+        for media_id, (phash, error) in zip(pending, results):
+            if phash is None:
+                outcomes['failed'] += 1
+                text = '{0}: could not be hashed: {1}'.format(media_id, error)
+                pywikibot.output(text)
+                if log:
+                    log.write(text)
+                continue
+            outcomes['hashed'] += 1
+            hashed.append((media_id, staged[media_id].get('sha1'), phash))
+    index.add(hashed)
+    return outcomes
+
+
+def find_groups(hashes, media_ids=None, max_distance=DEFAULT_DISTANCE):
+    """
+    Group images whose hashes are near each other.
+
+    Near is transitive within a group, so two images in a group may differ
+    by more than max_distance if a third one is near both.
+
+    :param hashes: dict of media id to hash, of all images to compare with
+    :param media_ids: only return groups holding at least one of these
+        images, defaults to all images
+    :param max_distance: max Hamming distance between near duplicates
+    :return: list of groups, each a sorted list of at least two media ids
+    """
+    tree = BKTree()
+    for media_id, phash in hashes.items():
+        tree.add(phash, media_id)
+
+    parents = {}  # union-find forest of the media ids
+
+    def root(media_id):
+        while parents.get(media_id, media_id) != media_id:
+            media_id = parents[media_id]
+        return media_id
+
+    targets = hashes if media_ids is None else [
+        media_id for media_id in media_ids if media_id in hashes]
+    for media_id in targets:
+        for distance, other in tree.search(hashes[media_id], max_distance):
+            parents[root(other)] = root(media_id)
+
+    groups = {}
+    for media_id in parents:
+        groups.setdefault(root(media_id), set()).add(media_id)
+    return sorted(sorted(group) for group in groups.values()
+                  if len(group) > 1)
+
+
+def load_groups(filename):
+    """
+    Load the groups written by main.
+
+    :param filename: path to the groups file
+    :return: dict of media id to the other media ids of its group
+    """
+    groups = common.open_and_read_file(filename, as_json=True)
+    return {media_id: [other for other in group if other != media_id]
+            for group in groups.get('groups') for media_id in group}
+
+
+def handle_args(args):
+    """
+    Parse the command line arguments.
+
+    :return: dict of options, None if the usage should be shown
+    """
+    options = DEFAULT_OPTIONS.copy()
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        key = option[1:]
+        if key not in options:
+            return None
+        if key in ('max_distance', 'processes'):
+            options[key] = int(value)
+        else:
+            options[key] = common.convert_from_commandline(value)
+    return options
+
+
+def main(*args):
+    """Hash the staged originals and write the near duplicate groups."""
+    options = handle_args(args)
+    if options is None:
+        pywikibot.output(__doc__)
+        return
+
+    media_ids = None
+    if options.get('in_file'):
+        media_ids = originals.harvest_media_ids(options.get('in_file'))
+    index = HashIndex(options.get('index'))
+    try:
+        outcomes = update_index(
+            index, options.get('staging_dir'), media_ids,
+            options.get('processes') or os.cpu_count())
+        hashes = {media_id: phash
+                  for media_id, (sha1, phash) in index.entries().items()}
+    finally:
+        index.close()
+
+    groups = find_groups(hashes, media_ids, options.get('max_distance'))
+    common.open_and_write_file(options.get('groups_file'), {
+        'max_distance': options.get('max_distance'),
+        'groups': groups
+    }, as_json=True)
+    pywikibot.output(
+        'Hashes: {0} computed, {1} reused, {2} failed. {3} images in {4} '
+        'groups of near duplicates written to {5}'.format(
+            outcomes.get('hashed', 0), outcomes.get('reused', 0),
+            outcomes.get('failed', 0), sum(len(group) for group in groups),
+            len(groups), options.get('groups_file')))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,424 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Download the original images of a harvest to a local staging area.
+
+The full size original of every image in a harvest file is streamed to disk
+using a bounded number of parallel downloads. The SHA-1 of each file is
+computed while it is being written, and its size and checksum are recorded
+in a manifest in the staging area. Files already in the manifest are not
+downloaded again, and partial downloads, e.g. of an interrupted run, are
+resumed using Range requests rather than started from scratch.
+
+The files are named after their media_id, with an extension matching their
+content type, and the manifest is stored as one json document per line, see
+Manifest.
+
+usage:
+    python importer/originals.py -in_file:PATH [OPTIONS]
+
+&params;
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
+from concurrent import futures
+
+import requests
+
+import pywikibot
+
+import batchupload.common as common
+
+try:
+    import importer.harvest_io as harvest_io
+    import importer.harvest_stats as harvest_stats
+    import importer.http_client as http_client
+    import importer.json_codec as json_codec
+except ImportError:  # run as a script from within the importer directory
+    import harvest_io
+    import harvest_stats
+    import http_client
+    import json_codec
+
+SERVER = 'http://dms01.dimu.org'
+STAGING_DIR = 'originals'
+MANIFEST_FILE = 'manifest.jsonl'
+LOGFILE = 'originals.log'
+PART_SUFFIX = '.part'
+CHUNK_SIZE = 1024 * 1024  # bytes read from the response at a time
+DEFAULT_WORKERS = 4
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/tiff': '.tif'}
+
+DEFAULT_OPTIONS = {
+    'in_file': None,
+    'staging_dir': STAGING_DIR,
+    'workers': DEFAULT_WORKERS,
+    'server': SERVER,
+    'log_file': LOGFILE,
+    'cutoff': None
+}
+PARAMETER_HELP = u"""\
+Download options:
+-in_file:PATH          path to the harvest file whose images to download
+-staging_dir:PATH      directory to download the originals to, the manifest \
+is kept in the same directory (DEF: {staging_dir})
+-workers:INT           number of files to download in parallel \
+(DEF: {workers})
+-server:URL            base url of the DiMu image server (DEF: {server})
+-log_file:PATH         path to log file (DEF: {log_file})
+-cutoff:INT            only download the first these many images. All are \
+downloaded if not present (DEF: {cutoff})
+"""
+__doc__ = __doc__.replace(
+    '&params;', PARAMETER_HELP.format(**DEFAULT_OPTIONS))
+
+
+def original_url(media_id, server=None):
+    """
+    Return the url of the full size original of an image.
+
+    Uses media_id instead of filename as the latter is not guaranteed to
+    exist or be mapped to the right image.
+
+    :param media_id: the DiMu media id of the image
+    :param server: base url of the image server, defaults to SERVER
+    """
+    return '{server}/image/{id}?dimension=max&filename={id}.jpg'.format(
+        server=server or SERVER, id=media_id)
+
+
+def url_media_id(url):
+    """Return the media id of an original url, None if not such a url."""
+    match = re.search(r'/image/([^/?]+)', url or '')
+    if match:
+        return match.group(1)
+
+
+def file_extension(content_type):
+    """Return the file extension to use for a content type."""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return (EXTENSIONS.get(content_type)
+            or mimetypes.guess_extension(content_type) or '.jpg')
+
+
+def hash_file(filename, sha1):
+    """
+    Feed the content of a file to a hash.
+
+    :param filename: path to the file
+    :param sha1: the hashlib hash to update
+    :return: the size of the file
+    """
+    size = 0
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+            size += len(chunk)
+    return size
+
+
+class Manifest(object):
+    """
+    The record of all downloaded originals in a staging area.
+
+    Every downloaded file is appended to the manifest as a json document
+    with its 'media_id', 'file' (name within the staging area), 'size',
+    'sha1' and 'url'. A partially written last line is discarded.
+    """
+
+    def __init__(self, directory):
+        """
+        Load the manifest of a staging area, creating it if needed.
+
+        :param directory: the staging area
+        """
+        self.directory = directory
+        self.filename = os.path.join(directory, MANIFEST_FILE)
+        self.entries = OrderedDict()  # media id to manifest entry
+        self._lock = threading.Lock()
+        if os.path.exists(self.filename):
+            self.read()
+        self.file = open(self.filename, 'a', encoding='utf-8')
+
+    def read(self):
+        """Load the manifest, dropping any partial line."""
+        valid_length = 0
+        with open(self.filename, 'rb') as f:
+            for entry, length in iter_manifest(f):
+                valid_length += length
+                self.entries[entry.get('media_id')] = entry
+        with open(self.filename, 'r+b') as f:
+            f.truncate(valid_length)
+
+    def get(self, media_id):
+        """Return the manifest entry of a file, None if not downloaded."""
+        return self.entries.get(media_id)
+
+    def has(self, media_id):
+        """Check whether a file is downloaded and still of the right size."""
+        entry = self.get(media_id)
+        if not entry:
+            return False
+        path = os.path.join(self.directory, entry.get('file'))
+        return (os.path.isfile(path)
+                and os.path.getsize(path) == entry.get('size'))
+
+    def path(self, media_id):
+        """Return the path to a downloaded file, None if not downloaded."""
+        entry = self.get(media_id)
+        if entry:
+            return os.path.join(self.directory, entry.get('file'))
+
+    def record(self, entry):
+        """Add a downloaded file to the manifest."""
+        with self._lock:
+            self.entries[entry.get('media_id')] = entry
+            self.file.write(json_codec.dumps(entry) + '\n')
+            self.file.flush()
+
+    def close(self):
+        """Close the manifest file."""
+        self.file.close()
+
+
+class OriginalsDownloader(object):
+    """Download originals to a staging area, recording them in its manifest."""
+
+    def __init__(self, directory=None, workers=None, server=None, log=None):
+        """
+        Initialise the downloader.
+
+        :param directory: the staging area, defaults to STAGING_DIR
+        :param workers: number of files to download in parallel
+        :param server: base url of the image server, defaults to SERVER
+        :param log: the log to write failures to
+        """
+        self.directory = directory or STAGING_DIR
+        common.create_dir(self.directory)
+        self.workers = workers or DEFAULT_WORKERS
+        self.server = server
+        self.log = log
+        self.manifest = Manifest(self.directory)
+        self.stats = harvest_stats.HarvestStats()
+
+    def download_all(self, media_ids):
+        """
+        Download all given originals not already in the manifest.
+
+        Failed downloads are logged, and any partial file kept so that the
+        download is resumed by the next run.
+
+        :param media_ids: iterable of media ids
+        :return: Counter of the outcomes, see download
+        """
+        media_ids = list(OrderedDict.fromkeys(media_ids))
+        outcomes = Counter()
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            jobs = [executor.submit(self.download, media_id)
+                    for media_id in media_ids]
+            for media_id, job in zip(media_ids, jobs):
+                try:
+                    outcome = job.result()
+                except (requests.RequestException, OSError,
+                        pywikibot.Error) as e:
+                    outcome = 'failed'
+                    self.write_log('{0}: download failed: {1}'.format(
+                        media_id, e))
+                outcomes[outcome] += 1
+                self.stats.count(outcome)
+        return outcomes
+
+    def download(self, media_id):
+        """
+        Download a single original, unless it is already in the manifest.
+
+        :param media_id: the media id of the image
+        :return: the outcome, one of 'skipped', 'downloaded' or 'resumed'
+        """
+        if self.manifest.has(media_id):
+            return 'skipped'
+        with self.stats.timer('download'):
+            return self.fetch(media_id)
+
+    def fetch(self, media_id):
+        """
+        Stream an original to disk, resuming any partial download.
+
+        The file is only given its final name, and recorded in the manifest,
+        once it is complete.
+
+        :param media_id: the media id of the image
+        :return: 'resumed' if a partial download was continued, otherwise
+            'downloaded'
+        """
+        url = original_url(media_id, self.server)
+        part_path = os.path.join(self.directory, media_id + PART_SUFFIX)
+        sha1 = hashlib.sha1()
+        offset = 0
+        if os.path.exists(part_path):
+            offset = hash_file(part_path, sha1)
+
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        response = http_client.get_session().get(
+            url, headers=headers, stream=True)
+        with response:
+            if offset and response.status_code == 416:
+                # the partial file is no part of the current original
+                os.remove(part_path)
+                return self.fetch(media_id)
+            response.raise_for_status()
+            if offset and not resumes_at(response, offset):
+                # the whole file was sent, e.g. as Range is not supported
+                sha1 = hashlib.sha1()
+                offset = 0
+            expected = response.headers.get('Content-Length')
+            received = 0
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    sha1.update(chunk)
+                    received += len(chunk)
+            content_type = response.headers.get('Content-Type')
+
+        if expected is not None and received != int(expected):
+            raise pywikibot.Error(
+                'received {0} of {1} bytes'.format(received, expected))
+        self.stats.count('bytes', received)
+
+        filename = media_id + file_extension(content_type)
+        os.replace(part_path, os.path.join(self.directory, filename))
+        self.manifest.record({
+            'media_id': media_id,
+            'file': filename,
+            'size': offset + received,
+            'sha1': sha1.hexdigest(),
+            'url': url
+        })
+        return 'resumed' if offset else 'downloaded'
+
+    def write_log(self, text):
+        """Write to the log, if any, and output in either case."""
+        pywikibot.output(text)
+        if self.log:
+            self.log.write(text)
+
+    def close(self):
+        """Close the manifest."""
+        self.manifest.close()
+
+
+def iter_manifest(f):
+    """
+    Yield the complete entries of an open manifest file.
+
+    :param f: the manifest, opened in binary mode
+    :return: iterator of tuples of the entry and the length of its line
+    """
+    for line in f:
+        try:
+            entry = json_codec.loads(line)
+        except ValueError:
+            return
+        if not line.endswith(b'\n'):
+            return
+        yield entry, len(line)
+
+
+def read_manifest(directory):
+    """
+    Load the manifest of a staging area without modifying it.
+
+    :param directory: the staging area
+    :return: OrderedDict of media id to manifest entry
+    """
+    entries = OrderedDict()
+    filename = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            for entry, length in iter_manifest(f):
+                entries[entry.get('media_id')] = entry
+    return entries
+
+
+def resumes_at(response, offset):
+    """Check whether a response holds the original from the given offset."""
+    if response.status_code != 206:
+        return False
+    match = re.match(r'bytes (\d+)-',
+                     response.headers.get('Content-Range') or '')
+    return bool(match) and int(match.group(1)) == offset
+
+
+def harvest_media_ids(filename):
+    """
+    Return the media ids of all images in a harvest file.
+
+    :param filename: path to the harvest file, in either format
+    :return: list of media ids, in harvest order
+    """
+    media_ids = OrderedDict()
+    for key, entry in harvest_io.iter_harvest_data(filename):
+        if entry.get('media_id'):
+            media_ids[entry.get('media_id')] = True
+    return list(media_ids)
+
+
+def handle_args(args):
+    """
+    Parse the command line arguments.
+
+    :return: dict of options, None if the usage should be shown
+    """
+    options = DEFAULT_OPTIONS.copy()
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        key = option[1:]
+        if key not in options:
+            return None
+        if key in ('workers', 'cutoff'):
+            options[key] = int(value)
+        else:
+            options[key] = common.convert_from_commandline(value)
+    if not options.get('in_file'):
+        return None
+    return options
+
+
+def main(*args):
+    """Download the originals of a harvest file."""
+    options = handle_args(args)
+    if options is None:
+        pywikibot.output(__doc__)
+        return
+
+    media_ids = harvest_media_ids(options.get('in_file'))
+    if options.get('cutoff'):
+        media_ids = media_ids[:options.get('cutoff')]
+    http_client.configure(pool_size=max(
+        options.get('workers'), http_client.DEFAULT_POOL_SIZE))
+    log = common.LogFile('', options.get('log_file'))
+    log.write_w_timestamp('Download started...')
+    downloader = OriginalsDownloader(
+        options.get('staging_dir'), options.get('workers'),
+        options.get('server'), log)
+    try:
+        outcomes = downloader.download_all(media_ids)
+    finally:
+        downloader.close()
+
+    summary = 'Originals: {}'.format(', '.join(
+        '{0} {1}'.format(outcomes.get(outcome, 0), outcome)
+        for outcome in ('downloaded', 'resumed', 'skipped', 'failed')))
+    pywikibot.output(summary)
+    log.write(summary)
+    log.write_w_timestamp('...Download finished\n')
+    pywikibot.output(log.close_and_confirm())
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
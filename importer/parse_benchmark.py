@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Micro-benchmark the parsing of DiMu artifacts.
+
+The artifacts of a local cache, or a json file holding a single artifact,
+are parsed with parse_single_object. The time per object is reported, for
+every artifactType and overall, as the best of a number of repeats together
+with the data which could not be parsed. Nothing is fetched from DiMu.
+
+usage:
+    python importer/parse_benchmark.py [OPTIONS]
+
+&params;
+"""
+import json
+import sys
+import time
+from collections import OrderedDict
+
+import pywikibot
+
+import batchupload.common as common
+
+try:
+    import importer.harvest_benchmark as harvest_benchmark
+    import importer.harvest_replay as harvest_replay
+except ImportError:  # run as a script from within the importer directory
+    import harvest_benchmark
+    import harvest_replay
+
+DEFAULT_OPTIONS = {
+    'artifacts': None,
+    'rounds': 20,
+    'repeat': 5,
+    'output': None
+}
+PARAMETER_HELP = u"""\
+Benchmark options:
+-artifacts:PATH        required. Cache directory or SQLite cache file whose \
+artifacts are parsed, or a json file of a single artifact
+-rounds:INT            times each artifact is parsed per timing \
+(DEF: {rounds})
+-repeat:INT            number of timings, of which the best is reported \
+(DEF: {repeat})
+-output:PATH           json file to write the results to (DEF: {output})
+"""
+__doc__ = __doc__.replace(
+    '&params;', PARAMETER_HELP.format(**DEFAULT_OPTIONS))
+
+
+def make_parser():
+    """Return a harvester which only parses, logging to memory."""
+    return harvest_replay.ParseHarvester(
+        {}, log=harvest_replay.LogCollector())
+
+
+def time_parser(parser, artifacts, rounds, repeat):
+    """
+    Time the parsing of some artifacts.
+
+    :param parser: the harvester to parse with, its log is emptied after
+        every timing
+    :param artifacts: list of raw artifacts
+    :param rounds: times each artifact is parsed per timing
+    :param repeat: number of timings
+    :return: the best seconds per object
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(rounds):
+            for artifact in artifacts:
+                parser.parse_single_object(artifact)
+        duration = time.perf_counter() - start
+        parser.log.take()
+        if best is None or duration < best:
+            best = duration
+    return best / (rounds * len(artifacts))
+
+
+def run_benchmark(artifacts, options):
+    """
+    Benchmark the parser on the given artifacts.
+
+    :param artifacts: list of raw artifacts
+    :param options: dict of benchmark options
+    :return: dict of measurements
+    """
+    parser = make_parser()
+    by_type = OrderedDict([('all', artifacts)])
+    for artifact in artifacts:
+        by_type.setdefault(artifact.get('artifactType'), []).append(artifact)
+
+    result = {'types': OrderedDict()}
+    for artifact_type, typed_artifacts in by_type.items():
+        result['types'][artifact_type] = {
+            'objects': len(typed_artifacts),
+            'seconds': time_parser(
+                parser, typed_artifacts, options.get('rounds'),
+                options.get('repeat'))
+        }
+    result['unknown_keys'] = dict(parser.unknown_keys.counts)
+    return result
+
+
+def format_result(result):
+    """Return a summary of a benchmark result, one line per artifactType."""
+    lines = []
+    for artifact_type, timings in result['types'].items():
+        lines.append(
+            '{artifact_type:>10} ({objects} objects): '
+            '{us:.1f} us per object'.format(
+                artifact_type=artifact_type, us=timings['seconds'] * 1e6,
+                **timings))
+    lines.append('{} kinds of data could not be parsed{}'.format(
+        len(result['unknown_keys']),
+        ': {}'.format(', '.join(sorted(result['unknown_keys'])))
+        if result['unknown_keys'] else ''))
+    return '\n'.join(lines)
+
+
+def handle_args(args):
+    """
+    Parse the command line arguments.
+
+    :return: dict of options, None if the usage should be shown
+    """
+    options = DEFAULT_OPTIONS.copy()
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        key = option[1:]
+        if key not in options:
+            return None
+        if key in ('rounds', 'repeat'):
+            options[key] = int(value)
+        else:
+            options[key] = common.convert_from_commandline(value)
+    if not options.get('artifacts'):
+        return None
+    return options
+
+
+def main(*args):
+    """Run the benchmark, outputting the results."""
+    options = handle_args(args)
+    if options is None:
+        pywikibot.output(__doc__)
+        return
+
+    artifacts = harvest_benchmark.load_templates(options.get('artifacts'))
+    result = run_benchmark(artifacts, options)
+    pywikibot.output(format_result(result))
+
+    if options.get('output'):
+        with open(options.get('output'), 'w', encoding='utf-8') as f:
+            json.dump({'options': options, 'result': result}, f,
+                      sort_keys=True, indent=4)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
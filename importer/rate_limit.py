@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Per host rate limiting and adaptive concurrency for the DiMu API.
+
+Every host gets a token bucket, capping the number of requests per second,
+and a concurrency limit which is adjusted using additive increase and
+multiplicative decrease (AIMD). The limit is halved whenever the host
+signals overload, by throttling (429/503) or by its response times rising
+well above the fastest seen, and grows by about one for every limit's worth
+of fast responses.
+"""
+import threading
+import time
+from collections import Counter
+
+THROTTLE_STATUSES = (429, 503)
+MIN_CONCURRENCY = 1
+LATENCY_ALPHA = 0.2  # weight of the latest response in the latency average
+LATENCY_FACTOR = 2  # latency above this many times the best is overload
+LATENCY_SLACK = 0.1  # seconds, ignore latency changes smaller than this
+DECREASE_INTERVAL = 1.0  # seconds, min time between two decreases
+
+
+class TokenBucket(object):
+    """Allow up to `rate` events per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        """
+        Initialise a full bucket.
+
+        :param rate: tokens added per second, None for no limit
+        :param burst: max number of tokens kept, defaults to one second's
+            worth
+        """
+        self.rate = rate
+        self.capacity = burst or max(rate or 1, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available.
+
+        :return: the number of seconds waited
+        """
+        if not self.rate:
+            return 0
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class HostLimiter(object):
+    """The token bucket and adaptive concurrency limit of a single host."""
+
+    def __init__(self, host, rate=None, max_concurrency=10):
+        """
+        Initialise the limiter, starting at the max concurrency.
+
+        :param host: the host name, used for reporting
+        :param rate: max requests per second, None for no limit
+        :param max_concurrency: upper bound for the concurrency limit
+        """
+        self.host = host
+        self.bucket = TokenBucket(rate)
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.lowest_limit = self.limit
+        self.decreased = None  # when the limit was last decreased
+        self.in_flight = 0
+        self.latency = None  # moving average of the response time
+        self.best_latency = None
+        # 'requests', 'throttled', 'slow', 'errors' and 'bytes' received
+        self.counts = Counter()
+        self.waited = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a token and for the number in flight to be in limits."""
+        waited = self.bucket.acquire()
+        start = time.monotonic()
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self.counts['requests'] += 1
+            self.waited += waited + time.monotonic() - start
+
+    def release(self, latency=None, statuses=(), failed=False, size=0):
+        """
+        Register the outcome of a request and adjust the limit.
+
+        :param latency: the response time in seconds
+        :param statuses: the statuses of all attempts of the request,
+            including any retries
+        :param failed: whether the request failed without a response
+        :param size: the number of bytes received
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.counts['bytes'] += size
+            if failed:
+                self.counts['errors'] += 1
+                self.decrease()
+            elif any(status in THROTTLE_STATUSES for status in statuses):
+                self.counts['throttled'] += 1
+                self.decrease()
+            elif latency is not None and self.is_slow(latency):
+                self.counts['slow'] += 1
+                self.decrease()
+            else:
+                self.increase()
+            self._condition.notify_all()
+
+    def is_slow(self, latency):
+        """Update the latency average, checking if it signals overload."""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_ALPHA * (latency - self.latency)
+        if self.best_latency is None or self.latency < self.best_latency:
+            self.best_latency = self.latency
+        return (self.latency > LATENCY_FACTOR * self.best_latency
+                and self.latency - self.best_latency > LATENCY_SLACK)
+
+    def increase(self):
+        """Additively raise the limit, by one per limit's worth of calls."""
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def decrease(self):
+        """
+        Multiplicatively lower the limit.
+
+        Requests already in flight when the host started to struggle tend to
+        fail together, so the limit is lowered at most once per interval.
+        """
+        now = time.monotonic()
+        if (self.decreased is not None
+                and now - self.decreased < DECREASE_INTERVAL):
+            return
+        self.decreased = now
+        self.limit = max(MIN_CONCURRENCY, self.limit / 2)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+        if self.latency is not None:
+            # judge later responses against the current conditions
+            self.best_latency = max(self.best_latency, self.latency / 2)
+
+    def as_dict(self):
+        """Return the limits and outcomes as a dict."""
+        with self._condition:
+            return {
+                'rate': self.bucket.rate,
+                'concurrency_limit': self.limit,
+                'lowest_concurrency_limit': self.lowest_limit,
+                'max_concurrency': self.max_concurrency,
+                'latency': self.latency,
+                'waited': self.waited,
+                'counts': dict(self.counts)
+            }
+
+    def report(self):
+        """Return a one line summary of the limits and outcomes."""
+        return (
+            '{host}: {requests} requests, {throttled} throttled, {slow} slow, '
+            '{errors} failed; rate limit {rate}; concurrency limit '
+            '{limit} (lowest {lowest}, max {max}); waited {waited:.1f}s'
+            ).format(
+                host=self.host, rate=(
+                    '{}/s'.format(self.bucket.rate) if self.bucket.rate
+                    else 'none'),
+                limit=int(self.limit), lowest=int(self.lowest_limit),
+                max=self.max_concurrency, waited=self.waited,
+                requests=self.counts['requests'],
+                throttled=self.counts['throttled'],
+                slow=self.counts['slow'], errors=self.counts['errors'])
+
+
+class RateLimiter(object):
+    """The limiters of all hosts, created as hosts are first contacted."""
+
+    def __init__(self, rate=None, max_concurrency=10):
+        """
+        Initialise the rate limiter.
+
+        :param rate: max requests per second per host, either one value for
+            all hosts or a dict of host name to value. None for no limit.
+        :param max_concurrency: upper bound for each host's concurrency
+        """
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def host_rate(self, host):
+        """Return the configured rate for a host."""
+        if isinstance(self.rate, dict):
+            return self.rate.get(host)
+        return self.rate
+
+    def get(self, host):
+        """Return the limiter for a host."""
+        with self._lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostLimiter(
+                    host, self.host_rate(host), self.max_concurrency)
+            return self.hosts.get(host)
+
+    def as_dict(self):
+        """Return the limits and outcomes of all contacted hosts."""
+        with self._lock:
+            hosts = dict(self.hosts)
+        return {host: limiter.as_dict() for host, limiter in hosts.items()}
+
+    def report(self):
+        """Return the summary lines of all contacted hosts."""
+        with self._lock:
+            return [self.hosts[host].report() for host in sorted(self.hosts)]
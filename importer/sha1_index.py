@@ -0,0 +1,358 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Persistent index of the SHA-1 of files known to be on Wikimedia Commons.
+
+Used to find images whose content is already on Commons, possibly under
+another name, before they are uploaded. The index is a single SQLite
+database mapping the SHA-1 of a file to its title on Commons and is filled
+from:
+* a local snapshot, a tab separated file of SHA-1 and title per line, e.g.
+  extracted from the image table of a Commons database dump. The SHA-1 may
+  be given either in hex or in the base 36 used by MediaWiki.
+* our own earlier uploads, given the batch file of the upload and the
+  staging area of the originals (see originals.py) holding their SHA-1.
+* the Commons API, or a stand-in for it, for any SHA-1 not yet in the
+  index. Files found there are added to the index.
+
+Both make_glam_info.py and uploader.py check the SHA-1 of all originals of
+a batch against the index at once.
+
+usage:
+    python importer/sha1_index.py [OPTIONS]
+
+&params;
+"""
+import os
+import re
+import sqlite3
+import sys
+import threading
+from concurrent import futures
+
+import pywikibot
+
+import batchupload.common as common
+
+try:
+    import importer.http_client as http_client
+    import importer.originals as originals
+except ImportError:  # run as a script from within the importer directory
+    import http_client
+    import originals
+
+INDEX_FILE = 'sha1_index.sqlite'
+COMMONS_API = 'https://commons.wikimedia.org/w/api.php'
+LOOKUP_CHUNK = 500  # max number of SHA-1 per query to the index
+DEFAULT_WORKERS = 4
+SHA1_PATTERN = re.compile(r'^([0-9a-f]{40}|[0-9a-z]{31})$')
+
+DEFAULT_OPTIONS = {
+    'index': INDEX_FILE,
+    'snapshot': None,
+    'uploads': None,
+    'originals': originals.STAGING_DIR,
+    'lookup': False,
+    'api_url': COMMONS_API,
+    'workers': DEFAULT_WORKERS
+}
+PARAMETER_HELP = u"""\
+Index options:
+-index:PATH            path to the index database (DEF: {index})
+-snapshot:PATH         tab separated file of SHA-1 and title to add to the \
+index (DEF: {snapshot})
+-uploads:PATH          batch file of an earlier upload whose files to add to \
+the index (DEF: {uploads})
+-originals:PATH        staging area holding the originals of the batch, and \
+their SHA-1, see originals.py (DEF: {originals})
+-lookup:BOOL           whether to look up the originals which are not in the \
+index using the Commons API (DEF: {lookup})
+-api_url:URL           url of the Commons API (DEF: {api_url})
+-workers:INT           number of parallel API lookups (DEF: {workers})
+"""
+__doc__ = __doc__.replace(
+    '&params;', PARAMETER_HELP.format(**DEFAULT_OPTIONS))
+
+
+class Sha1Index(object):
+    """
+    The SHA-1 of all files known to be on Commons.
+
+    For every file the title on Commons is stored together with the source
+    it was learnt from, e.g. 'snapshot', 'upload' or 'api'.
+    """
+
+    def __init__(self, filename=None):
+        """
+        Open the index in the given database file, creating it if needed.
+
+        :param filename: path to the database file, defaults to INDEX_FILE
+        """
+        self.filename = filename or INDEX_FILE
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            self.filename, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'sha1 TEXT PRIMARY KEY, title TEXT, source TEXT)')
+
+    def add(self, entries, source):
+        """
+        Add files to the index, replacing any earlier title.
+
+        :param entries: iterable of tuples of SHA-1 and title
+        :param source: where the files were learnt from
+        :return: the number of added files
+        """
+        rows = [(normalise_sha1(sha1), normalise_title(title), source)
+                for sha1, title in entries]
+        with self._lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO files (sha1, title, source) '
+                'VALUES (?, ?, ?)', rows)
+        return len(rows)
+
+    def lookup(self, sha1s):
+        """
+        Look up many files at once.
+
+        :param sha1s: iterable of SHA-1, in hex or base 36
+        :return: dict of the (hex) SHA-1 of the known files to their title
+        """
+        sha1s = sorted(set(normalise_sha1(sha1) for sha1 in sha1s))
+        found = {}
+        with self._lock:
+            for i in range(0, len(sha1s), LOOKUP_CHUNK):
+                chunk = sha1s[i:i + LOOKUP_CHUNK]
+                found.update(self.connection.execute(
+                    'SELECT sha1, title FROM files WHERE sha1 IN ({})'.format(
+                        ', '.join('?' * len(chunk))), chunk))
+        return found
+
+    def __len__(self):
+        """Return the number of files in the index."""
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self.connection.close()
+
+
+def normalise_sha1(sha1):
+    """
+    Return a SHA-1 as lower case hex.
+
+    :param sha1: the SHA-1 in hex or in the base 36 used by MediaWiki
+    """
+    sha1 = sha1.strip().lower()
+    if not SHA1_PATTERN.match(sha1):
+        raise ValueError('Could not interpret the SHA-1 "{}"'.format(sha1))
+    if len(sha1) == 40:
+        return sha1
+    return '{:040x}'.format(int(sha1, 36))
+
+
+def normalise_title(title):
+    """Return a file title in the form "File:Some name.jpg"."""
+    title = title.strip().replace('_', ' ')
+    if not title.startswith('File:'):
+        title = 'File:' + title
+    return title
+
+
+def load_snapshot(index, filename):
+    """
+    Add the files of a snapshot to the index.
+
+    :param index: the Sha1Index
+    :param filename: path to a tab separated file of SHA-1 and title. Lines
+        without a SHA-1, e.g. a header, are ignored.
+    :return: the number of added files
+    """
+    def entries():
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                sha1, sep, title = line.rstrip('\n').partition('\t')
+                if SHA1_PATTERN.match(sha1.strip().lower()) and title.strip():
+                    yield sha1, title
+    return index.add(entries(), 'snapshot')
+
+
+def staged_sha1s(staging_dir):
+    """
+    Return the SHA-1 of the originals in a staging area.
+
+    :param staging_dir: the staging area, see originals.py
+    :return: dict of media id to tuple of SHA-1 and file extension
+    """
+    return {
+        media_id: (entry.get('sha1'), os.path.splitext(entry.get('file'))[1])
+        for media_id, entry in originals.read_manifest(staging_dir).items()}
+
+
+def batch_sha1s(batch, staging_dir):
+    """
+    Return the SHA-1 of the staged originals of a batch.
+
+    :param batch: dict of original url to batch entry, as made by
+        make_glam_info.py
+    :param staging_dir: the staging area holding the originals
+    :return: dict of original url to tuple of SHA-1 and file extension, for
+        the files whose original is staged
+    """
+    staged = staged_sha1s(staging_dir)
+    media_ids = {url: originals.url_media_id(url) for url in batch}
+    return {url: staged[media_id] for url, media_id in media_ids.items()
+            if media_id in staged}
+
+
+def record_uploads(index, batch_file, staging_dir):
+    """
+    Add the files of an earlier upload to the index.
+
+    Only files whose original is in the staging area can be added.
+
+    :param index: the Sha1Index
+    :param batch_file: the batch file of the upload, as made by
+        make_glam_info.py
+    :param staging_dir: the staging area holding the originals
+    :return: the number of added files
+    """
+    batch = common.open_and_read_file(batch_file, as_json=True)
+    return index.add(
+        [(sha1, batch[url].get('filename') + ext)
+         for url, (sha1, ext) in batch_sha1s(batch, staging_dir).items()],
+        'upload')
+
+
+def query_api(sha1, api_url=None):
+    """
+    Look up a single SHA-1 using the Commons API.
+
+    :param sha1: the SHA-1, in hex
+    :param api_url: url of the api, defaults to COMMONS_API
+    :return: the title of a file with this content, None if there is none
+    """
+    response = http_client.get_session().get(api_url or COMMONS_API, params={
+        'action': 'query',
+        'list': 'allimages',
+        'aisha1': sha1,
+        'ailimit': 1,
+        'format': 'json'
+    })
+    response.raise_for_status()
+    files = response.json().get('query', {}).get('allimages')
+    if files:
+        return files[0].get('title')
+
+
+def known_files(index, sha1s, api_url=None, workers=None):
+    """
+    Return the files which are already known to be on Commons.
+
+    The index is checked first. If an api_url is given the remaining files
+    are then looked up using the API, in parallel, and any found are added
+    to the index.
+
+    :param index: the Sha1Index
+    :param sha1s: iterable of SHA-1
+    :param api_url: url of the Commons API, None to only use the index
+    :param workers: number of parallel API lookups
+    :return: dict of (hex) SHA-1 to title
+    """
+    sha1s = set(normalise_sha1(sha1) for sha1 in sha1s)
+    found = index.lookup(sha1s)
+    missing = sorted(sha1s - set(found))
+    if api_url and missing:
+        with futures.ThreadPoolExecutor(
+                max_workers=workers or DEFAULT_WORKERS) as executor:
+            titles = executor.map(
+                lambda sha1: query_api(sha1, api_url), missing)
+            new = {sha1: title for sha1, title in zip(missing, titles)
+                   if title}
+        index.add(new.items(), 'api')
+        found.update((sha1, normalise_title(title))
+                     for sha1, title in new.items())
+    return found
+
+
+def filter_batch(batch, index, staging_dir, api_url=None, workers=None):
+    """
+    Drop the files already on Commons from a batch.
+
+    :param batch: dict of original url to batch entry, as made by
+        make_glam_info.py
+    :param index: the Sha1Index
+    :param staging_dir: the staging area holding the originals
+    :param api_url: url of the Commons API, None to only use the index
+    :param workers: number of parallel API lookups
+    :return: tuple of the filtered batch and a dict of the url of every
+        dropped file to the title of its duplicate
+    """
+    sha1s = {url: sha1 for url, (sha1, ext) in
+             batch_sha1s(batch, staging_dir).items()}
+    known = known_files(index, sha1s.values(), api_url, workers)
+    dropped = {url: known[sha1] for url, sha1 in sha1s.items()
+               if sha1 in known}
+    filtered = {url: entry for url, entry in batch.items()
+                if url not in dropped}
+    return filtered, dropped
+
+
+def handle_args(args):
+    """
+    Parse the command line arguments.
+
+    :return: dict of options, None if the usage should be shown
+    """
+    options = DEFAULT_OPTIONS.copy()
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        key = option[1:]
+        if key not in options:
+            return None
+        if key == 'workers':
+            options[key] = int(value)
+        elif key == 'lookup':
+            options[key] = common.interpret_bool(value)
+        else:
+            options[key] = common.convert_from_commandline(value)
+    return options
+
+
+def main(*args):
+    """Fill the index, or check the staged originals against it."""
+    options = handle_args(args)
+    if options is None:
+        pywikibot.output(__doc__)
+        return
+
+    index = Sha1Index(options.get('index'))
+    try:
+        if options.get('snapshot'):
+            pywikibot.output('{} files added from the snapshot'.format(
+                load_snapshot(index, options.get('snapshot'))))
+        if options.get('uploads'):
+            pywikibot.output('{} files added from the upload'.format(
+                record_uploads(index, options.get('uploads'),
+                               options.get('originals'))))
+        if options.get('lookup'):
+            staged = staged_sha1s(options.get('originals'))
+            known = known_files(
+                index, [sha1 for sha1, ext in staged.values()],
+                options.get('api_url'), options.get('workers'))
+            pywikibot.output(
+                '{0} of {1} staged originals are already on Commons'.format(
+                    len(known), len(staged)))
+        pywikibot.output('The index holds {} files'.format(len(index)))
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
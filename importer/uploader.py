@@ -1,12 +1,107 @@
 #!/usr/bin/python
 # -*- coding: utf-8  -*-
-"""Tool for uploading a single or multiple files from disc or url."""
+"""
+Tool for uploading a single or multiple files from disc or url.
+
+If a SHA-1 index is given, using -sha1_index:PATH, the files of the batch
+(-in_path) whose content is already on Commons are dropped before the
+upload. Their SHA-1 is taken from the staging area of the originals
+(-originals:PATH, see originals.py) and files not in the index are looked
+up using the Commons API (-api_url:URL) if -lookup:True is given. The
+remaining files are written to "<in_path>.unique.json" which is then uploaded
+instead.
+
+Any other arguments are passed on to the batchupload uploader.
+"""
+import os
+import sys
+
+import pywikibot
+
+import batchupload.common as common
 import batchupload.uploader as uploader
 
+try:
+    import importer.originals as originals
+    import importer.sha1_index as sha1_index
+except ImportError:  # run as a script from within the importer directory
+    import originals
+    import sha1_index
+
+DEFAULT_OPTIONS = {
+    'sha1_index': None,
+    'originals': originals.STAGING_DIR,
+    'lookup': False,
+    'api_url': sha1_index.COMMONS_API,
+    'workers': sha1_index.DEFAULT_WORKERS
+}
+
+
+def drop_known_files(in_path, options):
+    """
+    Write a copy of a batch without the files already on Commons.
+
+    :param in_path: path to the batch file
+    :param options: dict with the keys 'sha1_index', 'originals', 'lookup',
+        'api_url' and 'workers'
+    :return: path to the filtered batch file
+    """
+    batch = common.open_and_read_file(in_path, as_json=True)
+    index = sha1_index.Sha1Index(options.get('sha1_index'))
+    try:
+        filtered, dropped = sha1_index.filter_batch(
+            batch, index, options.get('originals'),
+            options.get('api_url') if options.get('lookup') else None,
+            options.get('workers'))
+    finally:
+        index.close()
+
+    for url, title in sorted(dropped.items()):
+        pywikibot.output('{0} -- dropped as it is already on Commons as '
+                         '{1}'.format(batch[url].get('filename'), title))
+    pywikibot.output('{0} of {1} files are already on Commons'.format(
+        len(dropped), len(batch)))
+    out_path = '{}.unique.json'.format(os.path.splitext(in_path)[0])
+    common.open_and_write_file(out_path, filtered, as_json=True)
+    return out_path
+
+
+def handle_args(args):
+    """
+    Parse the command line arguments.
+
+    Arguments which are not options of this script are left for the
+    batchupload uploader.
+
+    :return: tuple of dict of options and list of the remaining arguments
+    """
+    options = DEFAULT_OPTIONS.copy()
+    upload_args = []
+    for arg in args:
+        option, sep, value = arg.partition(':')
+        key = option[1:]
+        if key not in options:
+            upload_args.append(arg)
+        elif key == 'workers':
+            options[key] = int(value)
+        elif key == 'lookup':
+            options[key] = common.interpret_bool(value)
+        else:
+            options[key] = common.convert_from_commandline(value)
+    return options, upload_args
+
 
 def main(*arguments):
-    uploader.main(*arguments)
+    """Upload a batch, first dropping files already on Commons if asked."""
+    options, upload_args = handle_args(arguments)
+    if options.get('sha1_index'):
+        for i, arg in enumerate(upload_args):
+            if arg.startswith('-in_path:'):
+                upload_args[i] = '-in_path:{}'.format(drop_known_files(
+                    common.convert_from_commandline(arg[len('-in_path:'):]),
+                    options))
+    uploader.main(*upload_args)
 
 
 if __name__ == "__main__":
-    main()
+    main(*sys.argv[1:])
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""Test data and fixtures shared by several of the test modules."""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from importer import dimu_standin
+from importer.DiMuHarvester import DiMuHarvester
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+FOLDER_UUID = 'F0000000-0000-0000-0000-000000000000'
+
+
+def make_artifact(uuid, idno='NMA.0029884'):
+    """Return the test artifact given a new uuid and identifier."""
+    with open(os.path.join(DATA_DIR, 'dimu_artifact.json')) as f:
+        artifact = json.load(f)
+    artifact['uuid'] = uuid
+    artifact['identifier']['id'] = idno
+    return artifact
+
+
+def make_standin_data(num_objects):
+    """Create recordings for a folder with the given number of objects."""
+    artifacts = {}
+    docs = [{'artifact.uuid': 'subfolder', 'artifact.type': 'Folder'}]
+    for i in range(num_objects):
+        uuid = 'uuid_{:05d}'.format(i)
+        artifacts[uuid] = make_artifact(uuid, 'NMA.{:07d}'.format(i))
+        docs.append({
+            'artifact.uuid': uuid,
+            'artifact.type': 'Photograph',
+            'artifact.hasPictures': i % 10 != 0
+        })
+    folders = {
+        FOLDER_UUID: {'unique_id': '021097827596', 'title': 'A folder',
+                      'docs': docs}
+    }
+    return dimu_standin.StandinData(folders, artifacts)
+
+
+def make_image(media_id, size=300000):
+    """Return the bytes of a synthetic original of the given size."""
+    seed = hashlib.sha1(media_id.encode('utf-8')).digest()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class TmpDirTestCase(unittest.TestCase):
+    """Base for tests using a temporary directory, self.tmp_dir."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def patch(self, target, *args, **kwargs):
+        """Patch a target for the duration of the test, see mock.patch."""
+        patcher = mock.patch(target, *args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+
+class HarvesterTestCase(TmpDirTestCase):
+    """
+    Base for tests of the harvester.
+
+    The output is silenced, the harvest log is mocked and the cache is kept
+    in the temporary directory.
+    """
+
+    def setUp(self):
+        super(HarvesterTestCase, self).setUp()
+        self.mock_output = self.patch(
+            'importer.DiMuHarvester.pywikibot.output')
+        self.mock_logfile = self.patch(
+            'importer.DiMuHarvester.common.LogFile')
+        self.mock_logfile.return_value = self.mock_logfile
+        self.patch('importer.DiMuHarvester.CACHE_DIR',
+                   os.path.join(self.tmp_dir, 'cache'))
+
+
+class StandinHarvestTestCase(HarvesterTestCase):
+    """
+    Base for tests harvesting from a local stand-in of the DiMu API.
+
+    The stand-in serves the folder of make_standin_data, with num_objects
+    objects, which can be changed through self.data during the test.
+    """
+
+    num_objects = 20
+    harvester_settings = {}  # defaults for make_harvester
+
+    def setUp(self):
+        super(StandinHarvestTestCase, self).setUp()
+        self.data = make_standin_data(self.num_objects)
+        self.server = dimu_standin.StandinServer(self.data).start()
+        self.addCleanup(self.server.stop)
+
+    def make_harvester(self, **settings):
+        """
+        Return a harvester of the stand-in, harvesting all slides.
+
+        :param settings: harvester settings, overriding harvester_settings
+        """
+        options = {
+            'api_url': self.server.url,
+            'all_slides': True,
+            'exhibition_file': os.path.join(self.tmp_dir, 'exhibitions.json')
+        }
+        options.update(self.harvester_settings)
+        options.update(settings)
+        harvester = DiMuHarvester(options)
+        if harvester.journal:
+            self.addCleanup(harvester.journal.close)
+        return harvester
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import requests
+
+from importer import artifact_cache, dimu_standin
+
+
+class TestArtifactCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.store = artifact_cache.DirectoryStore(self.cache_dir)
+
+        self.artifact = {'uuid': 'uuid_1', 'dimuCode': '123'}
+        self.server = dimu_standin.StandinServer(dimu_standin.StandinData(
+            artifacts={'uuid_1': self.artifact})).start()
+        self.addCleanup(self.server.stop)
+        self.url = '{}/artifact/uuid/uuid_1'.format(self.server.url)
+
+    def test_load_read_through(self):
+        cache = artifact_cache.ArtifactCache(self.store, ttl=None)
+        self.assertEqual(cache.load('uuid_1', self.url), self.artifact)
+        self.assertEqual(cache.load('uuid_1', self.url), self.artifact)
+        self.assertEqual(cache.counts, {'fetched': 1, 'hit': 1})
+
+        data, meta = self.store.get('uuid_1')
+        self.assertEqual(data, self.artifact)
+        self.assertTrue(meta.get('etag'))
+        self.assertTrue(meta.get('fetched'))
+
+    def test_load_revalidate_unchanged(self):
+        cache = artifact_cache.ArtifactCache(self.store, ttl=0)
+        cache.load('uuid_1', self.url)
+        self.assertEqual(cache.load('uuid_1', self.url), self.artifact)
+        self.assertEqual(cache.counts, {'fetched': 1, 'revalidated': 1})
+
+    def test_load_revalidate_changed(self):
+        cache = artifact_cache.ArtifactCache(self.store, ttl=0)
+        cache.load('uuid_1', self.url)
+        self.artifact['dimuCode'] = '456'
+        self.assertEqual(
+            cache.load('uuid_1', self.url).get('dimuCode'), '456')
+        self.assertEqual(cache.counts, {'fetched': 2})
+        self.assertEqual(self.store.get('uuid_1')[0].get('dimuCode'), '456')
+
+    def test_load_legacy_entry(self):
+        # entries from older harvests lack the metadata file
+        with open(os.path.join(self.cache_dir, 'uuid_1.json'), 'w') as f:
+            json.dump({'uuid': 'uuid_1', 'dimuCode': 'old'}, f)
+
+        cache = artifact_cache.ArtifactCache(self.store, ttl=None)
+        self.assertEqual(cache.load('uuid_1', self.url).get('dimuCode'), 'old')
+
+        cache.ttl = 3600
+        self.assertEqual(cache.load('uuid_1', self.url).get('dimuCode'), '123')
+        self.assertEqual(cache.counts, {'hit': 1, 'fetched': 1})
+
+    def test_load_updated_timestamp(self):
+        cache = artifact_cache.ArtifactCache(self.store, ttl=None)
+        cache.load('uuid_1', self.url, updated='2018-01-01')
+        self.assertEqual(cache.updated('uuid_1'), '2018-01-01')
+
+        # same timestamp is served from cache, a new one is revalidated
+        cache.load('uuid_1', self.url, updated='2018-01-01')
+        self.artifact['dimuCode'] = '456'
+        self.assertEqual(
+            cache.load('uuid_1', self.url, updated='2019-01-01'),
+            self.artifact)
+        self.assertEqual(cache.updated('uuid_1'), '2019-01-01')
+        self.assertEqual(cache.counts, {'fetched': 2, 'hit': 1})
+
+    def test_load_missing(self):
+        cache = artifact_cache.ArtifactCache(self.store, ttl=None)
+        with self.assertRaises(requests.HTTPError):
+            cache.load('uuid_2', '{}/artifact/uuid/uuid_2'.format(
+                self.server.url))
+        self.assertEqual(self.store.get('uuid_2'), (None, None))
+
+    def test_load_sqlite_store(self):
+        store = artifact_cache.SqliteStore(
+            os.path.join(self.cache_dir, 'cache.sqlite'))
+        self.addCleanup(store.close)
+        cache = artifact_cache.ArtifactCache(store, ttl=0)
+        cache.load('uuid_1', self.url)
+        self.assertEqual(cache.load('uuid_1', self.url), self.artifact)
+        self.assertEqual(cache.counts, {'fetched': 1, 'revalidated': 1})
+
+
+class TestSqliteStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.meta = {'etag': '"abc"', 'last_modified': None, 'fetched': 1.5,
+                     'updated': '2018-01-01T00:00:00Z'}
+        self.data = {'uuid': 'uuid_1', 'title': 'Vid Storsjön'}
+
+    def make_store(self, compress=False):
+        store = artifact_cache.SqliteStore(
+            os.path.join(self.tmp_dir, 'cache.sqlite'), compress=compress)
+        self.addCleanup(store.close)
+        return store
+
+    def test_sqlite_store_roundtrip(self):
+        store = self.make_store()
+        self.assertEqual(store.get('uuid_1'), (None, None))
+        store.put('uuid_1', self.data, self.meta)
+        self.assertEqual(store.get('uuid_1'), (self.data, self.meta))
+        self.assertEqual(store.uuids(), ['uuid_1'])
+
+    def test_sqlite_store_compressed(self):
+        store = self.make_store(compress=True)
+        store.put('uuid_1', self.data, self.meta)
+        store.compress = False
+        store.put('uuid_2', self.data, self.meta)
+        self.assertEqual(store.get('uuid_1')[0], self.data)
+        self.assertEqual(store.get('uuid_2')[0], self.data)
+
+    def test_sqlite_store_put_meta(self):
+        store = self.make_store()
+        store.put('uuid_1', self.data, self.meta)
+        store.put_meta('uuid_1', {'etag': '"def"', 'fetched': 2.5})
+        self.assertEqual(
+            store.get('uuid_1')[1],
+            {'etag': '"def"', 'last_modified': None, 'fetched': 2.5,
+             'updated': None})
+
+    def test_migrate(self):
+        source = artifact_cache.DirectoryStore(
+            os.path.join(self.tmp_dir, 'cache'))
+        source.put('uuid_1', self.data, self.meta)
+        with open(source.data_path('uuid_2'), 'w') as f:
+            json.dump(self.data, f)  # legacy entry without metadata
+        target = self.make_store(compress=True)
+
+        self.assertEqual(artifact_cache.migrate(source, target), 2)
+        self.assertEqual(sorted(target.uuids()), ['uuid_1', 'uuid_2'])
+        self.assertEqual(target.get('uuid_1'), (self.data, self.meta))
+        self.assertEqual(target.get('uuid_2')[0], self.data)
+
+    def test_make_store_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            artifact_cache.make_store('redis')
+
+    @mock.patch('importer.artifact_cache.pywikibot.handle_args',
+                side_effect=lambda args: args)
+    def test_handle_args(self, mock_handle_args):
+        options = artifact_cache.handle_args(
+            ['-from:cache', '-to:cache.sqlite', '-compress:true'])
+        self.assertEqual(options['from'], 'cache')
+        self.assertEqual(options['to'], 'cache.sqlite')
+        self.assertTrue(options['compress'])
+        self.assertFalse(
+            artifact_cache.handle_args(['-from:cache'])['compress'])
+        self.assertIsNone(artifact_cache.handle_args(['-to:cache.sqlite']))
+        self.assertIsNone(artifact_cache.handle_args(['-unknown:1']))
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import unittest
+
+import mock
+from importer.delta_harvest import DeltaHarvest
+from tests.factories import StandinHarvestTestCase
+
+
+class TestDeltaHarvest(unittest.TestCase):
+
+    def setUp(self):
+        self.delta = DeltaHarvest({
+            'uuid_1_0': {'idno': '1', 'updated': '2018'},
+            'uuid_1_1': {'idno': '1', 'updated': '2018'},
+            'uuid_2_0': {'idno': '2', 'updated': '2018'},
+            'uuid_3_0': {'idno': '3', 'updated': '2018'},
+            'uuid_5_0': {'idno': '5'}
+        })
+
+    def test_check(self):
+        self.assertTrue(self.delta.check('uuid_1', '2018'))
+        self.assertFalse(self.delta.check('uuid_2', '2019'))
+        self.assertFalse(self.delta.check('uuid_4', '2018'))
+        self.assertEqual(
+            self.delta.summary(),
+            {'new': ['uuid_4'], 'changed': ['uuid_2'],
+             'unchanged': ['uuid_1'], 'removed': ['uuid_3', 'uuid_5']})
+
+    def test_check_unknown_timestamp(self):
+        self.assertFalse(self.delta.check('uuid_1', None))
+        # harvested without a timestamp
+        self.assertFalse(self.delta.check('uuid_5', '2018'))
+
+    def test_reuse(self):
+        self.assertEqual(
+            list(self.delta.reuse('uuid_1')),
+            [('uuid_1_0', {'idno': '1', 'updated': '2018'}),
+             ('uuid_1_1', {'idno': '1', 'updated': '2018'})])
+
+
+class TestDeltaHarvestWithStandin(StandinHarvestTestCase):
+
+    harvester_settings = {'cache': True}
+
+    def setUp(self):
+        super(TestDeltaHarvestWithStandin, self).setUp()
+        self.docs = list(self.data.folders.values())[0]['docs']
+        for doc in self.docs:
+            doc['artifact.updatedDate'] = '2018-01-01T00:00:00Z'
+
+    def test_delta_harvest(self):
+        first_harvester = self.make_harvester()
+        first_harvester.load_folder('021097827596')
+
+        # change uuid_00001 and drop uuid_00002
+        self.docs[2]['artifact.updatedDate'] = '2019-01-01T00:00:00Z'
+        self.data.artifacts['uuid_00001']['dimuCode'] = 'changed'
+        del self.docs[3]
+
+        delta_harvester = self.make_harvester()
+        delta_harvester.delta = DeltaHarvest(first_harvester.data)
+        with mock.patch.object(
+                delta_harvester, 'parse_single_object',
+                wraps=delta_harvester.parse_single_object) as mock_parse:
+            delta_harvester.load_folder('021097827596')
+
+        mock_parse.assert_called_once_with(
+            self.data.artifacts['uuid_00001'])
+        summary = delta_harvester.delta.summary()
+        self.assertEqual(summary.get('changed'), ['uuid_00001'])
+        self.assertEqual(summary.get('removed'), ['uuid_00002'])
+        self.assertEqual(len(summary.get('unchanged')), 16)
+        self.assertNotIn('uuid_00002_0', delta_harvester.data)
+        self.assertEqual(
+            delta_harvester.data.get('uuid_00003_0'),
+            first_harvester.data.get('uuid_00003_0'))
+        self.assertEqual(len(delta_harvester.data), 34)
+        self.assertEqual(
+            delta_harvester.data.get('uuid_00001_65281').get('updated'),
+            '2019-01-01T00:00:00Z')
+
+    def test_delta_harvest_after_cache_refresh(self):
+        first_harvester = self.make_harvester()
+        first_harvester.load_folder('021097827596')
+
+        # a later, full, harvest refreshes the cache with the change
+        self.docs[2]['artifact.updatedDate'] = '2019-01-01T00:00:00Z'
+        self.data.artifacts['uuid_00001']['dimuCode'] = 'changed'
+        self.make_harvester().load_folder('021097827596')
+
+        delta_harvester = self.make_harvester()
+        delta_harvester.delta = DeltaHarvest(first_harvester.data)
+        delta_harvester.load_folder('021097827596')
+        self.assertEqual(
+            delta_harvester.delta.summary().get('changed'), ['uuid_00001'])
+        self.assertNotEqual(
+            delta_harvester.data.get('uuid_00001_65281'),
+            first_harvester.data.get('uuid_00001_65281'))
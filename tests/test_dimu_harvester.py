@@ -7,24 +7,15 @@ import requests
 import pywikibot
 
 import mock
+from importer import DiMuHarvester
 from importer.DiMuHarvester import DiMuHarvester as harvester
+from tests.factories import HarvesterTestCase, make_artifact
 
 
-class DiMuHarvesterTestBase(unittest.TestCase):
+class DiMuHarvesterTestBase(HarvesterTestCase):
 
     def setUp(self):
-        # silence output
-        output_patcher = mock.patch(
-            'importer.DiMuHarvester.pywikibot.output')
-        self.mock_output = output_patcher.start()
-        self.addCleanup(output_patcher.stop)
-
-        logfile_patcher = mock.patch(
-            'importer.DiMuHarvester.common.LogFile')
-        self.mock_logfile = logfile_patcher.start()
-        self.mock_logfile.return_value = self.mock_logfile
-        self.addCleanup(logfile_patcher.stop)
-
+        super(DiMuHarvesterTestBase, self).setUp()
         self.harvester = harvester({})
 
 
@@ -104,6 +95,21 @@ class TestGetSearchRecordFromUrl(DiMuHarvesterTestBase):
              'api.key': None, 'start': 0,
              'fq': ['identifier.owner:GLAM', 'artifact.type:Folder']})
 
+    def test_get_search_record_from_url_only_objects(self):
+        self.harvester.settings['rows'] = 500
+        self.assertEqual(
+            self.harvester.get_search_record_from_url(123, only_objects=True),
+            'a response'
+        )
+        self.mock_get_json.assert_called_once_with(
+            self.base_url,
+            {'q': 123, 'rows': 500, 'wt': 'json',
+             'api.key': None, 'start': 0,
+             'fq': ['artifact.type:(Photograph OR Thing OR Fineart)',
+                    'artifact.hasPictures:true'],
+             'fl': 'artifact.uuid,artifact.type,artifact.hasPictures,'
+                   'artifact.updatedDate'})
+
     def test_get_search_record_from_url_error(self):
         self.mock_get_json.side_effect = requests.HTTPError(
             'AN ERROR',
@@ -247,3 +253,228 @@ class TestMergePlace(unittest.TestCase):
             str(cm.exception),
             'failed merge other'
         )
+
+
+class TestParseSingleObject(DiMuHarvesterTestBase):
+
+    def test_unknown_keys_are_tallied(self):
+        artifact = make_artifact('uuid_1')
+        artifact['coordinates'] = [{'lat': 59.3, 'lon': 18.1}]
+        artifact['motif']['unusual'] = 'value'
+
+        for i in range(3):
+            self.harvester.parse_single_object(artifact)
+        self.assertEqual(self.harvester.unknown_keys.report(), [
+            ('coordinates', 3, 'uuid_1'), ('motif.unusual', 3, 'uuid_1')])
+        self.mock_logfile.write.assert_not_called()
+
+        with mock.patch(
+                'importer.DiMuHarvester.pywikibot.warning') as mock_warning:
+            self.harvester.report_unknown_keys()
+        self.assertEqual(mock_warning.call_count, 2)
+        self.assertIn('Found 3 entries', mock_warning.call_args[0][0])
+
+
+class TestProcessObjects(DiMuHarvesterTestBase):
+
+    def setUp(self):
+        super(TestProcessObjects, self).setUp()
+        self.artifacts = {
+            'uuid_{}'.format(i): make_artifact(
+                'uuid_{}'.format(i), 'NMA.{:07d}'.format(i % 4))
+            for i in range(20)}
+        self.uuids = sorted(self.artifacts.keys())
+
+        load_patcher = mock.patch(
+            'importer.DiMuHarvester.DiMuHarvester.load_single_object',
+            side_effect=lambda uuid: self.artifacts.get(uuid))
+        self.mock_load = load_patcher.start()
+        self.addCleanup(load_patcher.stop)
+
+    def test_process_objects_workers_match_serial(self):
+        self.harvester.settings['all_slides'] = True
+        self.harvester.process_objects(self.uuids)
+        serial_data = self.harvester.data
+
+        self.harvester.data = {}
+        self.harvester.settings['workers'] = 4
+        self.harvester.process_objects(self.uuids)
+
+        self.assertEqual(len(serial_data), 40)
+        self.assertEqual(self.harvester.data, serial_data)
+        self.assertEqual(
+            list(self.harvester.data.keys()), list(serial_data.keys()))
+
+    def test_process_objects_prefetches_exhibitions(self):
+        for i, uuid in enumerate(self.uuids[:4]):
+            self.artifacts[uuid]['exhibitions'] = [{
+                'uuid': 'exh_{}'.format(i % 2), 'titles': [],
+                'timespan': {'fromYear': 1970, 'toYear': 1971}}]
+        calls = []
+        self.harvester.exhibitions.fetch = mock.Mock(
+            side_effect=lambda uuid: calls.append(uuid) or 'code_' + uuid)
+        self.harvester.settings['workers'] = 4
+        with mock.patch.object(
+                self.harvester, 'timed_parse',
+                wraps=self.harvester.timed_parse) as mock_parse:
+            mock_parse.side_effect = (
+                lambda data: calls.append('parse') or mock.DEFAULT)
+            self.harvester.process_objects(self.uuids)
+
+        self.assertEqual(sorted(calls[:2]), ['exh_0', 'exh_1'])
+        self.assertEqual(calls[2:], ['parse'] * 20)
+        image = self.harvester.data['uuid_1_65281']
+        self.assertEqual(image['exhibitions'][0]['dimu_code'], 'code_exh_1')
+
+    def test_process_objects_skips_failed_objects(self):
+        self.harvester.settings['workers'] = 4
+        self.harvester.process_objects(self.uuids + ['missing'])
+        self.assertEqual(len(self.harvester.data), 20)
+        self.assertTrue(all(
+            key.startswith('uuid_') for key in self.harvester.data))
+
+
+class TestIterCollection(DiMuHarvesterTestBase):
+
+    def setUp(self):
+        super(TestIterCollection, self).setUp()
+        self.docs = [
+            {'artifact.uuid': 'uuid_{}'.format(i),
+             'artifact.type': 'Photograph',
+             'artifact.hasPictures': True}
+            for i in range(25)]
+
+        def search(query, start=None, only_folder=False, only_objects=False):
+            start = start or 0
+            return {'numFound': len(self.docs),
+                    'docs': self.docs[start:start + 10]}
+
+        search_patcher = mock.patch.object(
+            harvester, 'get_search_record_from_url', side_effect=search)
+        self.mock_search = search_patcher.start()
+        self.addCleanup(search_patcher.stop)
+
+        folder_patcher = mock.patch(
+            'importer.DiMuHarvester.DiMuHarvester.load_collection_object',
+            return_value='folder_uuid')
+        folder_patcher.start()
+        self.addCleanup(folder_patcher.stop)
+
+    def test_iter_collection_all_pages(self):
+        pages = list(self.harvester.iter_collection('123'))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(
+            sum(pages, []), [doc['artifact.uuid'] for doc in self.docs])
+        self.mock_search.assert_has_calls([
+            mock.call(query='artifact.folderUids:folder_uuid', start=0,
+                      only_objects=True),
+            mock.call(query='artifact.folderUids:folder_uuid', start=10,
+                      only_objects=True),
+            mock.call(query='artifact.folderUids:folder_uuid', start=20,
+                      only_objects=True)])
+
+    def test_iter_collection_page_workers(self):
+        self.harvester.settings['page_workers'] = 3
+        pages = list(self.harvester.iter_collection('123'))
+        self.assertEqual(
+            sum(pages, []), [doc['artifact.uuid'] for doc in self.docs])
+
+    def test_iter_collection_cutoff(self):
+        self.harvester.settings['cutoff'] = 12
+        pages = list(self.harvester.iter_collection('123'))
+        self.assertEqual(
+            sum(pages, []), ['uuid_{}'.format(i) for i in range(12)])
+        self.assertEqual(self.mock_search.call_count, 2)
+
+    def test_iter_collection_pages_resume(self):
+        pages = list(self.harvester.iter_collection_pages('123', start=10))
+        self.assertEqual([offset for offset, uuids in pages], [20, 25])
+        self.assertEqual(
+            pages[0][1], ['uuid_{}'.format(i) for i in range(10, 20)])
+        self.assertEqual(self.mock_search.call_count, 2)
+
+    def test_iter_collection_dedupe_moved_docs(self):
+        # a doc which is pushed to the next page while paging
+        self.docs.insert(10, self.docs[9])
+        pages = list(self.harvester.iter_collection('123'))
+        self.assertEqual(
+            sum(pages, []), ['uuid_{}'.format(i) for i in range(25)])
+
+
+class TestLoadFolders(DiMuHarvesterTestBase):
+
+    def setUp(self):
+        super(TestLoadFolders, self).setUp()
+        self.folders = {
+            'folder_1': ['uuid_1', 'uuid_2', 'uuid_3'],
+            'folder_2': ['uuid_3', 'uuid_4', 'uuid_1']
+        }
+
+        def search(query, start=None, only_folder=False, only_objects=False):
+            uuids = self.folders.get(query.partition(':')[2])
+            return {'numFound': len(uuids),
+                    'docs': [{'artifact.uuid': uuid,
+                              'artifact.type': 'Photograph',
+                              'artifact.hasPictures': True}
+                             for uuid in uuids]}
+
+        search_patcher = mock.patch.object(
+            harvester, 'get_search_record_from_url', side_effect=search)
+        search_patcher.start()
+        self.addCleanup(search_patcher.stop)
+
+        folder_patcher = mock.patch.object(
+            harvester, 'load_collection_object', side_effect=lambda idno: idno)
+        folder_patcher.start()
+        self.addCleanup(folder_patcher.stop)
+
+        process_patcher = mock.patch.object(harvester, 'process_objects')
+        self.mock_process = process_patcher.start()
+        self.addCleanup(process_patcher.stop)
+
+    def test_load_folders_dedupe(self):
+        self.harvester.load_folders(['folder_1', 'folder_2'])
+        self.mock_process.assert_has_calls([
+            mock.call(['uuid_1', 'uuid_2', 'uuid_3']),
+            mock.call(['uuid_4'])])
+        self.assertEqual(
+            self.harvester.add_folders('uuid_1_0', {})['folders'],
+            ['folder_1', 'folder_2'])
+        self.assertEqual(
+            self.harvester.add_folders('uuid_4_0', {})['folders'],
+            ['folder_2'])
+
+    def test_add_folders_no_folder_harvest(self):
+        self.assertEqual(self.harvester.add_folders('uuid_1_0', {}), {})
+
+    def test_folder_ids(self):
+        self.assertEqual(DiMuHarvester.folder_ids('021097827596, abc,'),
+                         ['021097827596', 'abc'])
+        self.assertEqual(DiMuHarvester.folder_ids(['abc']), ['abc'])
+        self.assertEqual(DiMuHarvester.folder_ids(None), [])
+
+
+class TestLoadSettings(unittest.TestCase):
+
+    def setUp(self):
+        handle_args_patcher = mock.patch(
+            'importer.DiMuHarvester.pywikibot.handle_args',
+            side_effect=lambda args: args)
+        handle_args_patcher.start()
+        self.addCleanup(handle_args_patcher.stop)
+
+        read_patcher = mock.patch(
+            'importer.DiMuHarvester.common.open_and_read_file')
+        self.mock_read = read_patcher.start()
+        self.mock_read.return_value = {}
+        self.addCleanup(read_patcher.stop)
+
+    def test_load_settings_zero_numbers(self):
+        self.mock_read.return_value = {'cache_ttl': 0, 'workers': 4}
+        options = DiMuHarvester.load_settings(['-retries:0', '-backoff:0'])
+        self.assertEqual(options.get('retries'), 0)
+        self.assertEqual(options.get('backoff'), 0)
+        self.assertEqual(options.get('cache_ttl'), 0)
+        self.assertEqual(options.get('workers'), 4)
+        self.assertEqual(options.get('timeout'),
+                         DiMuHarvester.DEFAULT_OPTIONS.get('timeout'))
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+from importer.exhibition_store import ExhibitionStore, exhibition_uuids
+
+
+def save_codes(filename, uuids):
+    """Look up and save some codes in a separate process."""
+    store = ExhibitionStore(filename, lambda uuid: 'code_' + uuid)
+    for uuid in uuids:
+        store.get(uuid)
+        store.save()
+
+
+class TestExhibitionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.filename = os.path.join(self.tmp_dir, 'exhibitions.json')
+        self.fetch = mock.Mock(side_effect=lambda uuid: 'code_' + uuid)
+
+    def test_get_persists_between_runs(self):
+        store = ExhibitionStore(self.filename, self.fetch)
+        self.assertEqual(store.get('exh_1'), 'code_exh_1')
+        self.assertEqual(store.get('exh_1'), 'code_exh_1')
+        store.save()
+
+        store = ExhibitionStore(self.filename, self.fetch)
+        self.assertEqual(store.get('exh_1'), 'code_exh_1')
+        self.fetch.assert_called_once_with('exh_1')
+
+    def test_get_ttl(self):
+        store = ExhibitionStore(self.filename, self.fetch, ttl=60)
+        store.get('exh_1')
+        store.entries['exh_1']['fetched'] = time.time() - 120
+        self.assertNotIn('exh_1', store)
+        store.get('exh_1')
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_get_failed_not_stored(self):
+        self.fetch.side_effect = None
+        self.fetch.return_value = None
+        store = ExhibitionStore(self.filename, self.fetch)
+        self.assertIsNone(store.get('exh_1'))
+        self.assertIsNone(store.get('exh_1'))
+        self.assertEqual(store.entries, {})
+        self.fetch.assert_called_once_with('exh_1')
+
+    def test_get_single_flight(self):
+        release = threading.Event()
+
+        def slow_fetch(uuid):
+            release.wait(5)
+            return 'code_' + uuid
+
+        self.fetch.side_effect = slow_fetch
+        store = ExhibitionStore(self.filename, self.fetch)
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(store.get('exh_1')))
+            for i in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['code_exh_1'] * 5)
+        self.fetch.assert_called_once_with('exh_1')
+
+    def test_missing(self):
+        store = ExhibitionStore(self.filename, self.fetch)
+        store.get('exh_1')
+        raw_data = [
+            {'exhibitions': [{'uuid': 'exh_1'}, {'uuid': 'exh_2'}]},
+            None,
+            {'exhibitions': [{'uuid': 'exh_2'}, {'uuid': 'exh_3'}]}]
+        self.assertEqual(store.missing(exhibition_uuids(raw_data)),
+                         {'exh_2', 'exh_3'})
+
+    def test_prefetch(self):
+        store = ExhibitionStore(self.filename, self.fetch)
+        store.get('exh_1')
+        raw_data = [
+            {'exhibitions': [{'uuid': 'exh_1'}, {'uuid': 'exh_2'}]},
+            None,
+            {'exhibitions': [{'uuid': 'exh_2'}, {'uuid': 'exh_3'}]}]
+        store.prefetch(exhibition_uuids(raw_data), workers=2)
+        self.assertEqual(sorted(store.entries), ['exh_1', 'exh_2', 'exh_3'])
+        self.assertEqual(self.fetch.call_count, 3)
+
+    def test_save_merges(self):
+        store_1 = ExhibitionStore(self.filename, self.fetch)
+        store_2 = ExhibitionStore(self.filename, self.fetch)
+        store_1.get('exh_1')
+        store_1.get('exh_3')
+        store_2.get('exh_2')
+        store_2.get('exh_1')
+        store_1.save()
+        store_2.save()
+
+        store = ExhibitionStore(self.filename, self.fetch)
+        self.assertEqual(sorted(store.entries), ['exh_1', 'exh_2', 'exh_3'])
+        self.assertEqual(store.entries['exh_1'],
+                         store_2.entries['exh_1'])
+
+    def test_save_concurrent_processes(self):
+        uuids = [['exh_{0}_{1}'.format(i, j) for j in range(20)]
+                 for i in range(4)]
+        with multiprocessing.Pool(4) as pool:
+            pool.starmap(save_codes, [(self.filename, u) for u in uuids])
+
+        store = ExhibitionStore(self.filename, self.fetch)
+        self.assertEqual(sorted(store.entries),
+                         sorted(sum(uuids, [])))
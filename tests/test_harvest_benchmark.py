@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import os
+import unittest
+
+import mock
+import requests
+
+import pywikibot
+
+from importer import dimu_standin, harvest_benchmark
+from tests.factories import DATA_DIR
+
+
+class TestSyntheticArtifacts(unittest.TestCase):
+
+    def setUp(self):
+        self.templates = [
+            {'artifactType': 'Thing', 'identifier': {'id': 'NM.1'}},
+            {'artifactType': 'Photograph'}]
+        self.artifacts = dimu_standin.SyntheticArtifacts(self.templates, 3)
+
+    def test_getitem(self):
+        artifact = self.artifacts['synthetic_0000002']
+        self.assertEqual(artifact['uuid'], 'synthetic_0000002')
+        self.assertEqual(artifact['identifier']['id'], 'SYN.2')
+        self.assertEqual(artifact['artifactType'], 'Thing')
+        # the templates are left untouched
+        self.assertEqual(self.templates[0]['identifier']['id'], 'NM.1')
+
+    def test_getitem_unknown(self):
+        with self.assertRaises(KeyError):
+            self.artifacts['synthetic_0000003']
+        with self.assertRaises(KeyError):
+            self.artifacts['021097827596']
+
+    def test_synthetic_data(self):
+        data = dimu_standin.StandinData.synthetic(self.templates, 3)
+        docs = data.search(
+            dimu_standin.SYNTHETIC_FOLDER_ID, ['artifact.type:Folder'])
+        self.assertEqual(
+            docs[0]['artifact.uuid'], dimu_standin.SYNTHETIC_FOLDER_UUID)
+        self.assertEqual(len(data.artifacts), 3)
+        self.assertEqual(
+            data.folders[dimu_standin.SYNTHETIC_FOLDER_UUID]['docs'][1],
+            {'artifact.uuid': 'synthetic_0000001',
+             'artifact.type': 'Photograph', 'artifact.hasPictures': True})
+
+
+class TestStandinConditions(unittest.TestCase):
+
+    def make_server(self, **kwargs):
+        data = dimu_standin.StandinData.synthetic([{}], 1)
+        server = dimu_standin.StandinServer(data, **kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_error_rate(self):
+        server = self.make_server(error_rate=1)
+        response = requests.get(
+            '{}/artifact/uuid/synthetic_0000000'.format(server.url))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(server.counts, {'requests': 1, 'errors': 1})
+
+    def test_latency(self):
+        server = self.make_server(latency=0.2)
+        response = requests.get(
+            '{}/artifact/uuid/synthetic_0000000'.format(server.url))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.elapsed.total_seconds(), 0.2)
+
+
+class TestHarvestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.templates = harvest_benchmark.load_templates(
+            os.path.join(DATA_DIR, 'dimu_artifact.json'))
+
+    def test_run_benchmark(self):
+        options = harvest_benchmark.DEFAULT_OPTIONS.copy()
+        result = harvest_benchmark.run_benchmark(30, self.templates, options)
+        self.assertEqual(result['size'], 30)
+        self.assertEqual(result['objects'], 30)
+        self.assertEqual(result['failed_objects'], 0)
+        self.assertGreater(result['objects_per_second'], 0)
+        self.assertGreater(result['peak_rss_mb'], 0)
+        self.assertIsNotNone(result['object_load_p95'])
+        self.assertIsNotNone(result['parse_p95'])
+        self.assertIn('30 objects', harvest_benchmark.format_result(result))
+
+    def test_run_benchmark_failed_harvest(self):
+        options = harvest_benchmark.DEFAULT_OPTIONS.copy()
+        options.update({'error_rate': 1, 'retries': 0})
+        with self.assertRaises(pywikibot.Error):
+            harvest_benchmark.run_benchmark(20, self.templates, options)
+
+    @mock.patch('importer.harvest_benchmark.pywikibot.handle_args',
+                side_effect=lambda args: args)
+    def test_handle_args(self, mock_handle_args):
+        options = harvest_benchmark.handle_args(
+            ['-sizes:10', '-latency:0.5', '-workers:4', '-stream:True',
+             '-templates:cache'])
+        self.assertEqual(options['sizes'], '10')
+        self.assertEqual(options['templates'], 'cache')
+        self.assertEqual(options['latency'], 0.5)
+        self.assertEqual(options['workers'], 4)
+        self.assertTrue(options['stream'])
+        self.assertIsNone(harvest_benchmark.handle_args(['-unknown:1']))
+        # the templates are required
+        self.assertIsNone(harvest_benchmark.handle_args(['-sizes:10']))
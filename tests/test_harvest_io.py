@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import json
+import os
+import unittest
+
+from importer import harvest_io
+from tests.factories import FOLDER_UUID, StandinHarvestTestCase, TmpDirTestCase
+
+
+class TestJsonlHarvestWriter(TmpDirTestCase):
+
+    def setUp(self):
+        super(TestJsonlHarvestWriter, self).setUp()
+        self.filename = os.path.join(self.tmp_dir, 'harvest.jsonl')
+
+    def test_save_sorted_across_runs(self):
+        writer = harvest_io.JsonlHarvestWriter(self.filename, run_size=3)
+        for i in (5, 2, 8, 1, 9, 3, 7):
+            writer['key_{}'.format(i)] = {'glam_id': [['S-NM', str(i)]]}
+
+        self.assertEqual(
+            writer.save(lambda entry: entry.get('glam_id')), 7)
+        self.assertEqual(
+            [key for key, entry in harvest_io.iter_harvest_data(
+                self.filename)],
+            ['key_1', 'key_2', 'key_3', 'key_5', 'key_7', 'key_8', 'key_9'])
+        self.assertEqual(os.listdir(self.tmp_dir), ['harvest.jsonl'])
+
+    def test_save_repeated_key_keeps_last(self):
+        writer = harvest_io.JsonlHarvestWriter(self.filename, run_size=2)
+        writer.update({'key_1': {'glam_id': 'a', 'title': 'old'},
+                       'key_2': {'glam_id': 'a'}})
+        writer['key_1'] = {'glam_id': 'a', 'title': 'Vid Storsjön'}
+
+        self.assertEqual(writer.save(lambda entry: entry.get('glam_id')), 2)
+        self.assertEqual(
+            harvest_io.load_harvest_data(self.filename),
+            {'key_1': {'glam_id': 'a', 'title': 'Vid Storsjön'},
+             'key_2': {'glam_id': 'a'}})
+
+    def test_save_repeated_key_with_new_glam_id_keeps_last(self):
+        writer = harvest_io.JsonlHarvestWriter(self.filename, run_size=2)
+        writer.update({'key_1': {'glam_id': 'a', 'title': 'old'},
+                       'key_2': {'glam_id': 'b'},
+                       'key_3': {'glam_id': 'c'}})
+        writer['key_1'] = {'glam_id': 'd', 'title': 'Vid Storsjön'}
+
+        self.assertEqual(writer.save(lambda entry: entry.get('glam_id')), 3)
+        self.assertEqual(
+            list(harvest_io.load_harvest_data(self.filename).items()),
+            [('key_2', {'glam_id': 'b'}),
+             ('key_3', {'glam_id': 'c'}),
+             ('key_1', {'glam_id': 'd', 'title': 'Vid Storsjön'})])
+
+
+class TestStreamingHarvest(StandinHarvestTestCase):
+
+    num_objects = 30
+
+    def test_streaming_matches_in_memory(self):
+        in_memory = self.make_harvester()
+        in_memory.load_folder('021097827596')
+
+        filename = os.path.join(self.tmp_dir, 'harvest.jsonl')
+        streaming = self.make_harvester(harvest_file=filename)
+        streaming.load_folder('021097827596')
+        streaming.save_data()
+
+        streamed = list(harvest_io.iter_harvest_data(filename))
+        for key, entry in in_memory.data.items():
+            in_memory.add_folders(key, entry)
+        self.assertEqual(streamed[0][1].get('folders'), [FOLDER_UUID])
+        self.assertEqual(dict(streamed),
+                         json.loads(json.dumps(in_memory.data)))
+        self.assertEqual([key for key, entry in streamed],
+                         list(in_memory.sort_data('glam_id')))
+
+    def test_normalised_matches_plain(self):
+        filenames = {}
+        for suffix in ('json', 'jsonl'):
+            for normalise in (False, True):
+                filename = os.path.join(self.tmp_dir, '{0}_harvest.{1}'.format(
+                    'normalised' if normalise else 'plain', suffix))
+                plain = self.make_harvester(harvest_file=filename,
+                                            normalise=normalise)
+                plain.load_folder('021097827596')
+                plain.save_data()
+                filenames[(suffix, normalise)] = filename
+
+        for suffix in ('json', 'jsonl'):
+            plain_file = filenames[(suffix, False)]
+            normalised_file = filenames[(suffix, True)]
+            normalised = harvest_io.load_harvest_data(normalised_file)
+            self.assertIsInstance(normalised, harvest_io.NormalisedHarvest)
+            self.assertEqual(dict(normalised),
+                             harvest_io.load_harvest_data(plain_file))
+            self.assertEqual(
+                sorted(harvest_io.iter_harvest_data(normalised_file)),
+                sorted(harvest_io.iter_harvest_data(plain_file)))
+            self.assertLess(os.path.getsize(normalised_file),
+                            os.path.getsize(plain_file))
+
+
+class TestNormalise(unittest.TestCase):
+
+    def test_normalise_and_expand(self):
+        shared = {'glam_id': [['S-NM', '1']], 'tags': ['a']}
+        entries = [
+            ('uuid_1_0', dict(shared, media_id='m0', slider_order=0,
+                              copyright={}, see_also=['uuid_1_1'])),
+            ('uuid_1_1', dict(shared, media_id='m1', slider_order=1,
+                              copyright={}, see_also=['uuid_1_0']))]
+        record = harvest_io.normalise(entries)
+        self.assertEqual(record['object'], shared)
+        self.assertEqual(record['images']['uuid_1_1'],
+                         {'media_id': 'm1', 'slider_order': 1,
+                          'copyright': {}, 'see_also': ['uuid_1_0']})
+        self.assertEqual(list(harvest_io.expand(record)), entries)
+
+        normalised = harvest_io.NormalisedHarvest({'uuid_1': record})
+        self.assertEqual(len(normalised), 2)
+        self.assertEqual(normalised['uuid_1_1'], entries[1][1])
+        self.assertIs(normalised['uuid_1_0']['tags'],
+                      normalised['uuid_1_1']['tags'])
+        with self.assertRaises(KeyError):
+            normalised['uuid_1_2']
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import json
+import os
+import tracemalloc
+
+import mock
+from importer import DiMuHarvester
+from importer.harvest_journal import HarvestJournal
+from tests.factories import FOLDER_UUID, StandinHarvestTestCase, TmpDirTestCase
+
+
+class TestHarvestJournal(TmpDirTestCase):
+
+    def setUp(self):
+        super(TestHarvestJournal, self).setUp()
+        self.filename = os.path.join(self.tmp_dir, 'harvest.json.journal')
+
+    def test_journal_resume(self):
+        journal = HarvestJournal(self.filename)
+        journal.record_object('uuid_1', {'uuid_1_0': {'idno': 'Vid Storsjön'}})
+        journal.record_object('uuid_2', {})
+        journal.record_page('folder_1', 10, ['uuid_1', 'uuid_2'])
+        journal.close()
+
+        journal = HarvestJournal(self.filename, resume=True)
+        self.addCleanup(journal.close)
+        self.assertEqual(journal.offset('folder_1'), 10)
+        self.assertEqual(journal.offset('folder_2'), 0)
+        self.assertEqual(journal.folders, {'folder_1': ['uuid_1', 'uuid_2']})
+        self.assertTrue(journal.has('uuid_2'))
+        self.assertEqual(
+            list(journal.iter_records()),
+            [('uuid_1', {'uuid_1_0': {'idno': 'Vid Storsjön'}}),
+             ('uuid_2', {})])
+
+    def test_journal_no_resume_truncates(self):
+        journal = HarvestJournal(self.filename)
+        journal.record_object('uuid_1', {})
+        journal.close()
+
+        journal = HarvestJournal(self.filename)
+        self.addCleanup(journal.close)
+        self.assertFalse(journal.has('uuid_1'))
+        self.assertEqual(os.path.getsize(self.filename), 0)
+
+    def test_journal_partial_line(self):
+        journal = HarvestJournal(self.filename)
+        journal.record_object('uuid_1', {})
+        journal.file.write('{"uuid": "uuid_2", "reco')
+        journal.close()
+
+        journal = HarvestJournal(self.filename, resume=True)
+        journal.record_object('uuid_3', {})
+        journal.close()
+
+        journal = HarvestJournal(self.filename, resume=True)
+        self.addCleanup(journal.close)
+        self.assertEqual(journal.processed, {'uuid_1', 'uuid_3'})
+        self.assertEqual([uuid for uuid, records in journal.iter_records()],
+                         ['uuid_1', 'uuid_3'])
+
+    def test_journal_keeps_only_uuids(self):
+        journal = HarvestJournal(self.filename)
+        self.addCleanup(journal.close)
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(200):
+            uuid = 'uuid_{}'.format(i)
+            journal.record_object(
+                uuid, {uuid + '_0': {'description': 'x' * 10000}})
+        # the 2 MB of entries are on disk only
+        self.assertLess(tracemalloc.get_traced_memory()[0] - before, 200000)
+        self.assertEqual(len(journal.processed), 200)
+        self.assertFalse(hasattr(journal, 'records'))
+
+    def test_journal_remove(self):
+        journal = HarvestJournal(self.filename)
+        journal.remove()
+        self.assertFalse(os.path.exists(self.filename))
+
+
+class TestResumeHarvest(StandinHarvestTestCase):
+
+    num_objects = 50
+
+    def make_harvester(self, **settings):
+        settings.update({
+            'rows': 10,
+            'harvest_file': os.path.join(self.tmp_dir, 'harvest.json')})
+        return super(TestResumeHarvest, self).make_harvester(**settings)
+
+    def test_resume_interrupted_harvest(self):
+        expected = self.make_harvester()
+        expected.load_folder('021097827596')
+
+        # interrupt the harvest while processing the 25th object
+        interrupted = self.make_harvester()
+        store_object = interrupted.store_object
+        stored = []
+
+        def interrupt(*args):
+            if len(stored) == 24:
+                raise KeyboardInterrupt
+            stored.append(args[0])
+            return store_object(*args)
+
+        with mock.patch.object(
+                interrupted, 'store_object', side_effect=interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                interrupted.load_folder('021097827596')
+
+        resumed = self.make_harvester(resume=True)
+        self.assertEqual(resumed.journal.offset(FOLDER_UUID), 20)
+        self.assertEqual(len(resumed.journal.processed), 24)
+        with mock.patch.object(
+                resumed, 'load_single_object',
+                wraps=resumed.load_single_object) as mock_load:
+            resumed.load_folder('021097827596')
+
+        self.assertEqual(mock_load.call_count, 45 - 24)
+        # journaled entries have been through json, as in the harvest file
+        self.assertEqual(json.loads(json.dumps(resumed.data)),
+                         json.loads(json.dumps(expected.data)))
+
+
+class TestResumeSetting(TmpDirTestCase):
+
+    def setUp(self):
+        super(TestResumeSetting, self).setUp()
+        self.patch('importer.DiMuHarvester.pywikibot.handle_args',
+                   side_effect=lambda args: args)
+        self.harvest_file = os.path.join(self.tmp_dir, 'harvest.json')
+
+    def test_handle_args_resume(self):
+        self.assertTrue(DiMuHarvester.handle_args(['-resume'], '')['resume'])
+        self.assertFalse(
+            DiMuHarvester.handle_args(['-resume:False'], '')['resume'])
+
+    def test_resume_flag_keeps_journal(self):
+        journal = HarvestJournal(self.harvest_file + '.journal')
+        journal.record_object('uuid_1', {'uuid_1_0': {'idno': '1'}})
+        journal.close()
+
+        with mock.patch('importer.DiMuHarvester.common.open_and_read_file',
+                        return_value={'resume': False}):
+            options = DiMuHarvester.load_settings(
+                ['-resume', '-harvest_file:' + self.harvest_file])
+        journal = HarvestJournal(self.harvest_file + '.journal',
+                                 resume=options.get('resume'))
+        self.addCleanup(journal.close)
+        self.assertTrue(journal.has('uuid_1'))
+
+    def test_resume_false_overrides_settings_file(self):
+        with mock.patch('importer.DiMuHarvester.common.open_and_read_file',
+                        return_value={'resume': True}):
+            options = DiMuHarvester.load_settings(['-resume:False'])
+        self.assertFalse(options.get('resume'))
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pywikibot
+
+import batchupload.common as common
+import mock
+from importer import dimu_standin, harvest_log
+from importer.DiMuHarvester import DiMuHarvester as harvester
+from tests.factories import make_standin_data
+
+
+class TestBufferedLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.log_file = os.path.join(self.tmp_dir, 'harvest.log')
+        self.json_file = os.path.join(self.tmp_dir, 'harvest.log.jsonl')
+
+    def read(self, filename):
+        with open(filename, encoding='utf-8') as f:
+            return f.read()
+
+    def test_same_text_as_plain_log(self):
+        plain_file = os.path.join(self.tmp_dir, 'plain.log')
+        for log in (common.LogFile('', plain_file),
+                    harvest_log.make_log(self.log_file, 'buffered')):
+            log.write('uuid_1')
+            log.write('uuid_1: had an unexpected event type "Ö".')
+            log.write('several\nlines')
+            log.close_and_confirm()
+        self.assertEqual(self.read(self.log_file), self.read(plain_file))
+
+    def test_json_records(self):
+        log = harvest_log.make_log(self.log_file, json_file=self.json_file)
+        self.assertIsInstance(log, harvest_log.BufferedLog)
+        log.write('uuid_1', 'uuid_1', 'search')
+        log.write_w_timestamp('Harvester started...')
+        harvest_log.write(log, 'uuid_2: a problem', 'parse', 'uuid_2')
+        log.close_and_confirm()
+
+        records = [json.loads(line)
+                   for line in self.read(self.json_file).splitlines()]
+        self.assertEqual(
+            [(r['uuid'], r['stage'], r['message']) for r in records[::2]],
+            [('uuid_1', 'search', 'uuid_1'),
+             ('uuid_2', 'parse', 'uuid_2: a problem')])
+        self.assertRegex(records[1]['message'],
+                         r'^\d{4}-\d\d-\d\d .*: Harvester started\.\.\.$')
+        self.assertIn('time', records[0])
+
+    def test_concurrent_writes(self):
+        log = harvest_log.BufferedLog(
+            common.LogFile('', self.log_file), self.json_file,
+            flush_interval=0.01, max_records=50)
+
+        def write_lines(thread):
+            for i in range(500):
+                log.write('{0}-{1}'.format(thread, i), stage='test')
+
+        threads = [threading.Thread(target=write_lines, args=(thread, ))
+                   for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.flush()
+        self.assertEqual(len(self.read(self.json_file).splitlines()), 4000)
+        log.close_and_confirm()
+
+        lines = self.read(self.log_file).splitlines()
+        self.assertEqual(sorted(lines), sorted(
+            '{0}-{1}'.format(thread, i)
+            for thread in range(8) for i in range(500)))
+        # the lines of each thread are kept in order
+        self.assertEqual([line for line in lines if line.startswith('3-')],
+                         ['3-{}'.format(i) for i in range(500)])
+
+    def test_output(self):
+        log = harvest_log.make_log(self.log_file, 'buffered')
+        with mock.patch('importer.harvest_log.pywikibot.output') as output:
+            harvest_log.output(log, 'Found 3 results')
+            log.close_and_confirm()
+        output.assert_called_once_with('Found 3 results')
+        self.assertEqual(self.read(self.log_file), '')
+
+    def test_make_log(self):
+        log = harvest_log.make_log(self.log_file)
+        self.assertNotIsInstance(log, harvest_log.BufferedLog)
+        log.close_and_confirm()
+        with self.assertRaises(pywikibot.Error):
+            harvest_log.make_log(self.log_file, 'unknown')
+        with self.assertRaises(pywikibot.Error):
+            harvest_log.make_log(self.log_file, 'plain', self.json_file)
+
+
+class TestBufferedHarvestLog(unittest.TestCase):
+
+    def setUp(self):
+        # silence output
+        output_patcher = mock.patch(
+            'importer.DiMuHarvester.pywikibot.output')
+        output_patcher.start()
+        self.addCleanup(output_patcher.stop)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        data = make_standin_data(30)
+        for uuid in ('uuid_00003', 'uuid_00005'):
+            data.artifacts[uuid]['subjects'] = [
+                {'name': 'Hav', 'nameType': 'other'}]
+        self.server = dimu_standin.StandinServer(data).start()
+        self.addCleanup(self.server.stop)
+
+    def harvest(self, name, **settings):
+        """Harvest the folder, returning the lines of the log."""
+        log_file = os.path.join(self.tmp_dir, name + '.log')
+        settings.update({
+            'api_url': self.server.url,
+            'harvest_log_file': log_file,
+            'cache_path': os.path.join(self.tmp_dir, name + '_cache'),
+            'exhibition_file': os.path.join(self.tmp_dir, 'exhibitions.json')
+        })
+        h = harvester(settings)
+        h.load_collection('021097827596')
+        h.log.close_and_confirm()
+        with open(log_file, encoding='utf-8') as f:
+            # drop the timestamp of the first line
+            return re.sub(r'^.*?: ', '', f.read()).splitlines()
+
+    def test_buffered_log_matches_plain(self):
+        json_file = os.path.join(self.tmp_dir, 'buffered.jsonl')
+        plain = self.harvest('plain', workers=4)
+        buffered = self.harvest('buffered', workers=4, log_json_file=json_file)
+        self.assertEqual(sorted(buffered), sorted(plain))
+        self.assertIn('Harvester started...', buffered)
+
+        with open(json_file, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), len(plain))
+        self.assertIn(('uuid_00003', 'parse',
+                       'uuid_00003: had an unexpected subject name type '
+                       '"other".'),
+                      [(r['uuid'], r['stage'], r['message'])
+                       for r in records])
+        # the uuid of every object found by the search
+        self.assertEqual(
+            len([r for r in records
+                 if r['stage'] == 'search' and r['uuid'] == r['message']]),
+            27)
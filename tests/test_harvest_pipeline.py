@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import pywikibot
+
+from importer import harvest_pipeline
+from tests.factories import StandinHarvestTestCase
+
+
+class TestPipelineHarvestEngine(StandinHarvestTestCase):
+
+    num_objects = 250
+    harvester_settings = {'cache': False}
+
+    def test_pipeline_engine_matches_sync(self):
+        sync_harvester = self.make_harvester()
+        sync_harvester.load_collection('021097827596')
+
+        pipeline_harvester = self.make_harvester(
+            engine='pipeline', workers=4, parse_workers=2, queue_size=10)
+        pipeline_harvester.load_folder('021097827596')
+
+        self.assertEqual(len(sync_harvester.data), 450)
+        self.assertEqual(pipeline_harvester.data, sync_harvester.data)
+        self.assertEqual(list(pipeline_harvester.data.keys()),
+                         list(sync_harvester.data.keys()))
+        self.assertEqual(
+            pipeline_harvester.stats.stage_report('parse')['count'], 225)
+
+    def test_pipeline_engine_exhibitions_and_failures(self):
+        pipeline_harvester = self.make_harvester()
+        self.server.data.artifacts['uuid_00001']['exhibitions'] = [{
+            'uuid': 'exh_1', 'titles': [{'title': 'An exhibition'}],
+            'timespan': {'fromYear': 1970, 'toYear': 1971}
+        }]
+        self.server.data.artifacts['exh_1'] = {
+            'uuid': 'exh_1', 'dimuCode': '0123456789'}
+
+        engine = harvest_pipeline.PipelineHarvestEngine(
+            pipeline_harvester, io_workers=2, parse_workers=1)
+        engine.load_uuid_list(['uuid_00001', 'missing', 'uuid_00002'])
+
+        self.assertEqual(len(pipeline_harvester.data), 4)
+        self.assertEqual(
+            pipeline_harvester.stats.counts['failed_objects'], 1)
+        image = next(image for key, image in pipeline_harvester.data.items()
+                     if key.startswith('uuid_00001_'))
+        self.assertEqual(image['exhibitions'][0].get('dimu_code'),
+                         '0123456789')
+
+    def test_pipeline_engine_producer_error(self):
+        pipeline_harvester = self.make_harvester(
+            engine='pipeline', parse_workers=1)
+        with self.assertRaises(pywikibot.Error):
+            pipeline_harvester.load_folder('999999999999')
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import os
+
+from importer import harvest_replay
+from tests.factories import FOLDER_UUID, StandinHarvestTestCase
+
+
+class TestHarvestReplay(StandinHarvestTestCase):
+
+    num_objects = 40
+
+    def setUp(self):
+        super(TestHarvestReplay, self).setUp()
+        self.settings = {
+            'all_slides': True,
+            'cache_path': os.path.join(self.tmp_dir, 'cache'),
+            'exhibition_file': os.path.join(self.tmp_dir, 'exhibitions.json'),
+            'harvest_file': os.path.join(self.tmp_dir, 'harvest.json')
+        }
+
+        # harvest the folder once to fill the cache
+        self.data.artifacts['uuid_00001']['exhibitions'] = [{
+            'uuid': 'exh_1', 'titles': [{'title': 'An exhibition'}],
+            'timespan': {'fromYear': 1970, 'toYear': 1971}
+        }]
+        self.data.artifacts['exh_1'] = {
+            'uuid': 'exh_1', 'dimuCode': '0123456789'}
+        for doc in self.data.folders[FOLDER_UUID]['docs']:
+            doc['artifact.updatedDate'] = '2020-01-01T00:00:00Z'
+        self.harvester = self.make_harvester(**self.settings)
+        self.harvester.load_folder('021097827596')
+        self.harvester.exhibitions.save()
+        self.harvester.save_data()
+        # replaying must not need the stand-in
+        self.server.stop()
+
+        # the exhibition code must come from the exhibition store
+        os.remove(os.path.join(self.tmp_dir, 'cache', 'exh_1.json'))
+
+    def test_replay_matches_harvest(self):
+        replayer = harvest_replay.ReplayHarvester(self.settings)
+        uuids = replayer.harvested_objects(self.settings['harvest_file'])
+        self.assertEqual(len(uuids), 36)
+
+        replayer.replay(uuids, processes=2)
+        for key, image_data in replayer.data.items():
+            replayer.add_folders(key, image_data)
+        self.assertEqual(replayer.data, self.harvester.data)
+        self.assertEqual(replayer.stats.counts, {'objects': 36})
+        image = next(image for key, image in replayer.data.items()
+                     if key.startswith('uuid_00001_'))
+        self.assertEqual(image['exhibitions'][0].get('dimu_code'),
+                         '0123456789')
+
+    def test_replay_keeps_updated(self):
+        replayer = harvest_replay.ReplayHarvester(self.settings)
+        replayer.replay(replayer.cached_objects(), processes=1)
+        self.assertEqual(len(replayer.data), 72)
+        self.assertEqual(
+            set(image.get('updated') for image in replayer.data.values()),
+            {'2020-01-01T00:00:00Z'})
+
+    def test_replay_cached_objects(self):
+        log = harvest_replay.LogCollector()
+        replayer = harvest_replay.ReplayHarvester(self.settings, log=log)
+        uuids = replayer.cached_objects()
+        self.assertEqual(len(uuids), 36)
+
+        replayer.replay(uuids + ['uuid_99999'], processes=1)
+        self.assertEqual(len(replayer.data), 72)
+        self.assertEqual(replayer.stats.counts,
+                         {'objects': 36, 'failed_objects': 1})
+        self.assertEqual(log.take(), ['uuid_99999: not in the local cache'])
+
+    def test_load_objects(self):
+        objects = harvest_replay.load_objects(self.settings['harvest_file'])
+        self.assertEqual(len(objects), 36)
+        self.assertEqual(objects['uuid_00001'], [FOLDER_UUID])
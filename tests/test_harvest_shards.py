@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import json
+import os
+import unittest
+
+import pywikibot
+
+from importer import DiMuHarvester, harvest_io, harvest_shards
+from tests.factories import StandinHarvestTestCase
+
+
+class TestShards(unittest.TestCase):
+
+    def test_parse_shard(self):
+        self.assertEqual(harvest_shards.parse_shard('1/4'), (1, 4))
+        self.assertEqual(harvest_shards.parse_shard([0, 2]), (0, 2))
+        self.assertIsNone(harvest_shards.parse_shard(None))
+        for value in ('4/4', '-1/4', '1', 'a/b'):
+            with self.assertRaises(ValueError):
+                harvest_shards.parse_shard(value)
+
+    def test_every_object_in_one_shard(self):
+        uuids = ['uuid_{:05d}'.format(i) for i in range(300)]
+        shards = [[uuid for uuid in uuids
+                   if harvest_shards.in_shard(uuid, (index, 3))]
+                  for index in range(3)]
+        self.assertEqual(sorted(sum(shards, [])), uuids)
+        self.assertTrue(all(len(shard) > 50 for shard in shards))
+        self.assertEqual(harvest_shards.shard_of('uuid_00001', 3),
+                         harvest_shards.shard_of('uuid_00001', 3))
+
+    def test_shard_path(self):
+        self.assertEqual(
+            harvest_shards.shard_path('dimu_harvest_data.jsonl', (0, 4)),
+            'dimu_harvest_data.shard-0-of-4.jsonl')
+        self.assertEqual(harvest_shards.shard_path('cache', (3, 4)),
+                         'cache.shard-3-of-4')
+        self.assertEqual(
+            harvest_shards.shard_files('harvest.json', 2),
+            ['harvest.shard-0-of-2.json', 'harvest.shard-1-of-2.json'])
+
+    def test_shard_settings(self):
+        options = {'shard': '1/2', 'harvest_file': 'harvest.json',
+                   'harvest_log_file': 'harvest.log',
+                   'cache_backend': 'sqlite', 'cache_path': None}
+        DiMuHarvester.shard_settings(options)
+        self.assertEqual(options['harvest_file'], 'harvest.shard-1-of-2.json')
+        self.assertEqual(options['harvest_log_file'],
+                         'harvest.shard-1-of-2.log')
+        self.assertEqual(options['cache_path'], 'cache.shard-1-of-2.sqlite')
+
+
+class TestShardedHarvest(StandinHarvestTestCase):
+
+    num_objects = 60
+
+    def setUp(self):
+        super(TestShardedHarvest, self).setUp()
+        # an object with 12 slides, whose keys do not sort in slide order
+        self.data.artifacts['uuid_00001']['media']['pictures'] = [
+            {'identifier': 'media_{}'.format(index), 'index': index}
+            for index in range(1, 13)]
+
+    def harvest(self, filename, shard=None):
+        """Harvest the folder, returning the harvester."""
+        settings = {'harvest_file': filename, 'shard': shard,
+                    'cache_path': os.path.join(self.tmp_dir, 'cache')}
+        if shard:
+            DiMuHarvester.shard_settings(settings)
+        harvester = self.make_harvester(**settings)
+        harvester.load_folder('021097827596')
+        harvester.save_data()
+        harvester.journal.remove()
+        return harvester
+
+    def check_merge(self, suffix, normalised=False):
+        filename = os.path.join(self.tmp_dir, 'harvest' + suffix)
+        self.harvest(filename)
+
+        harvesters = [self.harvest(filename, shard='{}/3'.format(index))
+                      for index in range(3)]
+        self.assertEqual(
+            sum(h.stats.counts['objects'] for h in harvesters), 54)
+        self.assertEqual(harvesters[0].stats.counts['other_shards'], 54 - (
+            harvesters[0].stats.counts['objects']))
+
+        merged = os.path.join(self.tmp_dir, 'merged' + suffix)
+        num_entries = harvest_shards.merge_shards(
+            harvest_shards.shard_files(filename, 3), merged, normalised,
+            count=3)
+        self.assertEqual(num_entries, 118)
+        return filename, merged
+
+    def test_merge_matches_single_harvest(self):
+        filename, merged = self.check_merge('.json')
+        with open(filename) as f, open(merged) as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_merge_jsonl_matches_single_harvest(self):
+        filename, merged = self.check_merge('.jsonl')
+        with open(filename) as f, open(merged) as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_merge_keeps_slide_order(self):
+        slides = ['uuid_00001_{}'.format(index) for index in range(1, 13)]
+        for suffix in ('.json', '.jsonl'):
+            filename, merged = self.check_merge(suffix)
+            keys = [key for key, entry in harvest_io.iter_harvest_data(merged)
+                    if key.startswith('uuid_00001_')]
+            self.assertEqual(keys, slides)
+
+    def test_merge_normalised(self):
+        filename, merged = self.check_merge('.jsonl', normalised=True)
+        self.assertEqual(
+            list(harvest_io.iter_harvest_data(merged)),
+            list(harvest_io.iter_harvest_data(filename)))
+
+    def test_merge_rejects_bad_shards(self):
+        filename = os.path.join(self.tmp_dir, 'harvest.json')
+        self.harvest(filename, shard='0/2')
+        in_files = harvest_shards.shard_files(filename, 2)
+        merged = os.path.join(self.tmp_dir, 'merged.json')
+
+        with self.assertRaisesRegex(pywikibot.Error, 'Missing'):
+            harvest_shards.merge_shards(in_files, merged, count=2)
+        with self.assertRaisesRegex(pywikibot.Error, 'more than one'):
+            harvest_shards.merge_shards([in_files[0]] * 2, merged)
+        with self.assertRaisesRegex(pywikibot.Error, 'does not belong'):
+            harvest_shards.merge_shards(in_files[:1], merged, count=3)
+
+        with open(in_files[0]) as f:
+            self.assertTrue(json.load(f))
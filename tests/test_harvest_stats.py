@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import json
+import os
+import unittest
+from collections import Counter
+
+from importer import harvest_stats
+from tests.factories import StandinHarvestTestCase
+
+
+class TestHarvestStats(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(harvest_stats.percentile(values, 50), 50)
+        self.assertEqual(harvest_stats.percentile(values, 95), 95)
+        self.assertEqual(harvest_stats.percentile([3], 99), 3)
+        self.assertIsNone(harvest_stats.percentile([], 50))
+
+    def test_stage_report(self):
+        stats = harvest_stats.HarvestStats()
+        for duration in (0.1, 0.3, 0.2):
+            stats.add('parse', duration)
+        with stats.timer('save'):
+            pass
+        report = stats.stage_report('parse')
+        self.assertEqual(report['count'], 3)
+        self.assertAlmostEqual(report['total'], 0.6)
+        self.assertEqual(report['p50'], 0.2)
+        self.assertEqual(report['max'], 0.3)
+        self.assertEqual(stats.stage_report('save')['count'], 1)
+
+    def test_report(self):
+        stats = harvest_stats.HarvestStats()
+        stats.count('objects', 10)
+        report = stats.report(images=20)
+        self.assertEqual(report['counts'], {'objects': 10})
+        self.assertEqual(report['images'], 20)
+        self.assertGreater(report['objects_per_second'], 0)
+
+    def test_ratios(self):
+        self.assertEqual(
+            harvest_stats.ratios(Counter(hit=3, fetched=1)),
+            {'counts': {'hit': 3, 'fetched': 1},
+             'ratios': {'hit': 0.75, 'fetched': 0.25}})
+        self.assertEqual(harvest_stats.ratios(Counter()),
+                         {'counts': {}, 'ratios': {}})
+
+    def test_unknown_keys(self):
+        unknown_keys = harvest_stats.UnknownKeys()
+        unknown_keys.add('names', 'uuid_1')
+        unknown_keys.add('names', 'uuid_2')
+        unknown_keys.update({'names': (3, 'uuid_3'),
+                             'coordinates': (1, 'uuid_4')})
+        self.assertEqual(unknown_keys.report(), [
+            ('coordinates', 1, 'uuid_4'), ('names', 5, 'uuid_1')])
+
+        tally = unknown_keys.take()
+        self.assertEqual(tally, {'names': (5, 'uuid_1'),
+                                 'coordinates': (1, 'uuid_4')})
+        self.assertEqual(unknown_keys.report(), [])
+
+
+class TestHarvesterStats(StandinHarvestTestCase):
+
+    def test_write_stats(self):
+        log_file = os.path.join(self.tmp_dir, 'dimu_harvest.log')
+        stats_harvester = self.make_harvester(harvest_log_file=log_file)
+        stats_harvester.load_folder('021097827596')
+        stats_harvester.write_stats()
+
+        with open(os.path.join(self.tmp_dir, 'dimu_harvest.stats.json')) as f:
+            report = json.load(f)
+        self.assertEqual(report['counts']['objects'], 18)
+        self.assertEqual(report['images'], 36)
+        self.assertEqual(report['stages']['parse']['count'], 18)
+        self.assertEqual(report['stages']['artifact_request']['count'], 18)
+        self.assertEqual(report['stages']['search_page']['count'], 2)
+        self.assertEqual(report['cache']['counts'], {'fetched': 18})
+        host = '127.0.0.1:{}'.format(self.server.server_address[1])
+        self.assertGreater(report['hosts'][host]['counts']['bytes'], 0)
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import unittest
+
+import requests
+
+import mock
+from importer import http_client
+
+
+class TestHarvestSession(unittest.TestCase):
+
+    def test_harvest_session_defaults(self):
+        session = http_client.HarvestSession()
+        adapter = session.get_adapter('http://api.dimu.org')
+        self.assertEqual(session.timeout, http_client.DEFAULT_TIMEOUT)
+        self.assertEqual(adapter._pool_maxsize, http_client.DEFAULT_POOL_SIZE)
+        self.assertEqual(
+            adapter.max_retries.total, http_client.DEFAULT_RETRIES)
+        self.assertTrue(adapter.max_retries.respect_retry_after_header)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+
+    def test_harvest_session_settings(self):
+        session = http_client.HarvestSession(
+            pool_size=3, timeout=7, retries=0, backoff=2)
+        adapter = session.get_adapter('https://dms01.dimu.org')
+        self.assertEqual(session.timeout, 7)
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(adapter.max_retries.total, 0)
+        self.assertEqual(adapter.max_retries.backoff_factor, 2)
+
+    def test_harvest_session_request_timeout(self):
+        session = http_client.HarvestSession(timeout=7)
+        with mock.patch.object(requests.Session, 'request') as mock_request:
+            session.get('http://api.dimu.org')
+            session.get('http://api.dimu.org', timeout=1)
+        self.assertEqual(mock_request.call_args_list[0][1]['timeout'], 7)
+        self.assertEqual(mock_request.call_args_list[1][1]['timeout'], 1)
+
+
+class TestConfigure(unittest.TestCase):
+
+    def tearDown(self):
+        http_client._session = None
+
+    def test_get_session_is_shared(self):
+        http_client._session = None
+        self.assertIs(http_client.get_session(), http_client.get_session())
+
+    def test_configure_replaces_session(self):
+        old_session = http_client.get_session()
+        new_session = http_client.configure(pool_size=2)
+        self.assertIsNot(old_session, new_session)
+        self.assertIs(http_client.get_session(), new_session)
+        self.assertEqual(new_session.pool_size, 2)
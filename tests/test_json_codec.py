@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from importer import harvest_io, json_codec
+
+
+class TestJsonCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {'b': [1, 2.5, None], 'a': {'title': 'Vid Storsjön'}}
+
+    def test_roundtrip(self):
+        self.assertEqual(json_codec.loads(json_codec.dumps(self.data)),
+                         self.data)
+        self.assertEqual(json_codec.loads(json_codec.dumpb(self.data)),
+                         self.data)
+
+    def test_dumps_sort_keys(self):
+        self.assertLess(json_codec.dumps(self.data, sort_keys=True).index('a'),
+                        json_codec.dumps(self.data, sort_keys=True).index('b'))
+
+    def test_dumps_tuples_and_non_str_keys(self):
+        self.assertEqual(
+            json_codec.loads(json_codec.dumps({1: ('S-NM', 'NMA.1')})),
+            {'1': ['S-NM', 'NMA.1']})
+
+    def test_standard_library_fallback(self):
+        with mock.patch('importer.json_codec.orjson', None):
+            self.assertEqual(
+                json_codec.dumps(self.data, sort_keys=True),
+                '{"a": {"title": "Vid Storsjön"}, "b": [1, 2.5, null]}')
+            self.assertEqual(
+                json_codec.loads('{"title": "Vid Storsjön"}'.encode('utf-8')),
+                {'title': 'Vid Storsjön'})
+
+    def test_harvest_file_independent_of_codec(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        outputs = []
+        for orjson in (json_codec.orjson, None):
+            filename = os.path.join(tmp_dir, 'harvest.jsonl')
+            with mock.patch('importer.json_codec.orjson', orjson):
+                writer = harvest_io.JsonlHarvestWriter(filename, run_size=1)
+                writer['key_2'] = {'glam_id': [('S-NM', '2')], 'title': 'ö'}
+                writer['key_1'] = {'glam_id': [('S-NM', '1')]}
+                writer.save(lambda entry: entry.get('glam_id'))
+            with open(filename, 'rb') as f:
+                outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1])
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from importer import near_duplicates
+
+
+class TestHashes(unittest.TestCase):
+
+    def test_hash_pixels(self):
+        # a gradient growing darker to the right sets every bit
+        row = [90, 80, 70, 60, 50, 40, 30, 20, 10]
+        self.assertEqual(near_duplicates.hash_pixels(row * 8), 2 ** 64 - 1)
+        self.assertEqual(near_duplicates.hash_pixels(row[::-1] * 8), 0)
+        self.assertEqual(
+            near_duplicates.hash_pixels([1, 0, 0, 1, 0, 1], size=2),
+            0b1010)
+
+    def test_hamming(self):
+        self.assertEqual(near_duplicates.hamming(0b1011, 0b0001), 2)
+        self.assertEqual(near_duplicates.hamming(7, 7), 0)
+
+    def test_bk_tree_matches_brute_force(self):
+        rnd = random.Random(1)
+        base = [rnd.getrandbits(64) for i in range(20)]
+        hashes = {}
+        for i in range(500):
+            phash = base[i % 20]
+            for bit in rnd.sample(range(64), rnd.randint(0, 10)):
+                phash ^= 1 << bit
+            hashes['media_{}'.format(i)] = phash
+
+        tree = near_duplicates.BKTree()
+        for media_id, phash in hashes.items():
+            tree.add(phash, media_id)
+        for phash in base[:5]:
+            expected = sorted(
+                (near_duplicates.hamming(phash, other), media_id)
+                for media_id, other in hashes.items()
+                if near_duplicates.hamming(phash, other) <= 6)
+            self.assertEqual(tree.search(phash, 6), expected)
+        self.assertEqual(near_duplicates.BKTree().search(0, 6), [])
+
+    def test_find_groups(self):
+        hashes = {'a': 0b0, 'b': 0b11, 'c': 0b1111, 'd': 2 ** 40 - 1,
+                  'e': 2 ** 40 - 1, 'f': 2 ** 64 - 2 ** 40}
+        self.assertEqual(
+            near_duplicates.find_groups(hashes, max_distance=2),
+            [['a', 'b', 'c'], ['d', 'e']])
+        # only groups holding images of the batch
+        self.assertEqual(
+            near_duplicates.find_groups(hashes, ['e', 'f'], max_distance=2),
+            [['d', 'e']])
+
+
+class TestHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.index = near_duplicates.HashIndex(
+            os.path.join(self.tmp_dir, 'index.sqlite'))
+        self.addCleanup(self.index.close)
+
+    def write_manifest(self, entries):
+        with open(os.path.join(self.tmp_dir, 'manifest.jsonl'), 'w') as f:
+            for media_id, sha1 in entries:
+                f.write(json.dumps({'media_id': media_id, 'sha1': sha1,
+                                    'file': media_id + '.jpg'}) + '\n')
+
+    def test_only_new_and_changed_images_are_pending(self):
+        self.index.add([('021', 'sha1_a', 2 ** 64 - 1), ('022', 'sha1_b', 5)])
+        self.assertEqual(self.index.entries(), {
+            '021': ('sha1_a', 2 ** 64 - 1), '022': ('sha1_b', 5)})
+
+        self.write_manifest(
+            [('021', 'sha1_a'), ('022', 'sha1_changed'), ('023', 'sha1_c')])
+        staged = near_duplicates.originals.read_manifest(self.tmp_dir)
+        self.assertEqual(
+            near_duplicates.pending_images(self.index.entries(), staged),
+            ['022', '023'])
+
+    def test_update_index_reuses_hashes(self):
+        self.index.add([('021', 'sha1_a', 1), ('022', 'sha1_b', 2)])
+        self.write_manifest([('021', 'sha1_a'), ('022', 'sha1_b')])
+        self.assertEqual(
+            near_duplicates.update_index(self.index, self.tmp_dir),
+            {'reused': 2})
+        self.assertEqual(
+            near_duplicates.update_index(self.index, self.tmp_dir, ['022']),
+            {'reused': 1})
+
+    @unittest.skipUnless(near_duplicates.Image, 'requires Pillow')
+    def test_update_index_hashes_images(self):
+        # a gradient from left to right, a more compressed copy of it and
+        # its mirror image
+        image = near_duplicates.Image.linear_gradient('L').rotate(90).resize(
+            (300, 200))
+        image.save(os.path.join(self.tmp_dir, '021.jpg'), quality=90)
+        image.save(os.path.join(self.tmp_dir, '022.jpg'), quality=40)
+        image.transpose(near_duplicates.Image.FLIP_LEFT_RIGHT).save(
+            os.path.join(self.tmp_dir, '023.jpg'))
+        with open(os.path.join(self.tmp_dir, '024.jpg'), 'w') as f:
+            f.write('not an image')
+        self.write_manifest([('021', 'a'), ('022', 'b'), ('023', 'c'),
+                             ('024', 'd')])
+
+        self.assertEqual(
+            near_duplicates.update_index(self.index, self.tmp_dir, None, 2),
+            {'hashed': 3, 'failed': 1, 'reused': 0})
+        hashes = {media_id: phash for media_id, (sha1, phash)
+                  in self.index.entries().items()}
+        self.assertEqual(near_duplicates.find_groups(hashes),
+                         [['021', '022']])
+
+    def test_load_groups(self):
+        filename = os.path.join(self.tmp_dir, 'groups.json')
+        with open(filename, 'w') as f:
+            json.dump({'max_distance': 6,
+                       'groups': [['021', '022', '023'], ['031', '032']]}, f)
+        groups = near_duplicates.load_groups(filename)
+        self.assertEqual(groups['022'], ['021', '023'])
+        self.assertEqual(groups['032'], ['031'])
+        self.assertNotIn('041', groups)
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from importer import dimu_standin, originals
+from tests.factories import make_image
+
+
+class TestOriginalsDownloader(unittest.TestCase):
+
+    def setUp(self):
+        # silence output
+        output_patcher = mock.patch('importer.originals.pywikibot.output')
+        output_patcher.start()
+        self.addCleanup(output_patcher.stop)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.images = {'021{:09d}'.format(i): make_image(str(i))
+                       for i in range(5)}
+        self.server = dimu_standin.StandinServer(
+            dimu_standin.StandinData(images=self.images)).start()
+        self.addCleanup(self.server.stop)
+        self.log = mock.MagicMock()
+
+    def make_downloader(self):
+        downloader = originals.OriginalsDownloader(
+            self.tmp_dir, workers=3, server=self.server.url, log=self.log)
+        self.addCleanup(downloader.close)
+        return downloader
+
+    def assert_downloaded(self, downloader, media_id):
+        entry = downloader.manifest.get(media_id)
+        image = self.images[media_id]
+        self.assertEqual(entry['file'], media_id + '.jpg')
+        self.assertEqual(entry['size'], len(image))
+        self.assertEqual(entry['sha1'], hashlib.sha1(image).hexdigest())
+        with open(downloader.manifest.path(media_id), 'rb') as f:
+            self.assertEqual(f.read(), image)
+
+    def test_original_url(self):
+        self.assertEqual(
+            originals.original_url('021234'),
+            'http://dms01.dimu.org/image/021234?dimension=max'
+            '&filename=021234.jpg')
+
+    def test_download_all(self):
+        downloader = self.make_downloader()
+        outcomes = downloader.download_all(
+            list(self.images) + ['unknown', list(self.images)[0]])
+        self.assertEqual(outcomes, {'downloaded': 5, 'failed': 1})
+        for media_id in self.images:
+            self.assert_downloaded(downloader, media_id)
+        self.assertIn('unknown: download failed',
+                      self.log.write.call_args[0][0])
+        downloader.close()
+
+        # a new run only downloads what is missing from the manifest
+        os.remove(os.path.join(self.tmp_dir, list(self.images)[1] + '.jpg'))
+        downloader = self.make_downloader()
+        self.assertEqual(downloader.download_all(self.images),
+                         {'downloaded': 1, 'skipped': 4})
+        self.assertEqual(len(downloader.manifest.entries), 5)
+
+    def test_resume_partial_download(self):
+        media_id = list(self.images)[0]
+        with open(os.path.join(self.tmp_dir, media_id + '.part'), 'wb') as f:
+            f.write(self.images[media_id][:100000])
+        downloader = self.make_downloader()
+        self.assertEqual(downloader.download(media_id), 'resumed')
+        self.assertEqual(self.server.counts['ranges'], 1)
+        self.assert_downloaded(downloader, media_id)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp_dir, media_id + '.part')))
+
+    def test_restart_if_range_ignored(self):
+        self.server.ranges = False
+        media_id = list(self.images)[0]
+        with open(os.path.join(self.tmp_dir, media_id + '.part'), 'wb') as f:
+            f.write(self.images[media_id][:100000])
+        downloader = self.make_downloader()
+        self.assertEqual(downloader.download(media_id), 'downloaded')
+        self.assert_downloaded(downloader, media_id)
+
+    def test_restart_if_partial_too_large(self):
+        media_id = list(self.images)[0]
+        with open(os.path.join(self.tmp_dir, media_id + '.part'), 'wb') as f:
+            f.write(b'x' * 400000)
+        downloader = self.make_downloader()
+        self.assertEqual(downloader.download(media_id), 'downloaded')
+        self.assert_downloaded(downloader, media_id)
+
+    def test_manifest_drops_partial_line(self):
+        media_ids = list(self.images)[:2]
+        downloader = self.make_downloader()
+        downloader.download_all(media_ids)
+        downloader.close()
+        with open(os.path.join(self.tmp_dir, 'manifest.jsonl'), 'a') as f:
+            f.write('{"media_id": "02')
+
+        manifest = originals.Manifest(self.tmp_dir)
+        self.addCleanup(manifest.close)
+        # entries are in the order the downloads finished
+        self.assertEqual(sorted(manifest.entries), sorted(media_ids))
+
+    def test_harvest_media_ids(self):
+        filename = os.path.join(self.tmp_dir, 'harvest.json')
+        with open(filename, 'w') as f:
+            json.dump({'uuid_1_0': {'media_id': '021'},
+                       'uuid_1_1': {'media_id': '022'},
+                       'uuid_2_0': {'media_id': '021'}}, f)
+        self.assertEqual(
+            sorted(originals.harvest_media_ids(filename)), ['021', '022'])
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import json
+import os
+
+import mock
+
+from importer import parse_benchmark
+from tests.factories import HarvesterTestCase, make_artifact
+
+
+class TestParseBenchmark(HarvesterTestCase):
+
+    def test_run_benchmark(self):
+        artifact = make_artifact('uuid_1')
+        thing = make_artifact('uuid_2')
+        thing['artifactType'] = 'Thing'
+        options = dict(parse_benchmark.DEFAULT_OPTIONS, rounds=1, repeat=1)
+        result = parse_benchmark.run_benchmark([artifact, thing], options)
+        self.assertEqual(list(result['types']),
+                         ['all', 'Photograph', 'Thing'])
+        self.assertEqual(result['types']['all']['objects'], 2)
+        self.assertGreater(result['types']['Thing']['seconds'], 0)
+        self.assertIn('Thing (1 objects)',
+                      parse_benchmark.format_result(result))
+
+    def test_main_writes_output(self):
+        artifact_file = os.path.join(self.tmp_dir, 'artifact.json')
+        with open(artifact_file, 'w', encoding='utf-8') as f:
+            json.dump(make_artifact('uuid_1'), f)
+        output = os.path.join(self.tmp_dir, 'result.json')
+        self.patch('importer.parse_benchmark.pywikibot.handle_args',
+                   side_effect=lambda args: args)
+        self.patch('importer.parse_benchmark.pywikibot.output')
+
+        parse_benchmark.main('-artifacts:' + artifact_file, '-rounds:1',
+                             '-repeat:1', '-output:' + output)
+        with open(output, encoding='utf-8') as f:
+            saved = json.load(f)
+        self.assertEqual(saved['result']['types']['all']['objects'], 1)
+
+    @mock.patch('importer.parse_benchmark.pywikibot.handle_args',
+                side_effect=lambda args: args)
+    def test_handle_args(self, mock_handle_args):
+        options = parse_benchmark.handle_args(
+            ['-artifacts:cache', '-rounds:3', '-repeat:2'])
+        self.assertEqual(options['artifacts'], 'cache')
+        self.assertEqual(options['rounds'], 3)
+        self.assertEqual(options['repeat'], 2)
+        self.assertIsNone(parse_benchmark.handle_args(['-unknown:1']))
+        # the artifacts are required
+        self.assertIsNone(parse_benchmark.handle_args(['-rounds:3']))
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import threading
+import time
+import unittest
+
+import mock
+from importer import http_client, rate_limit
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_acquire_unlimited(self):
+        bucket = rate_limit.TokenBucket(None)
+        for i in range(100):
+            self.assertEqual(bucket.acquire(), 0)
+
+    def test_acquire_rate(self):
+        bucket = rate_limit.TokenBucket(50, burst=1)
+        start = time.monotonic()
+        for i in range(6):
+            bucket.acquire()
+        # the first token is there from the start, the rest take 1/50s each
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class TestHostLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = rate_limit.HostLimiter('api.dimu.org', None, 8)
+
+    def test_release_throttled_decreases(self):
+        self.limiter.acquire()
+        self.limiter.release(latency=0.1, statuses=[200, 429])
+        self.assertEqual(self.limiter.limit, 4)
+        self.assertEqual(self.limiter.counts['throttled'], 1)
+
+        # a burst of throttled responses only halves the limit once
+        self.limiter.acquire()
+        self.limiter.release(latency=0.1, statuses=[503])
+        self.assertEqual(self.limiter.limit, 4)
+
+    def test_release_increases(self):
+        self.limiter.limit = 2
+        for i in range(4):
+            self.limiter.acquire()
+            self.limiter.release(latency=0.1, statuses=[200])
+        self.assertGreater(self.limiter.limit, 3)
+
+        for i in range(100):
+            self.limiter.acquire()
+            self.limiter.release(latency=0.1, statuses=[200])
+        self.assertEqual(self.limiter.limit, 8)
+
+    def test_release_slow_decreases(self):
+        for i in range(5):
+            self.limiter.acquire()
+            self.limiter.release(latency=0.1, statuses=[200])
+        for i in range(5):
+            self.limiter.acquire()
+            self.limiter.release(latency=2.0, statuses=[200])
+        self.assertEqual(self.limiter.limit, 4)
+        self.assertGreater(self.limiter.counts['slow'], 0)
+
+    def test_acquire_respects_limit(self):
+        self.limiter.limit = 2
+        self.limiter.acquire()
+        self.limiter.acquire()
+        third = threading.Thread(target=self.limiter.acquire)
+        third.start()
+        third.join(0.1)
+        self.assertTrue(third.is_alive())
+        self.limiter.release(latency=0.1)
+        third.join(1)
+        self.assertFalse(third.is_alive())
+        self.assertEqual(self.limiter.in_flight, 2)
+
+    def test_report(self):
+        self.limiter.acquire()
+        self.limiter.release(failed=True)
+        self.assertEqual(
+            self.limiter.report(),
+            'api.dimu.org: 1 requests, 0 throttled, 0 slow, 1 failed; '
+            'rate limit none; concurrency limit 4 (lowest 4, max 8); '
+            'waited 0.0s')
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_get_per_host_rate(self):
+        limiter = rate_limit.RateLimiter({'dms01.dimu.org': 2}, 5)
+        self.assertEqual(limiter.get('dms01.dimu.org').bucket.rate, 2)
+        self.assertIsNone(limiter.get('api.dimu.org').bucket.rate)
+        self.assertIs(limiter.get('api.dimu.org'),
+                      limiter.get('api.dimu.org'))
+        self.assertEqual(limiter.get('api.dimu.org').max_concurrency, 5)
+
+
+class TestResponseStatuses(unittest.TestCase):
+
+    def test_response_statuses_with_retries(self):
+        response = mock.Mock(status_code=200)
+        response.raw.retries.history = [
+            mock.Mock(status=429), mock.Mock(status=None)]
+        self.assertEqual(http_client.response_statuses(response), [200, 429])
+
+    def test_response_statuses_no_retries(self):
+        response = mock.Mock(status_code=404)
+        response.raw.retries = None
+        self.assertEqual(http_client.response_statuses(response), [404])
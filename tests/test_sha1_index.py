@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from importer import dimu_standin, originals, sha1_index
+from tests.factories import make_image
+
+
+def base36(sha1):
+    """Return a hex SHA-1 in the base 36 used by MediaWiki."""
+    value = int(sha1, 16)
+    digits = ''
+    while value:
+        value, digit = divmod(value, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[digit] + digits
+    return digits.rjust(31, '0')
+
+
+class TestSha1Index(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.index = sha1_index.Sha1Index(
+            os.path.join(self.tmp_dir, 'index.sqlite'))
+        self.addCleanup(self.index.close)
+        self.sha1s = [hashlib.sha1(str(i).encode('utf-8')).hexdigest()
+                      for i in range(1200)]
+
+    def test_normalise_sha1(self):
+        sha1 = self.sha1s[0]
+        self.assertEqual(sha1_index.normalise_sha1(sha1.upper()), sha1)
+        self.assertEqual(sha1_index.normalise_sha1(base36(sha1)), sha1)
+        with self.assertRaises(ValueError):
+            sha1_index.normalise_sha1('not a sha1')
+
+    def test_add_and_lookup(self):
+        self.index.add(
+            [(sha1, 'Image_{}.jpg'.format(i))
+             for i, sha1 in enumerate(self.sha1s[:1000])], 'snapshot')
+        self.assertEqual(len(self.index), 1000)
+
+        found = self.index.lookup(self.sha1s)
+        self.assertEqual(len(found), 1000)
+        self.assertEqual(found[self.sha1s[999]], 'File:Image 999.jpg')
+
+    def test_load_snapshot(self):
+        filename = os.path.join(self.tmp_dir, 'snapshot.tsv')
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write('sha1\ttitle\n')
+            f.write('{}\tSjö_1.jpg\n'.format(base36(self.sha1s[0])))
+            f.write('{}\tFile:Sjö 2.jpg\n'.format(self.sha1s[1]))
+            f.write('\n')
+        self.assertEqual(sha1_index.load_snapshot(self.index, filename), 2)
+        self.assertEqual(self.index.lookup(self.sha1s[:3]), {
+            self.sha1s[0]: 'File:Sjö 1.jpg',
+            self.sha1s[1]: 'File:Sjö 2.jpg'})
+
+
+class TestKnownFiles(unittest.TestCase):
+
+    def setUp(self):
+        # silence output
+        output_patcher = mock.patch('importer.originals.pywikibot.output')
+        output_patcher.start()
+        self.addCleanup(output_patcher.stop)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.index = sha1_index.Sha1Index(
+            os.path.join(self.tmp_dir, 'index.sqlite'))
+        self.addCleanup(self.index.close)
+
+        # stage four originals, of which the first two are on Commons
+        images = {'021{:09d}'.format(i): make_image(str(i), 1000)
+                  for i in range(4)}
+        self.media_ids = sorted(images)
+        self.sha1s = [hashlib.sha1(images[media_id]).hexdigest()
+                      for media_id in self.media_ids]
+        self.server = dimu_standin.StandinServer(dimu_standin.StandinData(
+            images=images,
+            commons_files={self.sha1s[0]: 'File:Old upload.jpg',
+                           self.sha1s[1]: 'File:Other name.jpg'})).start()
+        self.addCleanup(self.server.stop)
+        self.staging_dir = os.path.join(self.tmp_dir, 'originals')
+        downloader = originals.OriginalsDownloader(
+            self.staging_dir, server=self.server.url)
+        downloader.download_all(self.media_ids)
+        downloader.close()
+        self.api_url = '{}/w/api.php'.format(self.server.url)
+
+        # the batch uses the urls of the real image server
+        self.batch = {
+            originals.original_url(media_id): {
+                'filename': 'Image {}'.format(i), 'info': '', 'cats': [],
+                'meta_cats': []}
+            for i, media_id in enumerate(self.media_ids)}
+        self.batch_file = os.path.join(self.tmp_dir, 'batch.json')
+        with open(self.batch_file, 'w') as f:
+            json.dump(self.batch, f)
+
+    def test_known_files_uses_index_then_api(self):
+        self.index.add([(self.sha1s[1], 'Other name.jpg')], 'snapshot')
+        self.assertEqual(
+            sha1_index.known_files(self.index, self.sha1s),
+            {self.sha1s[1]: 'File:Other name.jpg'})
+
+        requests_before = self.server.counts['requests']
+        found = sha1_index.known_files(self.index, self.sha1s, self.api_url)
+        self.assertEqual(found, {self.sha1s[0]: 'File:Old upload.jpg',
+                                 self.sha1s[1]: 'File:Other name.jpg'})
+        # only the three files missing from the index were looked up
+        self.assertEqual(self.server.counts['requests'] - requests_before, 3)
+        self.assertEqual(len(self.index), 2)
+
+    def test_record_uploads(self):
+        self.assertEqual(sha1_index.record_uploads(
+            self.index, self.batch_file, self.staging_dir), 4)
+        self.assertEqual(self.index.lookup(self.sha1s[2:3]),
+                         {self.sha1s[2]: 'File:Image 2.jpg'})
+
+    def test_filter_batch(self):
+        filtered, dropped = sha1_index.filter_batch(
+            self.batch, self.index, self.staging_dir, self.api_url)
+        self.assertEqual(sorted(filtered), sorted(
+            originals.original_url(media_id)
+            for media_id in self.media_ids[2:]))
+        self.assertEqual(
+            dropped[originals.original_url(self.media_ids[0])],
+            'File:Old upload.jpg')